@@ -93,21 +93,27 @@ def display_cli_help():
     Terminal.inst().message("\t --paper-mode instanciate paper mode trader and simulate as best as possible.")
     Terminal.inst().message("\t --backtest process a backtesting, uses paper mode traders and data history avalaible in the database.")
     Terminal.inst().message("\t --timestep=<seconds> Timestep in seconds to increment the backesting. More precise is more accurate but need more computing simulation. Adjust to at least fits to the minimal candles size uses in the backtested strategies. Default is 60 seconds.")
+    Terminal.inst().message("\t --event-clock in backtesting mode skip the timesteps having no data for any market (nights, week-ends, illiquid markets).")
     Terminal.inst().message("\t --time-factor=<factor> in backtesting mode only allow the user to change the time factor and permit to interact during the backtesting. Default speed factor is as fast as possible.")
     Terminal.inst().message("\t --check-data @todo Process a test on candles data. Check if there is inconsitencies into the time of the candles and if there is some gaps. The test is done only on the defined range of time.")
     Terminal.inst().message("\t --from=<YYYY-MM-DDThh:mm:ss> define the date time from which start the backtesting, fetcher or binarizer. If ommited use whoole data set (take care).")
     Terminal.inst().message("\t --to=<YYYY-MM-DDThh:mm:ss> define the date time to which stop the backtesting, fetcher or binarizer. If ommited use now.")
     Terminal.inst().message("\t --last=<number> Fast last number of candles for every watched market (take care can take all requests credits on the broker). By default it is configured to get 1m, 5m and 1h candles.")
-    Terminal.inst().message("\t --market=<market-id> Specific market identifier to fetch, binarize only.")
+    Terminal.inst().message("\t --market=<market-id> Specific market identifier to fetch, binarize only. A comma separated list, with *suffix wildchars and !market exclusions, for the fetcher and the binarizer.")
     Terminal.inst().message("\t --broker=<broker-name> Specific fetcher or watcher name to fetche or binarize market from.")
     Terminal.inst().message("\t --timeframe=<timeframe> Time frame unit or 0 for trade level. For fetcher, higher candles are generated. Defined value is in second or an alias in 1m 5m 15m 1h 2h 4h d m w")
     Terminal.inst().message("\t --cascaded=<max-timeframe> During fetch process generate the candles of highers timeframe from lowers. Default is no. Take care to have entire multiple to fullfill the generated candles.")
     Terminal.inst().message("\t --spec=<specific-option> Specific fetcher option (exemple STOCK for alphavantage.co fetcher to fetch a stock market).")
     Terminal.inst().message("\t --watcher-only Only watch and save market/candles data into the database. No trade and neither paper mode trades are performed.")
     Terminal.inst().message("\t --read-only Don't write market neither candles data to the database. Default is writing to the database.")
+    Terminal.inst().message("\t --process-pool[=<number>] Compute the strategies on shard worker processes (default one per CPU) in place of threads. Trades are still managed by the main process. With --binarize the number of worker processes converting the months.")
     Terminal.inst().message("\t --tool=<tool-name> Execute a specific tool @todo.")
     Terminal.inst().message("\t --fetch Process the data fetcher.")
     Terminal.inst().message("\t --binarize Process to text file to binary conversion for a market.")
+    Terminal.inst().message("\t --compress With --binarize, also convert the binary tick files to compressed tick archives (.tcz).")
+    Terminal.inst().message("\t --optimize Process the data optimizer for a market, with --timeframe=0 the tick files are ordered, deduplicated and the gaps reported, else the ohlc gaps are rebuilt from the tick files.")
+    Terminal.inst().message("\t --gap=<seconds> With --optimize, minimal duration of a reported gap. Default is 900 seconds.")
+    Terminal.inst().message("\t --refetch With --optimize of a timeframe, fetch the ohlc gaps that cannot be rebuilt from the tick files.")
     Terminal.inst().message("\t --sync Process a synchronization of the watched market from a particular broker.")
     Terminal.inst().message("")
     Terminal.inst().message("\t During usage press ':h<ENTER>' to get interative commands help. Press ':q<ENTER>' to exit. Knows issues can lock one ore more thread, then you will need to kill the process yourself.")
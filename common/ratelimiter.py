@@ -0,0 +1,89 @@
+# @date 2019-03-23
+# @author Frederic SCHERMA
+# @license Copyright (c) 2019 Dream Overflow
+# Token bucket rate limiter
+
+import time
+import threading
+
+
+class TokenBucket(object):
+    """
+    Thread-safe token bucket, shared by the threads doing requests to a same broker.
+
+    The bucket is refilled at rate tokens per second up to its capacity, and a request of a weight blocks until
+    the bucket has enough tokens. The broker can also report the weight already used in its current window (sync),
+    or ask to retry after a delay (pause).
+
+    @note The capacity should be a fraction of the broker limit, in way to let a share to the other processes
+        (watcher, trader) using the same account or IP.
+    """
+
+    __slots__ = '_rate', '_capacity', '_tokens', '_last', '_paused_until', '_condition'
+
+    def __init__(self, rate, capacity):
+        """
+        @param rate Tokens per second.
+        @param capacity Max number of tokens (burst).
+        """
+        self._rate = float(rate)
+        self._capacity = float(capacity)
+
+        self._tokens = float(capacity)
+        self._last = time.monotonic()
+        self._paused_until = 0.0
+
+        self._condition = threading.Condition()
+
+    @property
+    def rate(self):
+        return self._rate
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    def __refill(self, now):
+        self._tokens = min(self._capacity, self._tokens + (now - self._last) * self._rate)
+        self._last = now
+
+    def acquire(self, weight=1):
+        """
+        Block until weight tokens are available and consume them.
+        """
+        weight = min(weight, self._capacity)
+
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                self.__refill(now)
+
+                delay = self._paused_until - now
+
+                if delay <= 0.0:
+                    if self._tokens >= weight:
+                        self._tokens -= weight
+                        return
+
+                    delay = (weight - self._tokens) / self._rate
+
+                self._condition.wait(delay)
+
+    def sync(self, used):
+        """
+        Reduce the available tokens according to the weight used reported by the broker for its current window.
+        """
+        with self._condition:
+            self.__refill(time.monotonic())
+            self._tokens = min(self._tokens, max(0.0, self._capacity - used))
+
+    def pause(self, delay):
+        """
+        No request during delay seconds, and then start with an empty bucket.
+        """
+        with self._condition:
+            now = time.monotonic()
+
+            self._paused_until = max(self._paused_until, now + delay)
+            self._tokens = 0.0
+            self._last = self._paused_until
@@ -46,9 +46,9 @@ class Service(Notifiable):
 	def notify(self, signal_type, source_name, signal_data):
 		pass
 
-	def add_listener(self, notifiable):
+	def add_listener(self, notifiable, all_topics=True):
 		self.lock()
-		self._notifier.add_listener(notifiable)
+		self._notifier.add_listener(notifiable, all_topics)
 		self.unlock()
 
 	def remove_listener(self, notifiable):
@@ -56,6 +56,16 @@ class Service(Notifiable):
 		self._notifier.remove_listener(notifiable)
 		self.unlock()
 
+	def subscribe(self, notifiable, source_name, signal_type, market_id, timeframe=None):
+		self.lock()
+		self._notifier.subscribe(notifiable, source_name, signal_type, market_id, timeframe)
+		self.unlock()
+
+	def unsubscribe(self, notifiable, source_name=None, signal_type=None, market_id=None):
+		self.lock()
+		self._notifier.unsubscribe(notifiable, source_name, signal_type, market_id)
+		self.unlock()
+
 	def command(self, command_type, data):
 		pass
 
@@ -71,7 +71,7 @@ def matching_symbols_set(configured_symbols, available_symbols):
     """
     if '*' in configured_symbols:
         # all instruments
-        watched_symbols = set(availables)
+        watched_symbols = set(available_symbols)
 
         # except...
         for configured_symbol in configured_symbols:
@@ -7,7 +7,9 @@ import traceback
 import threading
 import time
 import multiprocessing
+import multiprocessing.connection
 import collections
+import zlib
 
 from terminal.terminal import Terminal
 
@@ -48,6 +50,12 @@ class Worker(threading.Thread):
         self._running = False
         self._ping = False
 
+        # statistics since the last ping
+        self._num_jobs = 0
+        self._sum_latency = 0.0  # waiting time of the jobs into the queue
+        self._max_latency = 0.0
+        self._sum_exec = 0.0     # execution time of the jobs
+
     def start(self):
         if not self._running:
             self._running = True
@@ -66,17 +74,32 @@ class Worker(threading.Thread):
             self._running = False
 
     def __process_once(self):
-        count_down, job = self._pool.next_job()
+        # blocks until some jobs or a wake-up
+        jobs = self._pool.next_jobs()
+
+        for count_down, job, queued in jobs:
+            begin = time.perf_counter()
+
+            try:
+                job[0](*job[1])
+            except Exception as e:
+                # don't lose the others jobs of the batch
+                logger.error(repr(e))
+                error_logger.error(traceback.format_exc())
+            finally:
+                end = time.perf_counter()
+
+                latency = begin - queued
 
-        if job:
-            job[0](*job[1])
+                self._num_jobs += 1
+                self._sum_latency += latency
+                self._sum_exec += end - begin
 
-        if count_down:
-            count_down.done()
+                if latency > self._max_latency:
+                    self._max_latency = latency
 
-        if not job:
-            # avoid CPU usage
-            time.sleep(0.00001)
+                if count_down:
+                    count_down.done()
 
         if self._ping:
             # process the pong message
@@ -105,7 +128,22 @@ class Worker(threading.Thread):
     @property
     def uid(self):
         return self._uid
-    
+
+    def stats(self, reset=False):
+        """
+        Returns a tuple with the number of processed jobs, the sum and the max of their latency in the queue
+        and the sum of their execution time, in seconds.
+        """
+        stats = (self._num_jobs, self._sum_latency, self._max_latency, self._sum_exec)
+
+        if reset:
+            self._num_jobs = 0
+            self._sum_latency = 0.0
+            self._max_latency = 0.0
+            self._sum_exec = 0.0
+
+        return stats
+
     def ping(self):
         self._ping = True
 
@@ -114,8 +152,15 @@ class Worker(threading.Thread):
 
 
 class WorkerPool(object):
+    """
+    Pool of worker threads consuming a queue of jobs.
+    Idle workers are blocked on a condition, and each worker dequeue a batch of jobs at once.
+    """
 
-    __slots__ = '_num_workers', '_workers', '_queue', '_mutex'
+    __slots__ = '_num_workers', '_workers', '_queue', '_condition', '_last_ping'
+
+    MAX_BATCH = 16  # max number of jobs dequeued at once by a worker
+    TIMEOUT = 1.0   # max idle time before a worker check its running state
 
     def __init__(self, num_workers=None):
         if not num_workers:
@@ -125,7 +170,8 @@ class WorkerPool(object):
 
         self._workers = [Worker(self, i) for i in range(0, self._num_workers)]
         self._queue = collections.deque()
-        self._mutex = threading.RLock()
+        self._condition = threading.Condition()
+        self._last_ping = time.perf_counter()
 
     def start(self):
         for worker in self._workers:
@@ -135,27 +181,366 @@ class WorkerPool(object):
         for worker in self._workers:
             if worker._running:
                 worker.stop()
+
+        # wake-up the idle workers
+        self._condition.acquire()
+        self._condition.notify_all()
+        self._condition.release()
+
+        for worker in self._workers:
+            if worker.is_alive():
                 worker.join()
 
     def ping(self):
+        now = time.perf_counter()
+        elapsed = now - self._last_ping
+        self._last_ping = now
+
+        num_jobs = 0
+        sum_latency = 0.0
+        max_latency = 0.0
+        sum_exec = 0.0
+
         for worker in self._workers:
+            n, lat, max_lat, exe = worker.stats(True)
+
+            num_jobs += n
+            sum_latency += lat
+            sum_exec += exe
+            max_latency = max(max_latency, max_lat)
+
             worker.ping()
 
+        if num_jobs:
+            Terminal.inst().action("WorkerPool %i jobs %.2f jobs/s, latency avg %.3fms max %.3fms, execution avg %.3fms, pending %i" % (
+                num_jobs, num_jobs / elapsed if elapsed > 0 else 0.0, sum_latency * 1000.0 / num_jobs, max_latency * 1000.0,
+                sum_exec * 1000.0 / num_jobs, len(self._queue)), view='content')
+        else:
+            Terminal.inst().action("WorkerPool no jobs since the last ping, pending %i" % len(self._queue), view='content')
+
+        # wake-up the idle workers for their pong
+        self._condition.acquire()
+        self._condition.notify_all()
+        self._condition.release()
+
     def add_job(self, count_down, job):
+        self._condition.acquire()
+        self._queue.append((count_down, job, time.perf_counter()))
+        self._condition.notify()
+        self._condition.release()
+
+    def next_jobs(self):
+        """
+        Returns a batch of jobs, blocking until there is at least one or the timeout.
+        The queue is evenly shared between the workers, with at most MAX_BATCH jobs per batch.
+        """
+        self._condition.acquire()
+
+        if not self._queue:
+            self._condition.wait(WorkerPool.TIMEOUT)
+
+        n = min(max(1, len(self._queue) // self._num_workers), WorkerPool.MAX_BATCH, len(self._queue))
+        jobs = [self._queue.popleft() for i in range(0, n)]
+
+        if self._queue:
+            # let another worker takes its part
+            self._condition.notify()
+
+        self._condition.release()
+
+        return jobs
+
+    def new_count_down(self, n):
+        return CountDown(n)
+
+
+class ShardWorker(object):
+    """
+    Worker process owning a shard of the keys of a process worker pool.
+
+    The process is forked from the parent, and then it inherits of a copy of the objects of the shard,
+    the handler being in charge of the keys whose the shard is the owner.
+    Messages are received by batch from a pipe and the results are sent back by batch too.
+    """
+
+    @staticmethod
+    def run(uid, handler, initializer, conn):
+        if initializer:
+            initializer()
+
+        while True:
+            try:
+                messages = conn.recv()
+            except (EOFError, OSError):
+                break
+
+            if messages is None:
+                break
+
+            results = []
+
+            for msg_type, token, data in messages:
+                if msg_type == ProcessWorkerPool.MSG_PING:
+                    results.append((ProcessWorkerPool.MSG_PONG, token, uid))
+                    continue
+
+                try:
+                    results.append((ProcessWorkerPool.MSG_RESULT, token, handler(data)))
+                except Exception as e:
+                    results.append((ProcessWorkerPool.MSG_ERROR, token, (repr(e), traceback.format_exc())))
+
+            try:
+                conn.send(results)
+            except (EOFError, OSError):
+                break
+
+        conn.close()
+
+
+class ProcessWorkerPool(object):
+    """
+    Pool of worker processes, each of them owning a shard of the keys (generally the market identifiers).
+    Jobs are posted to the shard owning their key and then processed by the handler into the worker process,
+    the results are returned to the callback from a reader thread of the parent process.
+
+    Because the worker processes are forked they must be started once the objects of the shards are
+    ready (instruments, strategy traders), and then each one only receives the deltas of data.
+
+    @note Fork start method only, so Unix like systems only.
+    """
+
+    __slots__ = '_num_workers', '_handler', '_callback', '_initializer', '_processes', '_conns', '_buffers', \
+                '_tokens', '_shard_tokens', '_next_token', '_reader', '_running', '_mutex', '_send_mutex'
+
+    MSG_JOB = 0
+    MSG_PING = 1
+    MSG_RESULT = 2
+    MSG_PONG = 3
+    MSG_ERROR = 4
+
+    def __init__(self, handler, callback, num_workers=None, initializer=None):
+        """
+        @param handler Callable running into the worker processes, receives the data of a job and returns its result.
+        @param callback Callable of the parent process receiving the result of each job.
+        @param num_workers Number of worker processes, default to the number of CPUs.
+        @param initializer Optional callable running once into each worker process after the fork.
+        """
+        if not num_workers:
+            self._num_workers = multiprocessing.cpu_count()
+        else:
+            self._num_workers = num_workers
+
+        self._handler = handler
+        self._callback = callback
+        self._initializer = initializer
+
+        self._processes = []
+        self._conns = []
+        self._buffers = [[] for i in range(0, self._num_workers)]  # pending messages per shard
+
+        self._tokens = {}  # pending count down per job token
+        self._shard_tokens = [set() for i in range(0, self._num_workers)]  # pending job tokens per shard
+        self._next_token = 1
+
+        self._reader = None
+        self._running = False
+        self._mutex = threading.RLock()
+        self._send_mutex = threading.Lock()  # pipes are not thread-safe, but don't block the reader during a send
+
+    @property
+    def num_workers(self):
+        return self._num_workers
+
+    @property
+    def running(self):
+        return self._running
+
+    def start(self):
+        if self._running:
+            return False
+
+        context = multiprocessing.get_context('fork')
+
+        for i in range(0, self._num_workers):
+            conn, child_conn = context.Pipe()
+
+            process = context.Process(target=ShardWorker.run, args=(i, self._handler, self._initializer, child_conn), name="st-sh-%s" % i, daemon=True)
+            process.start()
+
+            # only used by the child
+            child_conn.close()
+
+            self._processes.append(process)
+            self._conns.append(conn)
+
+        self._running = True
+
+        self._reader = threading.Thread(name="st-sh-rd", target=self.__read)
+        self._reader.start()
+
+        return True
+
+    def stop(self):
+        if not self._running:
+            return
+
+        self._running = False
+
+        self._send_mutex.acquire()
+        for conn in self._conns:
+            try:
+                if conn is not None:
+                    conn.send(None)
+            except (EOFError, OSError):
+                pass
+        self._send_mutex.release()
+
+        for process in self._processes:
+            process.join(5.0)
+            if process.is_alive():
+                process.terminate()
+
+        if self._reader:
+            self._reader.join()
+            self._reader = None
+
+        for conn in self._conns:
+            if conn is not None:
+                conn.close()
+
+        self._processes = []
+        self._conns = []
+
+        # release any waiting count down
         self._mutex.acquire()
-        self._queue.append((count_down, job))
+        for token, count_down in self._tokens.items():
+            if count_down:
+                count_down.done()
+        self._tokens = {}
+        self._shard_tokens = [set() for i in range(0, self._num_workers)]
         self._mutex.release()
 
-    def next_job(self):
-        count_down = None
-        job = None
+    def ping(self):
+        self._mutex.acquire()
+        for i in range(0, self._num_workers):
+            self._buffers[i].append((ProcessWorkerPool.MSG_PING, 0, None))
+        self._mutex.release()
+
+        self.flush()
 
+    def shard(self, key):
+        """
+        Index of the worker process owning the key, stable between runs.
+        """
+        return zlib.crc32(str(key).encode('utf-8')) % self._num_workers
+
+    def add_job(self, key, count_down, data):
+        """
+        Buffer a job for the shard owning the key, sent at the next flush.
+        """
         self._mutex.acquire()
-        if len(self._queue):
-            count_down, job = self._queue.popleft()
+
+        token = self._next_token
+        self._next_token += 1
+
+        shard = self.shard(key)
+
+        self._tokens[token] = count_down
+        self._shard_tokens[shard].add(token)
+        self._buffers[shard].append((ProcessWorkerPool.MSG_JOB, token, data))
+
+        self._mutex.release()
+
+    def flush(self):
+        """
+        Send the buffered jobs, one message per shard.
+        """
+        self._mutex.acquire()
+        buffers = self._buffers
+        self._buffers = [[] for i in range(0, self._num_workers)]
         self._mutex.release()
 
-        return count_down, job
+        self._send_mutex.acquire()
+
+        for i, conn in enumerate(self._conns):
+            if buffers[i]:
+                if conn is None:
+                    # dead shard, the jobs are never processed
+                    self.__release_shard(i)
+                    continue
+
+                try:
+                    conn.send(buffers[i])
+                except (EOFError, OSError) as e:
+                    error_logger.error("ProcessWorkerPool shard %s : %s" % (i, repr(e)))
+
+        self._send_mutex.release()
 
     def new_count_down(self, n):
         return CountDown(n)
+
+    def __release_shard(self, shard):
+        """
+        Release the count down of the pending jobs of a shard, without result.
+        """
+        self._mutex.acquire()
+        tokens, self._shard_tokens[shard] = self._shard_tokens[shard], set()
+        count_downs = [self._tokens.pop(token, None) for token in tokens]
+        self._mutex.release()
+
+        for count_down in count_downs:
+            if count_down:
+                count_down.done()
+
+    def __read(self):
+        while self._running:
+            conns = [conn for conn in self._conns if conn is not None]
+            if not conns:
+                break
+
+            try:
+                ready = multiprocessing.connection.wait(conns, timeout=0.1)
+            except OSError:
+                break
+
+            for conn in ready:
+                shard = self._conns.index(conn)
+
+                try:
+                    results = conn.recv()
+                except (EOFError, OSError) as e:
+                    # the worker process is dead, forget its connection and release its pending jobs
+                    if self._running:
+                        logger.error("ProcessWorkerPool shard %s is dead" % shard)
+                        error_logger.error("ProcessWorkerPool shard %s : %s" % (shard, repr(e)))
+
+                    self._send_mutex.acquire()
+                    self._conns[shard] = None
+                    self._send_mutex.release()
+
+                    conn.close()
+                    self.__release_shard(shard)
+                    continue
+
+                for msg_type, token, data in results:
+                    if msg_type == ProcessWorkerPool.MSG_PONG:
+                        Terminal.inst().action("ProcessWorkerPool::Worker %s is alive" % data, view='content')
+                        continue
+
+                    self._mutex.acquire()
+                    count_down = self._tokens.pop(token, None)
+                    self._shard_tokens[shard].discard(token)
+                    self._mutex.release()
+
+                    try:
+                        if msg_type == ProcessWorkerPool.MSG_RESULT:
+                            self._callback(data)
+                        elif msg_type == ProcessWorkerPool.MSG_ERROR:
+                            logger.error(data[0])
+                            error_logger.error(data[1])
+                    except Exception as e:
+                        logger.error(repr(e))
+                        error_logger.error(traceback.format_exc())
+
+                    if count_down:
+                        count_down.done()
@@ -10,7 +10,13 @@ DATABASES = {
         'password': 'siis',     # user password
         'host': '127.0.0.1',    # database hostname or unix:// socket
         'port': 5432,           # database host port
-        'conn_max_age': 86400
+        'conn_max_age': 86400,
+        'batch_size': 5000,         # max rows per bulk insert
+        'flush_delay': 60,          # ohlc flush delay in seconds
+        'flush_max_pending': 500,   # or flush as soon as more ohlcs are pending
+        'ohlc_cache': True,         # local binary cache of the consolidated ohlcs into markets-path
+        'text_ticks': True,         # also write ticks in text, or a list of broker identifiers
+        'max_tick_handles': 128     # max opened tick files
     }
 }
 
@@ -74,6 +74,10 @@ class Client(object):
     AGG_BUYER_MAKES = 'm'
     AGG_BEST_MATCH = 'M'
 
+    # weight of a request for the rate limiter, any market data endpoint used by the fetcher is of weight 1
+    REQUEST_WEIGHT = 1
+    MAX_RATE_LIMIT_RETRY = 3
+
     # @todo margin/transfer, margin/loan, margin/repay, margin/order, margin/account
     # @todo margin/asset, margin/pair, margin/priceIndex, margin/openOrders, margin/allOrders, margin/myTrades
     # @todo margin/maxBorrowable, margin/maxTransferable 
@@ -95,6 +99,9 @@ class Client(object):
         self.session = self._init_session()
         self._requests_params = requests_params
 
+        # optional shared TokenBucket, one token per weight unit
+        self.rate_limiter = None
+
         # init DNS and SSL cert
         self.ping()
 
@@ -176,8 +183,23 @@ class Client(object):
             kwargs['params'] = kwargs['data']
             del(kwargs['data'])
 
-        response = getattr(self.session, method)(uri, **kwargs)
-        return self._handle_response(response)
+        for retry in range(0, self.MAX_RATE_LIMIT_RETRY+1):
+            if self.rate_limiter:
+                self.rate_limiter.acquire(self.REQUEST_WEIGHT)
+
+            response = getattr(self.session, method)(uri, **kwargs)
+
+            if self.rate_limiter:
+                if response.status_code in (418, 429) and retry < self.MAX_RATE_LIMIT_RETRY:
+                    # rate limit reached (or IP banned), wait as asked and retry
+                    self.rate_limiter.pause(float(response.headers.get('Retry-After', 60)))
+                    continue
+
+                used_weight = response.headers.get('X-MBX-USED-WEIGHT')
+                if used_weight:
+                    self.rate_limiter.sync(int(used_weight))
+
+            return self._handle_response(response)
 
     def _request_api(self, method, path, signed=False, version=PUBLIC_API_VERSION, **kwargs):
         uri = self._create_api_uri(path, signed, version)
@@ -199,8 +221,6 @@ class Client(object):
         """Internal helper for handling API responses from the Binance server.
         Raises the appropriate exceptions when necessary; otherwise, returns the
         response.
-
-        @todo X-MBX-USED-WEIGHT
         """
         if not str(response.status_code).startswith('2'):
             raise BinanceAPIException(response)
@@ -810,8 +830,8 @@ class Client(object):
             # increment next call by our timeframe
             start_ts += timeframe
 
-            # sleep after every 3rd call to be kind to the API
-            if idx % 3 == 0:
+            # sleep after every 3rd call to be kind to the API, when there is no rate limiter
+            if idx % 3 == 0 and not self.rate_limiter:
                 time.sleep(1)
 
         return output_data
@@ -891,8 +911,8 @@ class Client(object):
             # increment next call by our timeframe
             start_ts += timeframe
 
-            # sleep after every 3rd call to be kind to the API
-            if idx % 3 == 0:
+            # sleep after every 3rd call to be kind to the API, when there is no rate limiter
+            if idx % 3 == 0 and not self.rate_limiter:
                 time.sleep(1)
 
     def get_ticker(self, **params):
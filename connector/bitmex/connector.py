@@ -33,7 +33,7 @@ class Connector(object):
 
     BIN_SIZE = ('1m', '5m', '1h', '1d')
 
-    def __init__(self, service, api_key, api_secret, symbols, host="www.bitmex.com", callback=None):
+    def __init__(self, service, api_key, api_secret, symbols, host="www.bitmex.com", callback=None, order_book=False):
         self._protocol = "https://"
         self._host = host or "www.bitmex.com"
 
@@ -51,7 +51,7 @@ class Connector(object):
         self._session = None
 
         # Create websocket for streaming data
-        self._ws = BitMEXWebsocket(api_key, api_secret, callback)
+        self._ws = BitMEXWebsocket(api_key, api_secret, callback, order_book)
 
     def connect(self, use_ws=True):
         # Prepare HTTPS session
@@ -17,6 +17,8 @@ from urllib.parse import urlparse, urlunparse
 
 from decimal import Decimal
 
+from instrument.orderbook import OrderBook
+
 import logging
 logger = logging.getLogger('siis.connector.bitmex.ws')
 
@@ -53,10 +55,14 @@ class BitMEXWebsocket():
 	MAX_TABLE_LEN = 200  # Don't grow a table larger than this amount. Helps cap memory usage.
 	PREFERED_ORDER_BOOK = "orderBookL2_25"
 
-	def __init__(self, api_key, api_secret, callback=None):
+	def __init__(self, api_key, api_secret, callback=None, order_book=False):
+		"""
+		@param order_book If True subscribe to the order book of the symbols.
+		"""
 		self.__api_key = api_key
 		self.__api_secret = api_secret
 		self._callback = callback
+		self._order_book = order_book
 
 		self.__reset()
 
@@ -75,7 +81,10 @@ class BitMEXWebsocket():
 		# We can subscribe right in the connection querystring, so let's build that.
 		# Subscribe to all pertinent endpoints
 		for symbol in symbols:
-			subscriptions += [sub + ':' + symbol for sub in ["quote", "trade"]]  # , BitMEXWebsocket.PREFERED_ORDER_BOOK]]
+			subscriptions += [sub + ':' + symbol for sub in ["quote", "trade"]]
+
+			if self._order_book:
+				subscriptions.append(BitMEXWebsocket.PREFERED_ORDER_BOOK + ':' + symbol)
 	
 		subscriptions += ["instrument"]  # We want all of them
 
@@ -161,21 +170,9 @@ class BitMEXWebsocket():
 
 	def market_depth(self, symbol):
 		"""
-		Return order book for a symbol.
+		Return the OrderBook of a symbol or None.
 		"""
-		order_book = self.data.get(self.PREFERED_ORDER_BOOK, {})
-
-		buys = []
-		sells = []
-
-		for order in order_book:
-			if order['symbol'] == symbol:
-				if order['side'] == 'Buy':
-					buys.append({'id': str(order['id']), 'size': order['size'], 'price': order['price']})
-				elif order['side'] == 'Sell':
-					sells.append({'id': str(order['id']), 'size': order['size'], 'price': order['price']})
-
-		return (buys, sells)
+		return self._order_books.get(symbol)
 
 	def open_orders(self, clOrdIDPrefix):
 		orders = self.data.get('order', [])
@@ -372,6 +369,13 @@ class BitMEXWebsocket():
 					if self._callback:
 						self._callback[1](self._callback[0], 'error', 401)
 
+			elif action and table == self.PREFERED_ORDER_BOOK:
+				# maintained apart, into an OrderBook per symbol
+				updated = self.__on_order_book(action, message['data'])
+
+				if self._callback and self.ready:
+					self._callback[1](self._callback[0], 'action', (action, table, updated, message['data']))
+
 			elif action:
 
 				if table not in self.data:
@@ -447,6 +451,65 @@ class BitMEXWebsocket():
 		except Exception as e:
 			logger.error(traceback.format_exc())			
 
+	def __on_order_book(self, action, data):
+		"""
+		Apply an order book L2 message. There is no sequence id, the book is resynced by each partial.
+		The update and delete messages only contain the id of the level, that maps to its symbol, side and price.
+		@return The set of the updated symbols.
+		"""
+		updated = set()
+
+		if action == 'partial':
+			snapshots = {level['symbol']: ([], []) for level in data}
+
+			# forget the levels of the previous image of the symbols
+			self._order_book_levels = {k: v for k, v in self._order_book_levels.items() if v[0] not in snapshots}
+
+			for level in data:
+				snapshot = snapshots[level['symbol']]
+				snapshot[0 if level['side'] == 'Buy' else 1].append((level['price'], level['size']))
+
+				self._order_book_levels[level['id']] = (level['symbol'], level['side'], level['price'])
+
+			for symbol, snapshot in snapshots.items():
+				order_book = self._order_books.get(symbol)
+				if order_book is None:
+					order_book = self._order_books[symbol] = OrderBook(symbol)
+
+				order_book.snapshot(snapshot[0], snapshot[1])
+				updated.add(symbol)
+
+			return updated
+
+		for level in data:
+			if action == 'insert':
+				key = self._order_book_levels[level['id']] = (level['symbol'], level['side'], level['price'])
+				size = level['size']
+			elif action == 'update':
+				key = self._order_book_levels.get(level['id'])
+				size = level.get('size', 0)
+			elif action == 'delete':
+				key = self._order_book_levels.pop(level['id'], None)
+				size = 0
+			else:
+				raise Exception("Unknown action: %s" % action)
+
+			if key is None:
+				continue  # no level found, could happen before the partial
+
+			order_book = self._order_books.get(key[0])
+			if order_book is None:
+				continue
+
+			if key[1] == 'Buy':
+				order_book.set_bid(key[2], size)
+			else:
+				order_book.set_ask(key[2], size)
+
+			updated.add(key[0])
+
+		return updated
+
 	def __on_open(self):
 		logger.debug("BitMex websocket Opened.")
 		self._connected = True
@@ -463,6 +526,8 @@ class BitMEXWebsocket():
 	def __reset(self):
 		self.data = {}
 		self.keys = {}
+		self._order_books = {}         # OrderBook per symbol
+		self._order_book_levels = {}   # order book level id : (symbol, side, price)
 		self.ws = None
 		self.wst = None
 		self.exited = False
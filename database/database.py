@@ -14,15 +14,20 @@ import pathlib
 from watcher.service import WatcherService
 from notifier.signal import Signal
 
+import numpy as np
+
 from instrument.instrument import Candle
 
 from trader.market import Market
 from trader.asset import Asset
 
 from config.utils import databases
+from terminal.terminal import Terminal
 
-from .tickstorage import TickStorage, TickStreamer
+from .tickstorage import TickStorage, TickStreamer, TickFileHandles
 from .ohlcstorage import OhlcStorage, OhlcStreamer
+from .ohlcquery import OhlcQuery
+from .ohlccache import OhlcCache
 
 import logging
 logger = logging.getLogger('siis.database')
@@ -66,12 +71,24 @@ class Database(object):
     Optimizer can be used to detect gaps.
     Cleaner delete older ohlc according to previously defined rules.
 
+    Consolidated ohlcs are also kept into a local binary cache per market and timeframe (@see OhlcCache),
+    written on insert and on read from the SQL DB, and read first by the ohlc loads and streamers.
+    It can be disabled with ohlc_cache False into the DATABASES['siis'] config.
+
+    Insertions are bulk loaded per batch of at most batch_size rows, flushed every flush_delay seconds
+    or as soon as more than flush_max_pending ohlcs are pending. Those values can be overridden
+    into the DATABASES['siis'] config, and the timing of each batch is reported on ping.
+
     Ticks
     =====
 
     Ticks are stored per market into mutliple text files that can be optimized.
     Organisation is one file per month.
 
+    Ticks are written in binary, and in text too unless text_ticks is False into the DATABASES['siis']
+    config, or a list of the broker identifiers to write in text. The open files are kept in a LRU of
+    max_tick_handles.
+
     They essentially exists for backtesting purpose. But could serve as source to recreate ohlc also.
     They are stored in live by the watcher because its difficult to fetch historical data on most of the brokers.
 
@@ -82,6 +99,10 @@ class Database(object):
     """
     __instance = None
 
+    DEFAULT_BATCH_SIZE = 5000           # max rows per bulk insert batch
+    DEFAULT_FLUSH_DELAY = 60            # ohlc flush every minute
+    DEFAULT_FLUSH_MAX_PENDING = 500     # or as soon as more than 500 ohlcs are pending
+
     @classmethod
     def inst(cls):
         if Database.__instance is None:
@@ -114,10 +135,21 @@ class Database(object):
         Database.__instance = self
 
         self._mutex = threading.Lock()
+        self._pending_condition = threading.Condition(self._mutex)  # producers waiting for the pending data
+        self._num_pending_waiters = 0
         self._running = False
         self._thread = threading.Thread(name="db", target=self.run)
 
         self._db = None
+        self._config = None
+
+        self._ohlc_query = OhlcQuery('%s')
+
+        self._use_ohlc_cache = True
+        self._ohlc_caches = {}                  # OhlcCache per (broker_id, market_id, timeframe)
+
+        self._stream_db = None                  # connection dedicated to the ohlc streamers
+        self._stream_mutex = threading.Lock()   # shared by the streamers
 
         self._pending_market_info_insert = []
         self._pending_market_info_select = []
@@ -135,14 +167,26 @@ class Database(object):
         self._pending_user_trader_insert = []
         self._pending_user_trader_select = []
 
+        self._sync_requested = 0    # sync generation requested by the producers
+        self._sync_done = 0         # last sync generation done by the thread
+
         self._last_tick_flush = 0
         self._last_ohlc_flush = 0
         self._last_ohlc_clean = time.time()
 
+        self._batch_size = Database.DEFAULT_BATCH_SIZE
+        self._flush_delay = Database.DEFAULT_FLUSH_DELAY
+        self._flush_max_pending = Database.DEFAULT_FLUSH_MAX_PENDING
+
+        self._batch_stats = {}      # per table (num batches, num rows, sum time, max time)
+
         self._markets_path = None
         self._tick_storages = {}    # TickStorage per market
         self._pending_tick_insert = []
 
+        self._text_ticks = True     # True, False or a list of broker identifiers
+        self._tick_handles = TickFileHandles()
+
     def lock(self, blocking=True, timeout=-1):
         self._mutex.acquire(blocking, timeout)
 
@@ -153,6 +197,15 @@ class Database(object):
         # load database
         config = databases(options.get('config-path')) or {}
 
+        if 'siis' in config:
+            self._batch_size = max(1, config['siis'].get('batch_size', Database.DEFAULT_BATCH_SIZE))
+            self._flush_delay = config['siis'].get('flush_delay', Database.DEFAULT_FLUSH_DELAY)
+            self._flush_max_pending = config['siis'].get('flush_max_pending', Database.DEFAULT_FLUSH_MAX_PENDING)
+            self._use_ohlc_cache = config['siis'].get('ohlc_cache', True)
+            self._text_ticks = config['siis'].get('text_ticks', True)
+            self._tick_handles = TickFileHandles(config['siis'].get('max_tick_handles', TickFileHandles.DEFAULT_MAX_HANDLES))
+
+        self._config = config
         self.connect(config)
 
         # optionnal tables creation
@@ -179,6 +232,26 @@ class Database(object):
         """        
         pass
 
+    def open_connection(self, config, autocommit=False):
+        """
+        Open and return a new connection to the database host.
+        """
+        return None
+
+    def stream_connection(self):
+        """
+        Connection dedicated to the ohlc streamers, in autocommit, opened at the first call.
+        It must be used with the stream lock because the streamers query from their own thread.
+        """
+        self._stream_mutex.acquire()
+        try:
+            if self._stream_db is None and self._config:
+                self._stream_db = self.open_connection(self._config, True)
+        finally:
+            self._stream_mutex.release()
+
+        return self._stream_db
+
     def close(self):
         # wait until all insertions
         self.lock()
@@ -197,17 +270,92 @@ class Database(object):
 
         self.disconnect()
 
+        self._stream_mutex.acquire()
+        if self._stream_db:
+            self._stream_db.close()
+            self._stream_db = None
+        self._stream_mutex.release()
+
         # flush remaining ticks
         self.lock()
         for k, tick_storage in self._tick_storages.items():
             tick_storage.flush(force=True)
             tick_storage.close()
 
+        self._tick_handles.close_all()
+
         self._tick_storages = {}
         self._pending_tick_insert = []
 
         self.unlock()
 
+    def ping(self):
+        self.lock()
+        stats = self.batch_stats(True)
+        num_pending = len(self._pending_ohlc_insert)
+        self.unlock()
+
+        for table, (num_batches, num_rows, sum_time, max_time) in stats.items():
+            Terminal.inst().action("Database %s %i batches %i rows, batch avg %.3fms max %.3fms, %.0f rows/s" % (
+                table, num_batches, num_rows, sum_time * 1000.0 / num_batches, max_time * 1000.0,
+                num_rows / sum_time if sum_time > 0 else 0.0), view='content')
+
+        Terminal.inst().action("Database pending ohlcs %i" % num_pending, view='content')
+
+    #
+    # bulk insertion
+    #
+
+    def batches(self, rows):
+        """
+        Split a list of rows into batches of at most batch_size rows.
+        """
+        return [rows[i:i+self._batch_size] for i in range(0, len(rows), self._batch_size)]
+
+    def add_batch_stat(self, table, num_rows, elapsed):
+        """
+        Account a batch of rows inserted into a table, with its duration in seconds.
+        @note Must be called with the lock.
+        """
+        stat = self._batch_stats.get(table)
+
+        if stat is None:
+            self._batch_stats[table] = [1, num_rows, elapsed, elapsed]
+        else:
+            stat[0] += 1
+            stat[1] += num_rows
+            stat[2] += elapsed
+            stat[3] = max(stat[3], elapsed)
+
+    def batch_stats(self, reset=False):
+        """
+        Returns a dict per table with a tuple of the number of batches, the number of rows,
+        the sum and the max of the batch durations in seconds.
+        @note Must be called with the lock.
+        """
+        stats = {table: tuple(stat) for table, stat in self._batch_stats.items()}
+
+        if reset:
+            self._batch_stats = {}
+
+        return stats
+
+    def need_ohlc_flush(self):
+        return time.time() - self._last_ohlc_flush >= self._flush_delay or len(self._pending_ohlc_insert) > self._flush_max_pending
+
+    @staticmethod
+    def unique_rows(rows, key_len):
+        """
+        Returns the rows without duplicate keys (the key_len first fields), keeping the last one of each key,
+        because a single upsert statement cannot update twice the same row.
+        """
+        uniques = {}
+
+        for row in rows:
+            uniques[tuple(row[:key_len])] = row
+
+        return list(uniques.values())
+
     def setup_market_sql(self):
         pass
 
@@ -231,14 +379,18 @@ class Database(object):
             str ask (>= 0)
             str volume (>= 0)
         """
+        # an array of tuples must be of a same market
+        broker_id, market_id = (data[0][0], data[0][1]) if isinstance(data, list) else (data[0], data[1])
+
         self.lock()
 
         # store market per keyed array
-        key = data[0]+'/'+data[1]
+        key = broker_id+'/'+market_id
         tickstorage = self._tick_storages.get(key)
 
         if not tickstorage:
-            tickstorage = TickStorage(self._markets_path, data[0], data[1])
+            text = self._text_ticks if isinstance(self._text_ticks, bool) else broker_id in self._text_ticks
+            tickstorage = TickStorage(self._markets_path, broker_id, market_id, text=text, handles=self._tick_handles)
             self._tick_storages[key] = tickstorage
 
         # pending list of TickStorage controller having data to process to avoid to check everyone
@@ -373,17 +525,72 @@ class Database(object):
     # Tick and ohlc streamer
     #
 
-    def create_tick_streamer(self, broker_id, market_id, from_date, to_date, buffer_size=32768):
+    def create_tick_streamer(self, broker_id, market_id, from_date, to_date, buffer_size=32768, use_mmap=False):
         """
         Create a new tick streamer.
+        @param use_mmap Map the binary tick files as numpy arrays (@see TickStreamer.next_array).
         """
-        return TickStreamer(self._markets_path, broker_id, market_id, from_date, to_date, buffer_size, True)
+        return TickStreamer(self._markets_path, broker_id, market_id, from_date, to_date, buffer_size, True, use_mmap)
 
     def create_ohlc_streamer(self, broker_id, market_id, timeframe, from_date, to_date, buffer_size=8192):
         """
-        Create a new tick streamer.
+        Create a new ohlc streamer.
+        @param buffer_size Number of ohlcs per page.
         """
-        return OhlcStreamer(self._db, timeframe, broker_id, market_id, from_date, to_date, buffer_size)
+        return OhlcStreamer(self.stream_connection(), self._stream_mutex, self._ohlc_query, broker_id, market_id, timeframe,
+                from_date, to_date, buffer_size, self.ohlc_cache(broker_id, market_id, timeframe))
+
+    #
+    # Local ohlc cache
+    #
+
+    def ohlc_cache(self, broker_id, market_id, timeframe):
+        """
+        Shared OhlcCache of a market for a timeframe, or None if disabled or for timeframes lesser than 1m.
+        """
+        if not self._use_ohlc_cache or self._markets_path is None or timeframe < 60:
+            return None
+
+        key = (broker_id, market_id, timeframe)
+
+        self.lock()
+        cache = self._ohlc_caches.get(key)
+
+        if cache is None:
+            cache = OhlcCache(self._markets_path, broker_id, market_id, timeframe)
+            self._ohlc_caches[key] = cache
+
+        self.unlock()
+
+        return cache
+
+    def cache_ohlc(self, rows):
+        """
+        Write the consolidated ohlcs of inserted rows into their local cache.
+        @param rows List of tuples (@see store_market_ohlc).
+        """
+        if not self._use_ohlc_cache:
+            return
+
+        groups = {}
+
+        for row in rows:
+            if row[3] >= 60:
+                groups.setdefault((row[0], row[1], row[3]), []).append((row[2], *row[4:13]))
+
+        now = time.time()
+
+        for (broker_id, market_id, timeframe), records in groups.items():
+            cache = self.ohlc_cache(broker_id, market_id, timeframe)
+            if cache is None:
+                continue
+
+            data = OhlcQuery.decode(records)
+            data = data[np.argsort(data[:, 0], kind='stable')]
+            data = data[data[:, 0] <= cache.last_closed(now)]
+
+            if len(data):
+                cache.store(data, data[0, 0], data[-1, 0])
 
     #
     # User
@@ -478,13 +685,81 @@ class Database(object):
 
     def run(self):
         while self._running:
+            sync = self._sync_requested
+            if sync > self._sync_done:
+                # force the flush of the ohlcs and of the ticks for this cycle
+                self._last_ohlc_flush = 0
+
             self.process_userdata()
             self.process_market()
             self.process_ohlc()
-            self.process_tick()
+            self.process_tick(sync > self._sync_done)
+
+            if self._num_pending_waiters:
+                self.lock()
+
+                if sync > self._sync_done and not self._pending_ohlc_insert:
+                    self._sync_done = sync
+
+                self._pending_condition.notify_all()
+                self.unlock()
 
             time.sleep(0.001)  # don't waste the CPU
 
+    def wait_pending(self, max_ticks, max_ohlcs, timeout=None):
+        """
+        Block a producer (a fetcher) while more than max_ticks ticks or max_ohlcs ohlcs are pending, until the
+        thread has processed them. This is the backpressure of a bounded queue, without any polling.
+        @return False if the timeout expired or the database is closed.
+        """
+        deadline = time.time() + timeout if timeout else None
+
+        self.lock()
+        self._num_pending_waiters += 1
+
+        try:
+            while len(self._pending_tick_insert) > max_ticks or len(self._pending_ohlc_insert) > max_ohlcs:
+                if not self._running:
+                    return False
+
+                if deadline and time.time() >= deadline:
+                    return False
+
+                self._pending_condition.wait(1.0)
+        finally:
+            self._num_pending_waiters -= 1
+            self.unlock()
+
+        return True
+
+    def sync(self, timeout=None):
+        """
+        Block until the data stored before this call are written (ohlcs inserted and ticks flushed to their files),
+        for example before to checkpoint a fetch.
+        @return False if the timeout expired or the database is closed.
+        """
+        deadline = time.time() + timeout if timeout else None
+
+        self.lock()
+        self._sync_requested += 1
+        sync = self._sync_requested
+        self._num_pending_waiters += 1
+
+        try:
+            while self._sync_done < sync:
+                if not self._running:
+                    return False
+
+                if deadline and time.time() >= deadline:
+                    return False
+
+                self._pending_condition.wait(1.0)
+        finally:
+            self._num_pending_waiters -= 1
+            self.unlock()
+
+        return True
+
     def process_market(self):
         pass
 
@@ -494,12 +769,108 @@ class Database(object):
     def process_ohlc(self):
         pass
 
-    def process_tick(self):
+    def query_ohlc(self, broker_id, market_id, timeframe, from_ts, to_ts, last_n):
+        """
+        Query ohlcs from the SQL DB.
+        @param from_ts Optional timestamp in ms
+        @param to_ts Optional timestamp in ms
+        @param last_n Optional, from_ts and to_ts are then ignored
+        @return Decoded array (@see OhlcQuery.decode).
+        """
+        return np.empty((0, OhlcQuery.NUM_COLUMNS))
+
+    def query_ohlc_gaps(self, broker_id, market_id, timeframe, from_ts, to_ts):
+        """
+        Query the gaps of ohlcs from the SQL DB, through the stream connection (can be called from any thread).
+        @param from_ts Timestamp in ms
+        @param to_ts Timestamp in ms
+        @return A list of tuples (previous timestamp in ms, timestamp in ms, previous bid close, previous ofr close).
+        """
+        connection = self.stream_connection()
+        if connection is None:
+            return []
+
+        sql, params = self._ohlc_query.gaps(timeframe, from_ts, to_ts, (broker_id, market_id))
+
+        self._stream_mutex.acquire()
+        try:
+            cursor = connection.cursor()
+            cursor.execute(sql, params)
+
+            rows = [(int(row[0]), int(row[1]), float(row[2]), float(row[3])) for row in cursor.fetchall()]
+            cursor.close()
+        finally:
+            self._stream_mutex.release()
+
+        return rows
+
+    def select_ohlc(self, broker_id, market_id, timeframe, from_ts, to_ts, last_n):
+        """
+        Select ohlcs from the local cache, and from the SQL DB for the missing months and the current ohlc.
+        The ohlcs read from the SQL DB are then written to the cache.
+        Same parameters and result as query_ohlc.
+        """
+        cache = self.ohlc_cache(broker_id, market_id, timeframe)
+
+        if cache is None or not (last_n or from_ts):
+            return self.query_ohlc(broker_id, market_id, timeframe, from_ts, to_ts, last_n)
+
+        now = time.time()
+        last_closed = cache.last_closed(now)
+
+        if last_n:
+            data = cache.read_last(last_n, last_closed)
+
+            if data is None:
+                data = self.query_ohlc(broker_id, market_id, timeframe, None, None, last_n)
+
+                # they are all the ohlcs from the first one
+                closed = data[data[:, 0] <= last_closed]
+                if len(closed):
+                    cache.store(closed, closed[0, 0], last_closed)
+
+                return data
+
+            # plus the current one
+            current = self.query_ohlc(broker_id, market_id, timeframe, int(last_closed * 1000) + 1, None, None)
+
+            return np.concatenate((data, current))[-last_n:]
+
+        from_s = from_ts * 0.001
+        to_s = to_ts * 0.001 if to_ts else now
+        chunks = []
+
+        if from_s <= last_closed:
+            data, missing = cache.read(from_s, min(to_s, last_closed))
+            chunks.append(data)
+
+            for m_from, m_to in missing:
+                data = self.query_ohlc(broker_id, market_id, timeframe, int(round(m_from * 1000)), int(round(m_to * 1000)), None)
+                cache.store(data, m_from, m_to)
+
+                chunks.append(data)
+
+        if to_s > last_closed:
+            # the current one is never cached
+            chunks.append(self.query_ohlc(broker_id, market_id, timeframe, max(from_ts, int(last_closed * 1000) + 1), to_ts, None))
+
+        if not chunks:
+            return np.empty((0, OhlcQuery.NUM_COLUMNS))
+
+        data = np.concatenate(chunks)
+
+        return data[np.argsort(data[:, 0], kind='stable')]
+
+    def process_tick(self, force=False):
         self.lock()
         pti = copy.copy(self._pending_tick_insert)
         self._pending_tick_insert.clear()
+
+        if force:
+            # any tick storage having data, even if not recently stored
+            pti = list(self._tick_storages.values())
         self.unlock()
 
         for tick_storage in pti:
             if tick_storage.has_data():
-                tick_storage.flush()
+                tick_storage.flush(force)
@@ -14,15 +14,14 @@ import pathlib
 from watcher.service import WatcherService
 from notifier.signal import Signal
 
-from instrument.instrument import Candle
-
 from trader.market import Market
 from trader.asset import Asset
 
 from config.utils import databases
 
 from .tickstorage import TickStorage, TickStreamer
-from .ohlcstorage import OhlcStorage, OhlcStreamer
+from .ohlcstorage import OhlcStorage
+from .ohlcquery import OhlcQuery
 
 from .database import Database
 
@@ -41,15 +40,22 @@ class MySql(Database):
 
     def connect(self, config):
         if 'siis' in config:
-            import MySQLdb
+            self._db = self.open_connection(config)
+
+    def open_connection(self, config, autocommit=False):
+        import MySQLdb
+
+        db = MySQLdb.connect(
+            db='siis',
+            host=config['siis'].get('host', 'localhost'),
+            port=config['siis'].get('port', 3306),
+            user=config['siis'].get('user', 'siis'),
+            passwd=config['siis'].get('password', 'siis'),
+            connect_timeout=5)
 
-            self._db = MySQLdb.connect(
-                db='siis',
-                host=config['siis'].get('host', 'localhost'),
-                port=config['siis'].get('port', 3306),
-                user=config['siis'].get('user', 'siis'),
-                passwd=config['siis'].get('password', 'siis'),
-                connect_timeout=5)
+        db.autocommit(autocommit)
+
+        return db
 
     def disconnect(self):
         # postresql db
@@ -154,11 +160,27 @@ class MySql(Database):
 
         self._db.commit()
 
-    def create_ohlc_streamer(self, broker_id, market_id, timeframe, from_date, to_date, buffer_size=8192):
-        """
-        Create a new tick streamer.
-        """
-        return OhlcStreamer(self._db, timeframe, broker_id, market_id, from_date, to_date, buffer_size)
+    def query_ohlc(self, broker_id, market_id, timeframe, from_ts, to_ts, last_n):
+        import MySQLdb.cursors
+
+        kind, sql, params = self._ohlc_query.build(timeframe, from_ts, to_ts, last_n, (broker_id, market_id))
+
+        if kind == OhlcQuery.LAST_N:
+            # bounded
+            cursor = self._db.cursor()
+            cursor.execute(sql, params)
+
+            data = OhlcQuery.decode(cursor.fetchall(), True)
+        else:
+            # possibly large range, streamed from a server side (unbuffered) cursor
+            cursor = self._db.cursor(MySQLdb.cursors.SSCursor)
+            cursor.execute(sql, params)
+
+            data = OhlcQuery.fetch(cursor)
+
+            cursor.close()
+
+        return data
 
     #
     # Processing
@@ -355,16 +377,24 @@ class MySql(Database):
             try:
                 cursor = self._db.cursor()
 
-                for ua in uai:
-                    cursor.execute("""
+                for batch in self.batches(uai):
+                    t = time.perf_counter()
+
+                    # executemany is rewritten as a single multi-rows insert
+                    cursor.executemany("""
                         INSERT INTO asset(broker_id, account_id, asset_id, last_trade_id, timestamp, quantity, price, quote_symbol)
                             VALUES(%s, %s, %s, %s, %s, %s, %s, %s)
-                        ON DUPLICATE KEY UPDATE 
-                            last_trade_id = %s, timestamp = %s, quantity = %s, price = %s, quote_symbol = %s""", (*ua, *ua[3:]))
+                        ON DUPLICATE KEY UPDATE last_trade_id = VALUES(last_trade_id), timestamp = VALUES(timestamp),
+                            quantity = VALUES(quantity), price = VALUES(price), quote_symbol = VALUES(quote_symbol)""", batch)
 
-                self._db.commit()
+                    self._db.commit()
+
+                    self.lock()
+                    self.add_batch_stat('asset', len(batch), time.perf_counter() - t)
+                    self.unlock()
             except Exception as e:
                 logger.error(repr(e))
+                self._db.rollback()
 
                 # retry the next time
                 self.lock()
@@ -425,18 +455,24 @@ class MySql(Database):
             try:
                 cursor = self._db.cursor()
 
-                query = ' '.join((
-                    "INSERT INTO user_trade(broker_id, account_id, market_id, appliance_id, trade_id, trade_type, data, operations) VALUES",
-                    ','.join(["('%s', '%s', '%s', '%s', %i, %i, '%s', '%s')" % (ut[0], ut[1], ut[2], ut[3], ut[4], ut[5],
-                        json.dumps(ut[6]).replace("'", "''"), json.dumps(ut[7]).replace("'", "''")) for ut in uti]),
-                    "ON DUPLICATE KEY UPDATE data = VALUES(data), operations = VALUES(operations)"
-                ))
+                rows = [(ut[0], ut[1], ut[2], ut[3], ut[4], ut[5], json.dumps(ut[6]), json.dumps(ut[7])) for ut in uti]
 
-                cursor.execute(query)
+                for batch in self.batches(rows):
+                    t = time.perf_counter()
 
-                self._db.commit()
+                    cursor.executemany("""
+                        INSERT INTO user_trade(broker_id, account_id, market_id, appliance_id, trade_id, trade_type, data, operations)
+                            VALUES(%s, %s, %s, %s, %s, %s, %s, %s)
+                        ON DUPLICATE KEY UPDATE data = VALUES(data), operations = VALUES(operations)""", batch)
+
+                    self._db.commit()
+
+                    self.lock()
+                    self.add_batch_stat('user_trade', len(batch), time.perf_counter() - t)
+                    self.unlock()
             except Exception as e:
                 logger.error(repr(e))
+                self._db.rollback()
 
                 # retry the next time
                 self.lock()
@@ -556,62 +592,13 @@ class MySql(Database):
 
         if mks:
             try:
-                cursor = self._db.cursor()
+                while mks:
+                    mk = mks[0]
 
-                for mk in mks:
-                    if mk[6]:
-                        # last n
-                        cursor.execute("""SELECT COUNT(*) FROM ohlc WHERE broker_id = '%s' AND market_id = '%s' AND timeframe = %s""" % (mk[1], mk[2], mk[3]))
-                        count = int(cursor.fetchone()[0])
-                        offset = max(0, count - mk[6])
-
-                        # LIMIT should not be necessary then
-                        cursor.execute("""SELECT timestamp, bid_open, bid_high, bid_low, bid_close, ask_open, ask_high, ask_low, ask_close, volume FROM ohlc
-                                        WHERE broker_id = '%s' AND market_id = '%s' AND timeframe = %s ORDER BY timestamp ASC LIMIT %i OFFSET %i""" % (
-                                            mk[1], mk[2], mk[3], mk[6], offset))
-                    elif mk[4] and mk[5]:
-                        # from to
-                        cursor.execute("""SELECT timestamp, bid_open, bid_high, bid_low, bid_close, ask_open, ask_high, ask_low, ask_close, volume FROM ohlc
-                                        WHERE broker_id = '%s' AND market_id = '%s' AND timeframe = %s AND timestamp >= %i AND timestamp <= %i ORDER BY timestamp ASC""" % (
-                                            mk[1], mk[2], mk[3], mk[4], mk[5]))
-                    elif mk[4]:
-                        # from to now
-                        cursor.execute("""SELECT timestamp, bid_open, bid_high, bid_low, bid_close, ask_open, ask_high, ask_low, ask_close, volume FROM ohlc
-                                        WHERE broker_id = '%s' AND market_id = '%s' AND timeframe = %s AND timestamp >= %i ORDER BY timestamp ASC""" % (
-                                            mk[1], mk[2], mk[3], mk[4]))
-                    elif mk[5]:
-                        # to now
-                        cursor.execute("""SELECT timestamp, bid_open, bid_high, bid_low, bid_close, ask_open, ask_high, ask_low, ask_close, volume FROM ohlc
-                                        WHERE broker_id = '%s' AND market_id = '%s' AND timeframe = %s AND timestamp <= %i ORDER BY timestamp ASC""" % (
-                                            mk[1], mk[2], mk[3], mk[5]))
-                    else:
-                        # all
-                        cursor.execute("""SELECT timestamp, bid_open, bid_high, bid_low, bid_close, ask_open, ask_high, ask_low, ask_close, volume FROM ohlc
-                                        WHERE broker_id = '%s' AND market_id = '%s' AND timeframe = %s ORDER BY timestamp ASC""" % (
-                                            mk[1], mk[2], mk[3]))
-
-                    rows = cursor.fetchall()
+                    data = self.select_ohlc(mk[1], mk[2], mk[3], mk[4], mk[5], mk[6])
+                    mks.pop(0)
 
-                    ohlcs = []
-
-                    for row in rows:
-                        timestamp = float(row[0]) * 0.001  # to float second timestamp
-                        ohlc = Candle(timestamp, mk[3])
-
-                        ohlc.set_bid_ohlc(float(row[1]), float(row[2]), float(row[3]), float(row[4]))
-                        ohlc.set_ofr_ohlc(float(row[5]), float(row[6]), float(row[7]), float(row[8]))
-
-                        # if float(row[9]) <= 0:
-                        #   # prefer to ignore empty volume ohlc because it can broke volume signal and it is a no way but it could be
-                        #   # a lack of this information like on SPX500 of ig.com. So how to manage that cases...
-                        #   continue
-
-                        ohlc.set_volume(float(row[9]))
-
-                        if ohlc.timestamp >= Instrument.basetime(mk[3], time.time()):
-                            candle.set_consolidated(False)  # current
-
-                        ohlcs.append(ohlc)
+                    ohlcs = OhlcQuery.candles(data, mk[3])
 
                     # notify
                     mk[0].notify(Signal.SIGNAL_CANDLE_DATA_BULK, mk[1], (mk[2], mk[3], ohlcs))
@@ -619,7 +606,7 @@ class MySql(Database):
                 # check database for valide ohlc and volumes
                 logger.error(repr(e))
 
-                # retry the next time
+                # retry the next time the remaining ones
                 self.lock()
                 self._pending_ohlc_select = mks + self._pending_ohlc_select
                 self.unlock()
@@ -628,31 +615,44 @@ class MySql(Database):
         # insert market ohlcs
         #
 
-        if time.time() - self._last_ohlc_flush >= 60 or len(self._pending_ohlc_insert) > 500:
+        if self.need_ohlc_flush():
             self.lock()
             mkd = self._pending_ohlc_insert
             self._pending_ohlc_insert = []
             self.unlock()
 
             if mkd:
+                batches = self.batches(mkd)
+
                 try:
                     cursor = self._db.cursor()
 
-                    query = ' '.join((
-                        "INSERT INTO ohlc(broker_id, market_id, timestamp, timeframe, bid_open, bid_high, bid_low, bid_close, ask_open, ask_high, ask_low, ask_close, volume) VALUES",
-                        ','.join(["('%s', '%s', %i, %i, '%s', '%s', '%s', '%s', '%s', '%s', '%s', '%s', '%s')" % (mk[0], mk[1], mk[2], mk[3], mk[4], mk[5], mk[6], mk[7], mk[8], mk[9], mk[10], mk[11], mk[12]) for mk in mkd]),
-                        "ON DUPLICATE KEY UPDATE bid_open = VALUES(bid_open), bid_high = VALUES(bid_high), bid_low = VALUES(bid_low), bid_close = VALUES(bid_close), ask_open = VALUES(ask_open), ask_high = VALUES(ask_high), ask_low = VALUES(ask_low), ask_close = VALUES(ask_close), volume = VALUES(volume)"
-                    ))
+                    while batches:
+                        batch = batches[0]
+                        t = time.perf_counter()
 
-                    cursor.execute(query)
+                        # executemany is rewritten as a single multi-rows insert
+                        cursor.executemany("""INSERT INTO ohlc(broker_id, market_id, timestamp, timeframe, bid_open, bid_high, bid_low, bid_close, ask_open, ask_high, ask_low, ask_close, volume)
+                                            VALUES(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                                            ON DUPLICATE KEY UPDATE bid_open = VALUES(bid_open), bid_high = VALUES(bid_high), bid_low = VALUES(bid_low), bid_close = VALUES(bid_close),
+                                                ask_open = VALUES(ask_open), ask_high = VALUES(ask_high), ask_low = VALUES(ask_low), ask_close = VALUES(ask_close),
+                                                volume = VALUES(volume)""", batch)
 
-                    self._db.commit()
+                        self._db.commit()
+                        batches.pop(0)
+
+                        self.lock()
+                        self.add_batch_stat('ohlc', len(batch), time.perf_counter() - t)
+                        self.unlock()
+
+                        self.cache_ohlc(batch)
                 except Exception as e:
                     logger.error(repr(e))
+                    self._db.rollback()
 
-                    # retry the next time
+                    # retry the next time the remaining batches
                     self.lock()
-                    self._pending_ohlc_insert = mkd + self._pending_ohlc_insert
+                    self._pending_ohlc_insert = [mk for batch in batches for mk in batch] + self._pending_ohlc_insert
                     self.unlock()
 
                 self._last_ohlc_flush = time.time()
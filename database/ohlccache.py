@@ -0,0 +1,454 @@
+# @date 2019-03-10
+# @author Frederic SCHERMA
+# @license Copyright (c) 2019 Dream Overflow
+# Local binary cache of consolidated ohlcs
+
+import os
+import struct
+import pathlib
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # no lock between the processes
+
+import numpy as np
+
+from datetime import datetime
+
+from common.utils import UTC, timeframe_to_str
+from instrument.instrument import Instrument
+
+from .ohlcquery import OhlcQuery
+
+import logging
+logger = logging.getLogger('siis.database.ohlccache')
+
+
+class OhlcCache(object):
+    """
+    Local append-only binary cache of the consolidated ohlcs of a market for a timeframe, next to the tick files.
+    There is one segment file per month : <markets-path>/<broker-id>/<market-id>/C/<YYYYMM><market-id>_<timeframe>.dat
+
+    Each segment starts with a header of 32 bytes :
+        - magic and version
+        - timeframe (float64)
+        - synced from and synced to (float64) timestamps of the first and last bucket of the range known to be
+          identical to the SQL DB, or -1 if none.
+
+    Followed by fixed-width records of 10 float64 ordered by timestamp (in second), bid OHLC, ofr OHLC and
+    volume, that is the columns of OhlcQuery.decode.
+
+    Newer ohlcs are appended, the last one is rewritten in place, and older ones are merged by rewriting the segment.
+    An append only reads the header and the last record of the segment, so its cost does not depend on its size.
+    A read is served from a segment only if its synced range covers the requested part of the month, else the
+    caller has to query the SQL DB for the missing months, and then store the result with its range.
+
+    The current (non consolidated) ohlc is never stored.
+
+    The segments of a cache are shared by the processes (siis, fetcher, binarizer...), the writes are exclusive
+    and the reads shared with a lock file (flock) per market and timeframe, in addition to the mutex of the threads.
+    """
+
+    MAGIC = b'SIOC'
+    VERSION = 1
+
+    HEADER = struct.Struct('<4sHHddd')  # 32 bytes
+    HEADER_SIZE = 32
+
+    NUM_COLUMNS = OhlcQuery.NUM_COLUMNS
+    RECORD_SIZE = OhlcQuery.NUM_COLUMNS * 8  # 80 bytes
+
+    def __init__(self, markets_path, broker_id, market_id, timeframe):
+        self._path = pathlib.Path(markets_path, broker_id, market_id, 'C')
+        self._market_id = market_id
+        self._timeframe = timeframe
+        self._tf_str = timeframe_to_str(timeframe) or str(int(timeframe))
+        self._lockname = str(self._path.joinpath("%s_%s.lock" % (market_id, self._tf_str)))
+
+        self._mutex = threading.Lock()
+
+    @property
+    def timeframe(self):
+        return self._timeframe
+
+    #
+    # months and buckets
+    #
+
+    @staticmethod
+    def month_of(timestamp):
+        dt = datetime.utcfromtimestamp(timestamp)
+        return dt.year, dt.month
+
+    @staticmethod
+    def month_start(month):
+        return datetime(month[0], month[1], 1, tzinfo=UTC()).timestamp()
+
+    @staticmethod
+    def next_month(month):
+        return (month[0]+1, 1) if month[1] == 12 else (month[0], month[1]+1)
+
+    @staticmethod
+    def prev_month(month):
+        return (month[0]-1, 12) if month[1] == 1 else (month[0], month[1]-1)
+
+    @staticmethod
+    def months(from_ts, to_ts):
+        months = []
+        month = OhlcCache.month_of(from_ts)
+        last = OhlcCache.month_of(to_ts)
+
+        while month <= last:
+            months.append(month)
+            month = OhlcCache.next_month(month)
+
+        return months
+
+    def first_bucket(self, timestamp):
+        bt = Instrument.basetime(self._timeframe, timestamp)
+        return bt if bt >= timestamp else bt + self._timeframe
+
+    def last_bucket(self, timestamp):
+        return Instrument.basetime(self._timeframe, timestamp)
+
+    def last_closed(self, now):
+        """
+        Timestamp of the last consolidated bucket at now.
+        """
+        return Instrument.basetime(self._timeframe, now) - self._timeframe
+
+    def required(self, month, from_ts, to_ts):
+        """
+        First and last buckets of the month within [from_ts, to_ts].
+        """
+        ms = OhlcCache.month_start(month)
+        me = OhlcCache.month_start(OhlcCache.next_month(month))
+
+        return self.first_bucket(max(from_ts, ms)), self.last_bucket(min(to_ts, me - 0.001))
+
+    @staticmethod
+    def covers(synced, first, last):
+        return first > last or (synced is not None and synced[0] <= first and synced[1] >= last)
+
+    #
+    # segments
+    #
+
+    def filename(self, month):
+        return str(self._path.joinpath("%04i%02i%s_%s.dat" % (month[0], month[1], self._market_id, self._tf_str)))
+
+    def __lock(self, exclusive):
+        """
+        Lock the segments against the other processes.
+        @return The opened lock file, or None if there is nothing to lock.
+        """
+        if fcntl is None or (not exclusive and not self._path.exists()):
+            return None
+
+        lock = open(self._lockname, 'ab')
+
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        except OSError:
+            lock.close()
+            raise
+
+        return lock
+
+    @staticmethod
+    def __unlock(lock):
+        if lock is not None:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+            lock.close()
+
+    def __read_tail(self, month):
+        """
+        Read only the header and the last record of a segment.
+        @return A tuple (synced range or None, number of records, timestamp of the last record or None).
+        """
+        pathname = self.filename(month)
+
+        if not os.path.isfile(pathname):
+            return None, 0, None
+
+        with open(pathname, 'rb') as f:
+            header = f.read(OhlcCache.HEADER_SIZE)
+
+            if len(header) < OhlcCache.HEADER_SIZE:
+                return None, 0, None
+
+            magic, version, reserved, timeframe, synced_from, synced_to = OhlcCache.HEADER.unpack(header)
+
+            if magic != OhlcCache.MAGIC or version != OhlcCache.VERSION or timeframe != self._timeframe:
+                logger.warning("Ignore invalid ohlc cache segment %s" % pathname)
+                return None, 0, None
+
+            # ignore an incomplete trailing record
+            count = (os.fstat(f.fileno()).st_size - OhlcCache.HEADER_SIZE) // OhlcCache.RECORD_SIZE
+            last_ts = None
+
+            if count:
+                f.seek(OhlcCache.HEADER_SIZE + (count - 1) * OhlcCache.RECORD_SIZE)
+                last_ts = struct.unpack('<d', f.read(8))[0]
+
+        return (synced_from, synced_to) if synced_from >= 0 else None, count, last_ts
+
+    def read_segment(self, month):
+        """
+        @return A tuple (synced range or None, data array).
+        """
+        pathname = self.filename(month)
+
+        if not os.path.isfile(pathname):
+            return None, np.empty((0, OhlcCache.NUM_COLUMNS))
+
+        with open(pathname, 'rb') as f:
+            header = f.read(OhlcCache.HEADER_SIZE)
+
+            if len(header) < OhlcCache.HEADER_SIZE:
+                return None, np.empty((0, OhlcCache.NUM_COLUMNS))
+
+            magic, version, reserved, timeframe, synced_from, synced_to = OhlcCache.HEADER.unpack(header)
+
+            if magic != OhlcCache.MAGIC or version != OhlcCache.VERSION or timeframe != self._timeframe:
+                logger.warning("Ignore invalid ohlc cache segment %s" % pathname)
+                return None, np.empty((0, OhlcCache.NUM_COLUMNS))
+
+            data = np.fromfile(f, dtype=np.float64)
+
+        # ignore an incomplete trailing record
+        count = len(data) // OhlcCache.NUM_COLUMNS
+        data = data[:count*OhlcCache.NUM_COLUMNS].reshape(count, OhlcCache.NUM_COLUMNS)
+
+        return (synced_from, synced_to) if synced_from >= 0 else None, data
+
+    def __header(self, synced):
+        if synced is None:
+            return OhlcCache.HEADER.pack(OhlcCache.MAGIC, OhlcCache.VERSION, 0, self._timeframe, -1.0, -1.0)
+
+        return OhlcCache.HEADER.pack(OhlcCache.MAGIC, OhlcCache.VERSION, 0, self._timeframe, synced[0], synced[1])
+
+    def __write_segment(self, month, synced, data):
+        pathname = self.filename(month)
+        tmpname = pathname + '.tmp'
+
+        with open(tmpname, 'wb') as f:
+            f.write(self.__header(synced))
+            f.write(np.ascontiguousarray(data, dtype=np.float64).tobytes())
+
+        os.replace(tmpname, pathname)
+
+    def __merge_synced(self, synced, first, last):
+        if first > last:
+            return synced
+
+        if synced is None:
+            return first, last
+
+        if first <= synced[1] + self._timeframe and last >= synced[0] - self._timeframe:
+            # overlapping or contiguous
+            return min(synced[0], first), max(synced[1], last)
+
+        # disjoint, keep the larger one
+        return (first, last) if last - first > synced[1] - synced[0] else synced
+
+    def __store_segment(self, month, synced, count, last_ts, rows):
+        pathname = self.filename(month)
+
+        if not count or not len(rows) or rows[0, 0] >= last_ts:
+            if not os.path.isfile(pathname):
+                self.__write_segment(month, synced, rows)
+                return
+
+            # append only, possibly rewriting the last record
+            with open(pathname, 'r+b') as f:
+                f.write(self.__header(synced))
+
+                if len(rows):
+                    if count and rows[0, 0] == last_ts:
+                        f.seek(OhlcCache.HEADER_SIZE + (count - 1) * OhlcCache.RECORD_SIZE)
+                    else:
+                        f.seek(OhlcCache.HEADER_SIZE + count * OhlcCache.RECORD_SIZE)
+
+                    f.write(np.ascontiguousarray(rows, dtype=np.float64).tobytes())
+                    f.truncate()
+        else:
+            # merge older ohlcs, the new ones replace the existing ones of same timestamp
+            existing = self.read_segment(month)[1]
+
+            data = np.concatenate((existing, rows))
+            data = data[np.argsort(data[:, 0], kind='stable')]
+
+            keep = np.append(data[1:, 0] != data[:-1, 0], True)
+            self.__write_segment(month, synced, data[keep])
+
+    def store(self, data, from_ts, to_ts):
+        """
+        Store consolidated ohlcs, and the range where they are known to be complete.
+        @param data Decoded array (@see OhlcQuery.decode) ordered by timestamp, possibly empty.
+        @param from_ts Timestamp in second of the beginning of the complete range.
+        @param to_ts Timestamp in second of the end of the complete range.
+        """
+        if from_ts > to_ts:
+            return
+
+        lock = None
+
+        self._mutex.acquire()
+        try:
+            if not self._path.exists():
+                self._path.mkdir(parents=True, exist_ok=True)
+
+            lock = self.__lock(True)
+
+            for month in OhlcCache.months(from_ts, to_ts):
+                ms = OhlcCache.month_start(month)
+                me = OhlcCache.month_start(OhlcCache.next_month(month))
+
+                rows = data[(data[:, 0] >= ms) & (data[:, 0] < me)] if len(data) else data
+                synced, count, last_ts = self.__read_tail(month)
+
+                first, last = self.required(month, from_ts, to_ts)
+                synced = self.__merge_synced(synced, first, last)
+
+                self.__store_segment(month, synced, count, last_ts, rows)
+        except Exception as e:
+            logger.error(repr(e))
+        finally:
+            OhlcCache.__unlock(lock)
+            self._mutex.release()
+
+    #
+    # reading
+    #
+
+    def read(self, from_ts, to_ts):
+        """
+        Read the ohlcs from the covered months.
+        @return A tuple (data array, list of missing (from_ts, to_ts) ranges to query from the SQL DB).
+        """
+        chunks = []
+        missing = []
+
+        lock = None
+
+        self._mutex.acquire()
+        try:
+            lock = self.__lock(False)
+
+            for month in OhlcCache.months(from_ts, to_ts):
+                synced, data = self.read_segment(month)
+                first, last = self.required(month, from_ts, to_ts)
+
+                if OhlcCache.covers(synced, first, last):
+                    if len(data):
+                        chunks.append(data[(data[:, 0] >= from_ts) & (data[:, 0] <= to_ts)])
+                else:
+                    ms = max(from_ts, OhlcCache.month_start(month))
+                    me = min(to_ts, OhlcCache.month_start(OhlcCache.next_month(month)) - 0.001)
+
+                    if missing and missing[-1][1] >= ms - 0.001:
+                        # contiguous missing months
+                        missing[-1] = (missing[-1][0], me)
+                    else:
+                        missing.append((ms, me))
+        except Exception as e:
+            logger.error(repr(e))
+
+            chunks = []
+            missing = [(from_ts, to_ts)]
+        finally:
+            OhlcCache.__unlock(lock)
+            self._mutex.release()
+
+        data = np.concatenate(chunks) if chunks else np.empty((0, OhlcCache.NUM_COLUMNS))
+
+        return data, missing
+
+    def read_last(self, n, to_ts):
+        """
+        Read the last n ohlcs until to_ts.
+        @return The data array, or None if the cache does not cover them.
+        """
+        chunks = []
+        count = 0
+        month = OhlcCache.month_of(to_ts)
+
+        lock = None
+
+        self._mutex.acquire()
+        try:
+            lock = self.__lock(False)
+
+            while count < n:
+                synced, data = self.read_segment(month)
+
+                if synced is None:
+                    return None
+
+                rows = data[data[:, 0] <= to_ts] if len(data) else data
+                needed = n - count
+
+                if len(rows) >= needed:
+                    rows = rows[-needed:]
+                    first = rows[0, 0]
+                else:
+                    first = self.first_bucket(OhlcCache.month_start(month))
+
+                if not OhlcCache.covers(synced, first, self.last_bucket(min(to_ts, OhlcCache.month_start(OhlcCache.next_month(month)) - 0.001))):
+                    return None
+
+                if len(rows):
+                    chunks.append(rows)
+                    count += len(rows)
+
+                month = OhlcCache.prev_month(month)
+        except Exception as e:
+            logger.error(repr(e))
+            return None
+        finally:
+            OhlcCache.__unlock(lock)
+            self._mutex.release()
+
+        return np.concatenate(chunks[::-1])
+
+    def read_page(self, after_ts, to_ts, limit):
+        """
+        Read at most limit ohlcs after after_ts (excluded) until to_ts, while the months are covered.
+        @return A tuple (data array, True if the cache covers until to_ts).
+        """
+        chunks = []
+        count = 0
+
+        lock = None
+
+        self._mutex.acquire()
+        try:
+            lock = self.__lock(False)
+
+            for month in OhlcCache.months(after_ts, to_ts):
+                synced, data = self.read_segment(month)
+                first, last = self.required(month, after_ts + 0.001, to_ts)
+
+                if not OhlcCache.covers(synced, first, last):
+                    return np.concatenate(chunks) if chunks else np.empty((0, OhlcCache.NUM_COLUMNS)), False
+
+                if len(data):
+                    rows = data[(data[:, 0] > after_ts) & (data[:, 0] <= to_ts)][:limit-count]
+
+                    if len(rows):
+                        chunks.append(rows)
+                        count += len(rows)
+
+                if count >= limit:
+                    return np.concatenate(chunks), False
+        except Exception as e:
+            logger.error(repr(e))
+            return np.empty((0, OhlcCache.NUM_COLUMNS)), False
+        finally:
+            OhlcCache.__unlock(lock)
+            self._mutex.release()
+
+        return np.concatenate(chunks) if chunks else np.empty((0, OhlcCache.NUM_COLUMNS)), True
@@ -0,0 +1,211 @@
+# @date 2019-03-09
+# @author Frederic SCHERMA
+# @license Copyright (c) 2019 Dream Overflow
+# Parameterized ohlc queries and decoding
+
+import time
+
+import numpy as np
+
+from instrument.instrument import Instrument, Candle
+
+
+class OhlcQuery(object):
+    """
+    Parameterized ohlc select queries, shared by the SQL backends, the ohlc storage and streamer.
+
+    The SQL is built once per placeholder style : '%s' for psycopg2 and MySQLdb, '?' for sqlite,
+    or '$' for the numbered parameters of a PostgreSQL prepared statement.
+    The market filter (broker_id, market_id) is optional, for the per market DB.
+
+    The last n ohlcs are selected with an ORDER BY timestamp DESC LIMIT n, that is a backward scan
+    of the unique index, and then reversed, instead of a COUNT(*) followed by an OFFSET.
+
+    Missing buckets are found with a window query (LAG over the timestamps), returning only the pairs of
+    consecutive ohlcs more distant than the timeframe, with the close prices of the ohlc before the gap.
+
+    Rows are decoded at once into a float64 array of NUM_COLUMNS columns (timestamp in second,
+    bid OHLC, ofr OHLC, volume), from which the candles can be built.
+    """
+
+    __slots__ = '_by_market', '_queries'
+
+    COLUMNS = "timestamp, bid_open, bid_high, bid_low, bid_close, ask_open, ask_high, ask_low, ask_close, volume"
+
+    TIMESTAMP = 0
+    BID_OPEN = 1
+    BID_HIGH = 2
+    BID_LOW = 3
+    BID_CLOSE = 4
+    OFR_OPEN = 5
+    OFR_HIGH = 6
+    OFR_LOW = 7
+    OFR_CLOSE = 8
+    VOLUME = 9
+
+    NUM_COLUMNS = 10
+
+    FETCH_SIZE = 10000  # rows per fetchmany from a server side cursor
+
+    LAST_N = 0
+    FROM_TO = 1
+    FROM = 2
+    TO = 3
+    ALL = 4
+    FROM_LIMIT = 5
+    PAGE = 6
+    GAPS = 7
+
+    def __init__(self, param='%s', by_market=True):
+        where = "broker_id = {} AND market_id = {} AND timeframe = {}" if by_market else "timeframe = {}"
+        select = "SELECT " + OhlcQuery.COLUMNS + " FROM ohlc WHERE " + where
+
+        templates = {
+            OhlcQuery.LAST_N: select + " ORDER BY timestamp DESC LIMIT {}",
+            OhlcQuery.FROM_TO: select + " AND timestamp >= {} AND timestamp <= {} ORDER BY timestamp ASC",
+            OhlcQuery.FROM: select + " AND timestamp >= {} ORDER BY timestamp ASC",
+            OhlcQuery.TO: select + " AND timestamp <= {} ORDER BY timestamp ASC",
+            OhlcQuery.ALL: select + " ORDER BY timestamp ASC",
+            OhlcQuery.FROM_LIMIT: select + " AND timestamp >= {} ORDER BY timestamp ASC LIMIT {}",
+            OhlcQuery.PAGE: select + " AND timestamp > {} AND timestamp <= {} ORDER BY timestamp ASC LIMIT {}",
+            OhlcQuery.GAPS: "SELECT prev_ts, timestamp, prev_bid_close, prev_ask_close FROM ("
+                "SELECT timestamp, LAG(timestamp) OVER w AS prev_ts, LAG(bid_close) OVER w AS prev_bid_close, LAG(ask_close) OVER w AS prev_ask_close "
+                "FROM ohlc WHERE " + where + " AND timestamp >= {} AND timestamp <= {} WINDOW w AS (ORDER BY timestamp)) AS g "
+                "WHERE timestamp - prev_ts > {} ORDER BY timestamp ASC",
+        }
+
+        self._by_market = by_market
+        self._queries = {}
+
+        for kind, template in templates.items():
+            n = template.count('{}')
+
+            if param == '$':
+                # numbered parameters
+                self._queries[kind] = template.format(*['$%i' % (i+1) for i in range(n)])
+            else:
+                self._queries[kind] = template.format(*[param] * n)
+
+    def sql(self, kind):
+        return self._queries[kind]
+
+    def build(self, timeframe, from_ts=None, to_ts=None, last_n=None, market=None, limit=None):
+        """
+        Select the query and its parameters.
+        @param from_ts Optional timestamp in ms.
+        @param to_ts Optional timestamp in ms.
+        @param last_n Optional, when defined from_ts and to_ts are ignored.
+        @param market Tuple (broker_id, market_id), only if by market.
+        @param limit Optional max number of ohlcs from from_ts (ignored if to_ts).
+        @return A tuple (kind, sql, params).
+        """
+        params = (*market, timeframe) if self._by_market else (timeframe,)
+
+        if last_n:
+            kind, params = OhlcQuery.LAST_N, (*params, int(last_n))
+        elif from_ts and to_ts:
+            kind, params = OhlcQuery.FROM_TO, (*params, int(from_ts), int(to_ts))
+        elif from_ts and limit:
+            kind, params = OhlcQuery.FROM_LIMIT, (*params, int(from_ts), int(limit))
+        elif from_ts:
+            kind, params = OhlcQuery.FROM, (*params, int(from_ts))
+        elif to_ts:
+            kind, params = OhlcQuery.TO, (*params, int(to_ts))
+        else:
+            kind = OhlcQuery.ALL
+
+        return kind, self._queries[kind], params
+
+    def page(self, timeframe, after_ts, to_ts, limit, market=None):
+        """
+        Query of the next page of at most limit ohlcs after a timestamp (keyset pagination, using the index
+        from the last fetched timestamp in place of an OFFSET).
+        @param after_ts Timestamp in ms of the last fetched ohlc (excluded).
+        @param to_ts Timestamp in ms (included).
+        @return A tuple (sql, params).
+        """
+        params = (*market, timeframe) if self._by_market else (timeframe,)
+
+        return self._queries[OhlcQuery.PAGE], (*params, int(after_ts), int(to_ts), int(limit))
+
+    def gaps(self, timeframe, from_ts, to_ts, market=None):
+        """
+        Query of the gaps between from_ts and to_ts, that is the ohlcs having their previous one older than the timeframe.
+        @param from_ts Timestamp in ms (included).
+        @param to_ts Timestamp in ms (included).
+        @return A tuple (sql, params), rows are (previous timestamp, timestamp, previous bid close, previous ofr close).
+        """
+        params = (*market, timeframe) if self._by_market else (timeframe,)
+
+        return self._queries[OhlcQuery.GAPS], (*params, int(from_ts), int(to_ts), int(timeframe * 1000))
+
+    #
+    # decoding
+    #
+
+    @staticmethod
+    def decode(rows, reverse=False):
+        """
+        Decode a list of rows into a float64 array of NUM_COLUMNS columns with a timestamp in second.
+        @param reverse True if the rows are in descending timestamp order (last n query).
+        """
+        if not rows:
+            return np.empty((0, OhlcQuery.NUM_COLUMNS))
+
+        data = np.array(rows, dtype=np.float64)
+        data[:, OhlcQuery.TIMESTAMP] *= 0.001
+
+        return data[::-1] if reverse else data
+
+    @staticmethod
+    def fetch(cursor, reverse=False, fetch_size=FETCH_SIZE):
+        """
+        Fetch and decode all the rows of an executed query, per chunk of fetch_size rows, in way to
+        never have the whole rows list in memory when the cursor is a server side one.
+        """
+        chunks = []
+
+        while True:
+            rows = cursor.fetchmany(fetch_size)
+            if not rows:
+                break
+
+            chunks.append(OhlcQuery.decode(rows))
+
+            if len(rows) < fetch_size:
+                break
+
+        if not chunks:
+            return np.empty((0, OhlcQuery.NUM_COLUMNS))
+
+        data = chunks[0] if len(chunks) == 1 else np.concatenate(chunks)
+
+        return data[::-1] if reverse else data
+
+    @staticmethod
+    def candles(data, timeframe):
+        """
+        Build the list of candles from a decoded array.
+        The last candle is not consolidated if it is the current one.
+        """
+        ohlcs = []
+
+        for row in data.tolist():
+            ohlc = Candle(row[0], timeframe)
+
+            ohlc.set_bid_ohlc(row[1], row[2], row[3], row[4])
+            ohlc.set_ofr_ohlc(row[5], row[6], row[7], row[8])
+
+            # if row[9] <= 0:
+            #   # prefer to ignore empty volume ohlc because it can broke volume signal and it is a no way but it could be
+            #   # a lack of this information like on SPX500 of ig.com. So how to manage that cases...
+            #   continue
+
+            ohlc.set_volume(row[9])
+
+            ohlcs.append(ohlc)
+
+        if ohlcs and ohlcs[-1].timestamp >= Instrument.basetime(timeframe, time.time()):
+            ohlcs[-1].set_consolidated(False)  # current
+
+        return ohlcs
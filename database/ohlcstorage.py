@@ -8,9 +8,13 @@ import json
 import time
 import threading
 import traceback
+import collections
+
+import numpy as np
 
 from notifier.signal import Signal
-from instrument.instrument import Candle
+
+from .ohlcquery import OhlcQuery
 
 import logging
 logger = logging.getLogger('siis.database')
@@ -29,6 +33,7 @@ class OhlcStorage(object):
 
     DEFAULT_FLUSH_DELAY = 5*60  # every 5 mins
     MAX_PENDING_LEN = 500       # or 500 inserts
+    BATCH_SIZE = 5000           # max rows per executemany
 
     # must be from lesser timeframe to higher
     CLEANERS = (
@@ -44,11 +49,18 @@ class OhlcStorage(object):
         self._broker_id = broker_id
         self._market_id = market_id
 
+        self._mutex = threading.Lock()
+
         self._ohlcs = []
 
         self._queries = []
         self._last_write = 0
 
+        self._query = OhlcQuery('?', False)
+
+        self._batch_size = OhlcStorage.BATCH_SIZE
+        self._last_flush_time = 0.0   # duration of the last flush in seconds
+
     def set_thread_id(self, thread_id):
         self._thread_id = thread_id
 
@@ -62,6 +74,13 @@ class OhlcStorage(object):
     def has_query(self):
         return len(self._queries) > 0
 
+    def set_batch_size(self, batch_size):
+        self._batch_size = max(1, batch_size)
+
+    @property
+    def last_flush_time(self):
+        return self._last_flush_time
+
     def store(self, data):
         """
         @param data is a tuple or an array of tuples containing data in that order and format :
@@ -86,27 +105,38 @@ class OhlcStorage(object):
 
     def flush(self):
         self._mutex.acquire()
-        ohlcs = self._ohlcs = []
+        ohlcs = self._ohlcs
+        self._ohlcs = []
         self._mutex.release()
 
+        t = time.perf_counter()
+        n = 0
+
         try:
             cursor = self._db.cursor()
 
-            for ohlc in ohlcs:
-                cursor.execute("""
+            # insert by batch, the broker and market are implicit to the DB
+            while n < len(ohlcs):
+                batch = ohlcs[n:n+self._batch_size]
+
+                cursor.executemany("""
                     INSERT INTO ohlc(timestamp, timeframe, bid_open, bid_high, bid_low, bid_close, ask_open, ask_high, ask_low, ask_close, volume)
-                        VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", ohlc)
+                        VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", (ohlc[2:] for ohlc in batch))
 
-            self._db.commit()
+                self._db.commit()
+                n += len(batch)
 
         except Exception as e:
             logger.error(repr(e))
+            self._db.rollback()
 
-            # retry next time
+            # retry next time the non committed ones
             self._mutex.acquire()
-            self._ohlcs = ohlcs + self._ohlcs
+            self._ohlcs = ohlcs[n:] + self._ohlcs
             self._mutex.release()
 
+        self._last_flush_time = time.perf_counter() - t
+
     def clean(self):
         now = time.time()
 
@@ -126,87 +156,42 @@ class OhlcStorage(object):
         self._queries.append((service, timeframe, from_date, to_date, limit))
         self._mutex.release()
 
-    def query(self, timeframe, from_date, to_date, limit_or_last_n, auto_close=True):
+    def query(self, timeframe, from_date, to_date, limit_or_last_n, auto_close=True, as_array=False):
         """
         Query ohlcs for a timeframe.
         @param from_date Optional
         @param to_date Optional
-        @param limit_or_last_n Optional
+        @param limit_or_last_n Optional, limit if from_date else last n
+        @param as_array If True returns the decoded float64 array (@see OhlcQuery.decode) in place of the candles.
         """
-        cursor = self._db.cursor()
+        from_ts = int(from_date.timestamp() * 1000.0) if from_date else None
+        to_ts = int(to_date.timestamp() * 1000.0) if to_date else None
+
+        if from_ts:
+            kind, sql, params = self._query.build(timeframe, from_ts, to_ts, limit=limit_or_last_n)
+        else:
+            kind, sql, params = self._query.build(timeframe, from_ts, to_ts, last_n=limit_or_last_n)
 
         try:
-            if from_date and to_date:
-                from_ts = int(from_date.timestamp() * 1000.0)
-                to_ts = int(to_date.timestamp() * 1000.0)
-                self.query_from_to(cursor, timeframe, from_date, to_date)
-            elif from_date:
-                from_ts = int(from_date.timestamp() * 1000.0)
-                self.query_from_limit(cursor, timeframe, from_date, limit_or_last_n)
-            elif to_date:
-                to_ts = int(to_date.timestamp() * 1000.0)
-                self.query_from_limit(cursor, timeframe, to_date)
-            elif limit:
-                self.query_last(cursor, timeframe, limit_or_last_n)
-            else:
-                self.query_all(cursor, timeframe)
+            cursor = self._db.cursor()
+            cursor.execute(sql, params)
+
+            data = OhlcQuery.fetch(cursor, kind == OhlcQuery.LAST_N)
         except Exception as e:
             logger.error(repr(e))
 
             self.close()
-            return []
-
-        rows = cursor.fetchall()
-        ohlcs = []
-
-        for row in rows:
-            timestamp = float(row[0]) * 0.001  # to float second timestamp
-            ohlc = Candle(timestamp, timeframe)
-
-            ohlc.set_bid_ohlc(float(row[1]), float(row[2]), float(row[3]), float(row[4]))
-            ohlc.set_ofr_ohlc(float(row[5]), float(row[6]), float(row[7]), float(row[8]))
-
-            ohlc.set_volume(float(row[9]))
-
-            ohlcs.append(ohlc)
+            return np.empty((0, OhlcQuery.NUM_COLUMNS)) if as_array else []
 
         if auto_close:
             self.close()
 
-        return data
-
-    def query_all(self, cursor, timeframe):
-        cursor.execute("""SELECT timestamp, bid_open, bid_high, bid_low, bid_close, ask_open, ask_high, ask_low, ask_close, volume FROM ohlc
-                            WHERE timeframe = %s ORDER BY timestamp ASC""" % (timeframe,))
-
-    def query_last(self, cursor, timeframe, limit):
-        cursor.execute("""SELECT COUNT(*) FROM ohlc WHERE timeframe = %s""" % (timeframe,))
-        count = int(cursor.fetchone()[0])
-        offset = max(0, count - limit)
-
-        # LIMIT should not be necessary then
-        cursor.execute("""SELECT timestamp, bid_open, bid_high, bid_low, bid_close, ask_open, ask_high, ask_low, ask_close, volume FROM ohlc
-                        WHERE timeframe = %s ORDER BY timestamp ASC LIMIT %i OFFSET %i""" % (timeframe, limit, offset))
-
-    def query_from_to(self, cursor, timeframe, from_ts, to_ts):
-        cursor.execute("""SELECT timestamp, bid_open, bid_high, bid_low, bid_close, ask_open, ask_high, ask_low, ask_close, volume FROM ohlc
-                        WHERE timeframe = %s AND timestamp >= %i AND timestamp <= %i ORDER BY timestamp ASC""" % (
-                            timeframe, from_ts, to_ts))
-
-    def query_from_limit(self, cursor, timeframe, from_ts, limit):
-        cursor.execute("""SELECT timestamp, bid_open, bid_high, bid_low, bid_close, ask_open, ask_high, ask_low, ask_close, volume FROM ohlc
-                        WHERE timeframe = %s AND timestamp >= %i ORDER BY timestamp ASC LIMIT %i""" % (
-                            timeframe, from_ts, limit))
-
-    def query_to(self, cursor, timeframe, to_ts):
-        cursor.execute("""SELECT timestamp, bid_open, bid_high, bid_low, bid_close, ask_open, ask_high, ask_low, ask_close, volume FROM ohlc
-                        WHERE timeframe = %s AND timestamp <= %i ORDER BY timestamp ASC""" % (
-                            timeframe, to_ts))
+        return data if as_array else OhlcQuery.candles(data, timeframe)
 
     def process_async_queries(self):
         self._mutex.acquire()
         queries = self._queries
-        self._queries.clear()
+        self._queries = []
         self._mutex.release()
 
         failed = []
@@ -216,16 +201,16 @@ class OhlcStorage(object):
                 ohlcs = self.query(query[1], query[2], query[3], query[4], False)
                 
                 # and signal notification
-                service.notify(Signal.SIGNAL_CANDLE_DATA_BULK, self._broker_id, (self._market_id, query[1], ohlcs))
+                query[0].notify(Signal.SIGNAL_CANDLE_DATA_BULK, self._broker_id, (self._market_id, query[1], ohlcs))
             except Exception as e:
                 logger.error(repr(e))
                 failed.append(query)
 
         # retry the next time
         if failed:
-            self.lock()
+            self._mutex.acquire()
             self._queries = failed + self._queries
-            self.unlock()
+            self._mutex.release()
 
     def process(self):
         """
@@ -255,106 +240,191 @@ class OhlcStorage(object):
 
 class OhlcStreamer(object):
     """
-    Streamer that read ohlc from a start to end date.
+    Streamer that read ohlc from a start to end date, by pages of buffer_size ohlcs.
     @note Generic SQL.
+
+    Pages are selected by keyset pagination : the next one starts after the timestamp of the last
+    fetched ohlc, using the unique index of (broker_id, market_id, timestamp, timeframe).
+    Once a page is consumed into the buffer, the next one is prefetched from a background thread,
+    querying the connection dedicated to the streamers under their shared lock.
+
+    If a local cache is given, the pages are read from it first, and the pages read from the SQL DB are written to it.
+
+    An ohlc is returned once closed, that is when its timestamp + timeframe is lesser or equal to
+    the requested timestamp, to not look ahead of the current candle.
+
+    A failed query of a page is retried up to MAX_RETRY times, then the streamer is finished but marked as failed,
+    in way for the caller to abort rather than to process a truncated stream.
     """
 
-    def __init__(self, db, timeframe, from_date, to_date=None, buffer_size=1000):
+    MAX_RETRY = 3
+    RETRY_DELAY = 1.0  # in seconds
+
+    def __init__(self, db, mutex, query, broker_id, market_id, timeframe, from_date, to_date=None, buffer_size=1000, cache=None):
         """
+        @param db Connection (in autocommit)
+        @param mutex Lock of the connection
+        @param query OhlcQuery of the connection placeholder style, filtered by market
+        @param cache Optional OhlcCache of the market and timeframe
         @param from_date datetime Object
         @param to_date datetime Object
         """
-
         self._db = db
+        self._mutex = mutex
+        self._query = query
+        self._cache = cache
+
+        self._broker_id = broker_id
+        self._market_id = market_id
         self._timeframe = timeframe
 
         self._from_date = from_date
         self._to_date = to_date
-        
-        self._curr_date = from_date
 
+        self._to_ts = int(to_date.timestamp() * 1000) if to_date else int(time.time() * 1000)
+        self._last_ts = int(from_date.timestamp() * 1000) - 1 if from_date else -1  # last fetched timestamp (ms)
+
+        self._buffer = collections.deque()
         self._buffer_size = buffer_size
 
+        self._eof = self._db is None   # no more page to fetch
+        self._prefetch = None          # prefetching thread
+        self._page = None              # prefetched page
+        self._failed = False           # a page cannot be fetched
+
     def finished(self):
-        return self._curr_date >= self._to_date and not self._ohlcs
+        return self._eof and self._prefetch is None and not self._buffer
+
+    def failed(self):
+        """
+        True if a page cannot be fetched, the stream is then truncated.
+        """
+        return self._failed
+
+    def close(self):
+        if self._prefetch:
+            self._prefetch.join()
+            self._prefetch = None
+
+        self._page = None
+        self._buffer.clear()
+        self._eof = True
 
     def next(self, timestamp):
-        # @todo
-        return []
+        """
+        Returns the list of the closed ohlcs until the timestamp.
+        """
+        results = []
+        delta = self._timeframe
 
-    def __bufferize(self):
-        results = self.query(self, self._timeframe, self._curr_date, None, limit, False)
-        if results:
-            self._buffer.extend(results)
+        while 1:
+            if not self._buffer:
+                self.__bufferize()
 
-    def query(self, timeframe, from_date, to_date, limit_or_last_n, auto_close=True):
+            while self._buffer and self._buffer[0]._timestamp + delta <= timestamp:
+                results.append(self._buffer.popleft())
+
+            if self.finished() or (self._buffer and self._buffer[0]._timestamp + delta > timestamp):
+                break
+
+        return results
+
+    def next_timestamp(self):
         """
-        Query ohlcs for a timeframe.
-        @param from_date Optional
-        @param to_date Optional
-        @param limit_or_last_n Optional
+        Timestamp at which the next ohlc is closed without consuming it, or None if there is no more ohlc.
         """
-        cursor = self._db.cursor()
+        if not self._buffer and not self.finished():
+            self.__bufferize()
 
-        try:
-            if from_date and to_date:
-                from_ts = int(from_date.timestamp() * 1000.0)
-                to_ts = int(to_date.timestamp() * 1000.0)
-                self.query_from_to(cursor, timeframe, from_date, to_date)
-            elif from_date:
-                from_ts = int(from_date.timestamp() * 1000.0)
-                self.query_from_limit(cursor, timeframe, from_date, limit_or_last_n)
-            elif to_date:
-                to_ts = int(to_date.timestamp() * 1000.0)
-                self.query_from_limit(cursor, timeframe, to_date)
-            elif limit:
-                self.query_last(cursor, timeframe, limit_or_last_n)
-            else:
-                self.query_all(cursor, timeframe)
-        except Exception as e:
-            logger.error(repr(e))
-            return []
+        if self._buffer:
+            return self._buffer[0]._timestamp + self._timeframe
+
+        return None
 
-        rows = cursor.fetchall()
-        ohlcs = []
+    def __fetch(self):
+        """
+        Read the page following the last fetched timestamp from the cache, else from the SQL DB.
+        @return A tuple (data array or None on error, True if it is the last page).
+        """
+        if self._cache is not None:
+            last_closed = self._cache.last_closed(time.time())
+            after = self._last_ts * 0.001
+
+            if after < last_closed:
+                to = min(self._to_ts * 0.001, last_closed)
+                data, complete = self._cache.read_page(after, to, self._buffer_size)
+
+                if len(data):
+                    return data, complete and to >= self._to_ts * 0.001
+
+                # from the DB, and keep the consolidated ones into the cache
+                data = self.__query()
+
+                if data is not None:
+                    closed = data[data[:, 0] <= last_closed]
+                    last = to if len(data) < self._buffer_size else closed[-1, 0] if len(closed) else after
+
+                    self._cache.store(closed, after + 0.001, last)
+
+                    return data, len(data) < self._buffer_size
+
+                return None, True
+
+        data = self.__query()
 
-        for row in rows:
-            timestamp = float(row[0]) * 0.001  # to float second timestamp
-            ohlc = Candle(timestamp, timeframe)
+        return data, data is None or len(data) < self._buffer_size
 
-            ohlc.set_bid_ohlc(float(row[1]), float(row[2]), float(row[3]), float(row[4]))
-            ohlc.set_ofr_ohlc(float(row[5]), float(row[6]), float(row[7]), float(row[8]))
+    def __query(self):
+        """
+        Query and decode the page following the last fetched timestamp, retried on error.
+        @return The data array, or None if all the retries failed, and then the streamer is marked as failed.
+        """
+        sql, params = self._query.page(self._timeframe, self._last_ts, self._to_ts, self._buffer_size, (self._broker_id, self._market_id))
+
+        for retry in range(0, OhlcStreamer.MAX_RETRY+1):
+            if retry:
+                time.sleep(OhlcStreamer.RETRY_DELAY)
 
-            ohlc.set_volume(float(row[9]))
+            self._mutex.acquire()
+            try:
+                cursor = self._db.cursor()
+                cursor.execute(sql, params)
 
-            ohlcs.append(ohlc)
+                return OhlcQuery.decode(cursor.fetchall())
+            except Exception as e:
+                logger.error(repr(e))
+            finally:
+                self._mutex.release()
 
-        return data
+        logger.error("Unable to stream ohlc of %s %s after %i retries" % (self._market_id, self._timeframe, OhlcStreamer.MAX_RETRY))
+        self._failed = True
 
-    def query_all(self, cursor, timeframe):
-        cursor.execute("""SELECT timestamp, bid_open, bid_high, bid_low, bid_close, ask_open, ask_high, ask_low, ask_close, volume FROM ohlc
-                            WHERE timeframe = %s ORDER BY timestamp ASC""" % (timeframe,))
+        return None
 
-    def query_last(self, cursor, timeframe, limit):
-        cursor.execute("""SELECT COUNT(*) FROM ohlc WHERE timeframe = %s""" % (timeframe,))
-        count = int(cursor.fetchone()[0])
-        offset = max(0, count - limit)
+    def __run_prefetch(self):
+        self._page = self.__fetch()
 
-        # LIMIT should not be necessary then
-        cursor.execute("""SELECT timestamp, bid_open, bid_high, bid_low, bid_close, ask_open, ask_high, ask_low, ask_close, volume FROM ohlc
-                        WHERE timeframe = %s ORDER BY timestamp ASC LIMIT %i OFFSET %i""" % (timeframe, limit, offset))
+    def __bufferize(self):
+        if self._prefetch:
+            # wait for the prefetched page
+            self._prefetch.join()
+            self._prefetch = None
+
+            data, last_page = self._page
+            self._page = None
+        elif not self._eof:
+            data, last_page = self.__fetch()
+        else:
+            return
 
-    def query_from_to(self, cursor, timeframe, from_ts, to_ts):
-        cursor.execute("""SELECT timestamp, bid_open, bid_high, bid_low, bid_close, ask_open, ask_high, ask_low, ask_close, volume FROM ohlc
-                        WHERE timeframe = %s AND timestamp >= %i AND timestamp <= %i ORDER BY timestamp ASC""" % (
-                            timeframe, from_ts, to_ts))
+        if last_page:
+            # on error stop there too, but the streamer is failed
+            self._eof = True
 
-    def query_from_limit(self, cursor, timeframe, from_ts, limit):
-        cursor.execute("""SELECT timestamp, bid_open, bid_high, bid_low, bid_close, ask_open, ask_high, ask_low, ask_close, volume FROM ohlc
-                        WHERE timeframe = %s AND timestamp >= %i ORDER BY timestamp ASC LIMIT %i""" % (
-                            timeframe, from_ts, limit))
+        if data is not None and len(data):
+            self._last_ts = int(round(data[-1, OhlcQuery.TIMESTAMP] * 1000))
+            self._buffer.extend(OhlcQuery.candles(data, self._timeframe))
 
-    def query_to(self, cursor, timeframe, to_ts):
-        cursor.execute("""SELECT timestamp, bid_open, bid_high, bid_low, bid_close, ask_open, ask_high, ask_low, ask_close, volume FROM ohlc
-                        WHERE timeframe = %s AND timestamp <= %i ORDER BY timestamp ASC""" % (
-                            timeframe, to_ts))
+        if not self._eof:
+            self._prefetch = threading.Thread(name="ohlc-prefetch", target=self.__run_prefetch)
+            self._prefetch.start()
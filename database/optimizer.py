@@ -3,53 +3,390 @@
 # @license Copyright (c) 2019 Dream Overflow
 # Candle market DB checker/optimizer.
 
+import os
+import time
+import pathlib
+
+import numpy as np
+
+from datetime import datetime
+
 import logging
 logger = logging.getLogger('siis.database.optimizer')
 
+from common.utils import UTC
+
 from database.database import Database
-from database.tickstorage import TickStorage, TickSteamer, TextToBinary
+from database.tickstorage import TickStorage, TickStreamer, TextToBinary
+from database.tickarchive import TickArchive
+
+from instrument.instrument import Instrument
+from instrument.candlegenerator import CandleGenerator
 
 
 class OhlcOptimizer(object):
 	"""
-	Tick data optimizer/validate.
-	
-	@todo Check for missing Ohlc
-	@todo Repair with missing Ohlc
-	@todo Take care of week-end/off-market
+	Ohlc data optimizer/validate, for a market and a timeframe of the SQL DB.
+
+	The gaps are found with a window query (@see OhlcQuery.gaps), and classified as for the ticks, the market closed
+	periods (week-ends and daily sessions) being kept as is. The missing ohlcs of a gap are rebuilt from the local
+	tick files with a CandleGenerator, the buckets without tick being flat ohlcs at the previous close and with no
+	volume, and then upserted in bulk by the database. A gap without any local tick is returned as a range to re-fetch.
+
+	Month timeframe is not supported because its buckets are not regular.
 	"""
 
-	def __init__(self, db, broker_id, market_id):
+	def __init__(self, db, broker_id, market_id, timeframe, from_date=None, to_date=None, markets_path=None):
+		"""
+		@param from_date Optional datetime, else from the first ohlc.
+		@param to_date Optional datetime, else until now.
+		@param markets_path Path of the tick files, if None the gaps are not rebuilt.
+		"""
 		self._db = db
 
 		self._broker_id = broker_id
 		self._market_id = market_id
+		self._timeframe = timeframe
 
-	def optimize(self):
-		# @todo
-		pass
+		self._from_date = from_date
+		self._to_date = to_date
+
+		self._markets_path = markets_path
 
 	def detect_gaps(self):
-		# @todo
-		return []
+		"""
+		@return A list of tuples (first missing timestamp, last missing timestamp, kind, previous bid close,
+			previous ofr close), timestamps in second.
+		"""
+		if self._timeframe <= 0 or self._timeframe >= Instrument.TF_MONTH:
+			return []
+
+		from_ts = int(self._from_date.timestamp() * 1000) if self._from_date else 0
+		to_ts = int((self._to_date.timestamp() if self._to_date else time.time()) * 1000)
+
+		rows = self._db.query_ohlc_gaps(self._broker_id, self._market_id, self._timeframe, from_ts, to_ts)
+
+		if not rows:
+			return []
+
+		# periods without ohlc, from the end of the previous one
+		periods = np.array([(row[0] * 0.001 + self._timeframe, row[1] * 0.001) for row in rows])
+		kinds = TickOptimizer.classify(periods)
+
+		return [(period[0], period[1] - self._timeframe, kind, row[2], row[3]) for period, kind, row in zip(
+				periods.tolist(), kinds.tolist(), rows)]
+
+	def rebuild(self, first, last, prev_bid, prev_ofr):
+		"""
+		Rebuild the ohlcs from first to last (timestamps in second) from the local tick files.
+		@return A list of rows (@see Database.store_market_ohlc), or None if there is no tick.
+		"""
+		if not self._markets_path:
+			return None
+
+		end = last + self._timeframe
+
+		streamer = TickStreamer(self._markets_path, self._broker_id, self._market_id,
+				datetime.fromtimestamp(first, tz=UTC()), datetime.fromtimestamp(end, tz=UTC()), use_mmap=True)
+
+		try:
+			ticks = streamer.next_array(end)
+			ticks = ticks[(ticks['t'] >= first) & (ticks['t'] < end)]
+		finally:
+			streamer.close()
+
+		if not len(ticks):
+			return None
+
+		generator = CandleGenerator(0, self._timeframe)
+
+		candles = generator.generate_from_ticks(ticks)
+		if generator.current:
+			candles.append(generator.current)
+
+		candles = {int(round(candle.timestamp * 1000)): candle for candle in candles}
+
+		rows = []
+		bid, ofr = prev_bid, prev_ofr
+		tf_ms = int(self._timeframe * 1000)
+
+		for ts in range(int(round(first * 1000)), int(round(last * 1000)) + 1, tf_ms):
+			candle = candles.get(ts)
+
+			if candle:
+				rows.append((self._broker_id, self._market_id, ts, int(self._timeframe),
+						candle.bid_open, candle.bid_high, candle.bid_low, candle.bid_close,
+						candle.ofr_open, candle.ofr_high, candle.ofr_low, candle.ofr_close,
+						candle.volume))
+
+				bid, ofr = candle.bid_close, candle.ofr_close
+			else:
+				# no trade during this bucket
+				rows.append((self._broker_id, self._market_id, ts, int(self._timeframe), bid, bid, bid, bid, ofr, ofr, ofr, ofr, 0.0))
+
+		return rows
+
+	def optimize(self, gaps=None):
+		"""
+		Repair the gaps, closed market periods excepted.
+		@param gaps Optional result of detect_gaps, else they are detected.
+		@return A tuple (list of repaired (first, last, number of ohlcs), list of (first, last) ranges to re-fetch).
+		"""
+		if gaps is None:
+			gaps = self.detect_gaps()
+
+		repaired = []
+		refetch = []
+		rows = []
+
+		for first, last, kind, prev_bid, prev_ofr in gaps:
+			if kind != TickOptimizer.GAP:
+				continue
+
+			try:
+				gap_rows = self.rebuild(first, last, prev_bid, prev_ofr)
+			except Exception as e:
+				logger.error(repr(e))
+				gap_rows = None
+
+			if gap_rows is None:
+				refetch.append((first, last))
+				continue
+
+			rows.extend(gap_rows)
+			repaired.append((first, last, len(gap_rows)))
+
+		if rows:
+			# bulk upsert by the database thread
+			self._db.store_market_ohlc(rows)
+
+		return repaired, refetch
 
 
 class TickOptimizer(object):
 	"""
-	Tick data optimizer/validate.
-	
-	@todo Check for GAP of tick (Take care of week-end/off-market)
-	@todo Reorder the ticks and recreate the file if necessary
+	Tick data optimizer/validate, for the monthly binary tick files of a market.
+
+	Multiple watchers, or a fetch during a watch, can append duplicated or unordered ticks, that then break the
+	binary search of the streamer. Each monthly file is memory-mapped, and only if its timestamps are not strictly
+	increasing, its ticks are stable sorted by timestamp, the exact duplicates of (t, b, o, v) removed, and the file
+	atomically replaced (and its compressed archive rewritten if any).
+
+	Gaps are the intervals without tick longer than a minimal duration. A gap is reported as closed when the
+	market is off : if it covers a whole week-end (it starts on Friday or Saturday, ends on Sunday or Monday), or
+	if it is a recurring daily session (the same start and end time of the day for at least SESSION_DAYS days).
+
+	It must not be run while a watcher writes the same market.
 	"""
 
-	def __init__(self, broker_id, market_id):
+	GAP = 0
+	WEEKEND = 1
+	SESSION = 2
+
+	GAP_KINDS = ('gap', 'week-end', 'session')
+
+	DEFAULT_MIN_GAP = 15*60   # 15 minutes
+	SESSION_DAYS = 3          # a gap at the same time of the day at least 3 days is a daily closed session
+	SESSION_BIN = 15*60       # time of the day precision of the sessions
+
+	def __init__(self, markets_path, broker_id, market_id, from_date=None, to_date=None):
+		"""
+		@param from_date Optional datetime, else from the first monthly file.
+		@param to_date Optional datetime, else to the last monthly file.
+		"""
+		self._markets_path = markets_path
 		self._broker_id = broker_id
 		self._market_id = market_id
 
+		self._from_date = from_date
+		self._to_date = to_date
+
+		self._data_path = pathlib.Path(markets_path, broker_id, market_id, 'T')
+
+	def months(self):
+		"""
+		List of the months (year, month) having a binary file, within the from/to dates.
+		"""
+		months = []
+
+		if not self._data_path.exists():
+			return months
+
+		suffix = self._market_id + ".dat"
+
+		for pathname in self._data_path.iterdir():
+			name = pathname.name
+
+			if name.endswith(suffix) and len(name) == len(suffix) + 6 and name[:6].isdigit():
+				month = (int(name[0:4]), int(name[4:6]))
+
+				if self._from_date and month < (self._from_date.year, self._from_date.month):
+					continue
+
+				if self._to_date and month > (self._to_date.year, self._to_date.month):
+					continue
+
+				months.append(month)
+
+		return sorted(months)
+
+	def pathname(self, month):
+		return str(self._data_path.joinpath("%04i%02i%s.dat" % (month[0], month[1], self._market_id)))
+
+	@staticmethod
+	def map_ticks(pathname):
+		"""
+		Memory-map a binary tick file as an array of shape (n, 4), ignoring an incomplete trailing tick.
+		"""
+		count = os.path.getsize(pathname) // 32
+
+		if not count:
+			return np.empty((0, 4))
+
+		return np.memmap(pathname, dtype='<f8', mode='r', shape=(count, 4))
+
+	@staticmethod
+	def sort_dedup(ticks):
+		"""
+		Stable sort by timestamp and remove the exact duplicates of (t, b, o, v), keeping the first occurrence.
+		The order of the ticks of a same timestamp is preserved.
+		@return The indices of the ticks to keep, in order.
+		"""
+		# identical ticks are contiguous, and the first one has the lowest index because lexsort is stable
+		order = np.lexsort((ticks[:, 3], ticks[:, 2], ticks[:, 1], ticks[:, 0]))
+		rows = ticks[order]
+
+		unique = np.ones(len(rows), dtype=bool)
+		unique[1:] = np.any(rows[1:] != rows[:-1], axis=1)
+
+		keep = np.sort(order[unique])
+		return keep[np.argsort(ticks[keep, 0], kind='stable')]
+
+	def optimize_month(self, month):
+		"""
+		@return A tuple (number of ticks, number of removed duplicates, True if the file has been rewritten).
+		"""
+		pathname = self.pathname(month)
+		ticks = TickOptimizer.map_ticks(pathname)
+		count = len(ticks)
+
+		truncated = os.path.getsize(pathname) != count * 32
+
+		if not count:
+			return 0, 0, False
+
+		if not truncated and np.all(ticks[1:, 0] > ticks[:-1, 0]):
+			# strictly increasing, nothing to do
+			return count, 0, False
+
+		keep = TickOptimizer.sort_dedup(ticks)
+		optimized = np.ascontiguousarray(ticks[keep])
+
+		# release the mapping before replacing the file
+		del ticks
+
+		tmpname = pathname + '.tmp'
+		with open(tmpname, 'wb') as f:
+			f.write(optimized.tobytes())
+
+		os.replace(tmpname, pathname)
+
+		archive = str(self._data_path.joinpath(TickArchive.filename(self._market_id, month)))
+		if os.path.isfile(archive):
+			TickArchive.write(archive, optimized)
+
+		return count, count - len(keep), True
+
 	def optimize(self):
-		# @todo
-		pass
+		"""
+		@return A list of tuples (month, number of ticks, number of removed duplicates, rewritten, duration in second).
+		"""
+		results = []
 
-	def detect_gaps(self):
-		# @todo
-		return []
+		for month in self.months():
+			try:
+				start = time.time()
+				count, removed, rewritten = self.optimize_month(month)
+
+				results.append((month, count, removed, rewritten, time.time() - start))
+			except Exception as e:
+				logger.error("Unable to optimize %s : %s" % (self.pathname(month), repr(e)))
+
+		return results
+
+	@staticmethod
+	def classify(gaps):
+		"""
+		Kind of each gap (GAP, WEEKEND or SESSION).
+		@param gaps float64 array of shape (n, 2) of (from, to) timestamps.
+		"""
+		kinds = np.full(len(gaps), TickOptimizer.GAP, dtype=np.int32)
+
+		if not len(gaps):
+			return kinds
+
+		# week-end : from Friday or Saturday to Sunday or Monday, and long enough to cover the whole Saturday
+		day = 24*60*60
+		start_wd = ((gaps[:, 0] // day).astype(np.int64) + 3) % 7  # 0 is Monday (1970-01-01 is a Thursday)
+		end_wd = ((gaps[:, 1] // day).astype(np.int64) + 3) % 7
+
+		weekend = ((start_wd == 4) | (start_wd == 5)) & ((end_wd == 6) | (end_wd == 0)) & (gaps[:, 1] - gaps[:, 0] >= day)
+		kinds[weekend] = TickOptimizer.WEEKEND
+
+		# recurring daily sessions, same (start, end) times of the day on distinct days
+		bins = np.stack(((gaps[:, 0] % day) // TickOptimizer.SESSION_BIN, (gaps[:, 1] % day) // TickOptimizer.SESSION_BIN), axis=1)
+		candidates = ~weekend & (gaps[:, 1] - gaps[:, 0] < day)
+
+		if np.any(candidates):
+			keys, inverse, counts = np.unique(bins[candidates], axis=0, return_inverse=True, return_counts=True)
+			session = counts[inverse.reshape(-1)] >= TickOptimizer.SESSION_DAYS
+			kinds[np.flatnonzero(candidates)[session]] = TickOptimizer.SESSION
+
+		return kinds
+
+	def detect_gaps(self, min_gap=DEFAULT_MIN_GAP):
+		"""
+		Detect the intervals without ticks longer than min_gap, including between two months.
+		@param min_gap Minimal duration in second.
+		@return A list of tuples (from timestamp, to timestamp, kind).
+		"""
+		chunks = []
+		prev_last = None
+
+		from_ts = self._from_date.timestamp() if self._from_date else None
+		to_ts = self._to_date.timestamp() if self._to_date else None
+
+		for month in self.months():
+			try:
+				ticks = TickOptimizer.map_ticks(self.pathname(month))
+			except Exception as e:
+				logger.error(repr(e))
+				continue
+
+			if not len(ticks):
+				continue
+
+			t = np.array(ticks[:, 0])
+			del ticks
+
+			if from_ts is not None:
+				t = t[t >= from_ts]
+			if to_ts is not None:
+				t = t[t <= to_ts]
+
+			if not len(t):
+				continue
+
+			if prev_last is not None:
+				t = np.concatenate(([prev_last], t))
+
+			idx = np.flatnonzero(np.diff(t) > min_gap)
+			if len(idx):
+				chunks.append(np.stack((t[idx], t[idx+1]), axis=1))
+
+			prev_last = t[-1]
+
+		gaps = np.concatenate(chunks) if chunks else np.empty((0, 2))
+		kinds = TickOptimizer.classify(gaps)
+
+		return [(g[0], g[1], int(k)) for g, k in zip(gaps.tolist(), kinds.tolist())]
@@ -3,6 +3,7 @@
 # @license Copyright (c) 2018 Dream Overflow
 # Storage service, postgresql implementation
 
+import io
 import os
 import json
 import time
@@ -14,15 +15,14 @@ import pathlib
 from watcher.service import WatcherService
 from notifier.signal import Signal
 
-from instrument.instrument import Instrument, Candle
-
 from trader.market import Market
 from trader.asset import Asset
 
 from config.utils import databases
 
 from .tickstorage import TickStorage, TickStreamer
-from .ohlcstorage import OhlcStorage, OhlcStreamer
+from .ohlcstorage import OhlcStorage
+from .ohlcquery import OhlcQuery
 
 from .database import Database
 
@@ -48,14 +48,21 @@ class PgSql(Database):
 
     def connect(self, config):
         if 'siis' in config:
-            import psycopg2
+            self._db = self.open_connection(config)
+
+    def open_connection(self, config, autocommit=False):
+        import psycopg2
+
+        db = psycopg2.connect("dbname=%s user=%s password=%s host=%s port=%i" % (
+            'siis',
+            config['siis'].get('user', 'siis'),
+            config['siis'].get('password', 'siis'),
+            config['siis'].get('host', 'localhost'),
+            config['siis'].get('port', 5432)))
+
+        db.autocommit = autocommit
 
-            self._db = psycopg2.connect("dbname=%s user=%s password=%s host=%s port=%i" % (
-                'siis',
-                config['siis'].get('user', 'siis'),
-                config['siis'].get('password', 'siis'),
-                config['siis'].get('host', 'localhost'),
-                config['siis'].get('port', 5432)))
+        return db
 
     def disconnect(self):
         # postresql db
@@ -138,13 +145,47 @@ class PgSql(Database):
                 volume VARCHAR(48) NOT NULL,
                 UNIQUE(broker_id, market_id, timestamp, timeframe))""")
 
+        # staging table for the bulk loading, private to the session and emptied at each commit
+        cursor.execute("""
+            CREATE TEMPORARY TABLE IF NOT EXISTS ohlc_staging(
+                broker_id VARCHAR(255) NOT NULL, market_id VARCHAR(255) NOT NULL,
+                timestamp BIGINT NOT NULL, timeframe INTEGER NOT NULL,
+                bid_open VARCHAR(32) NOT NULL, bid_high VARCHAR(32) NOT NULL, bid_low VARCHAR(32) NOT NULL, bid_close VARCHAR(32) NOT NULL,
+                ask_open VARCHAR(32) NOT NULL, ask_high VARCHAR(32) NOT NULL, ask_low VARCHAR(32) NOT NULL, ask_close VARCHAR(32) NOT NULL,
+                volume VARCHAR(48) NOT NULL) ON COMMIT DELETE ROWS""")
+
+        # prepared statement of the last n ohlcs, planned once per session for the warm-up of the strategies
+        cursor.execute("PREPARE ohlc_last_n(VARCHAR, VARCHAR, INTEGER, INTEGER) AS " + OhlcQuery('$').sql(OhlcQuery.LAST_N))
+
         self._db.commit()
 
-    def create_ohlc_streamer(self, broker_id, market_id, timeframe, from_date, to_date, buffer_size=8192):
-        """
-        Create a new tick streamer.
-        """
-        return OhlcStreamer(self._db, timeframe, broker_id, market_id, from_date, to_date, buffer_size)
+    def query_ohlc(self, broker_id, market_id, timeframe, from_ts, to_ts, last_n):
+        kind, sql, params = self._ohlc_query.build(timeframe, from_ts, to_ts, last_n, (broker_id, market_id))
+
+        try:
+            if kind == OhlcQuery.LAST_N:
+                # bounded, through the prepared statement
+                cursor = self._db.cursor()
+                cursor.execute("EXECUTE ohlc_last_n(%s, %s, %s, %s)", params)
+
+                data = OhlcQuery.decode(cursor.fetchall(), True)
+            else:
+                # possibly large range, streamed from a server side cursor
+                cursor = self._db.cursor(name='ohlc_select')
+                cursor.itersize = OhlcQuery.FETCH_SIZE
+
+                cursor.execute(sql, params)
+                data = OhlcQuery.fetch(cursor)
+
+                cursor.close()
+
+            # terminate the read transaction
+            self._db.commit()
+        except Exception:
+            self._db.rollback()
+            raise
+
+        return data
 
     #
     # Processing
@@ -339,18 +380,27 @@ class PgSql(Database):
 
         if uai:
             try:
+                from psycopg2.extras import execute_values
+
                 cursor = self._db.cursor()
 
-                for ua in uai:
-                    cursor.execute("""
-                        INSERT INTO asset(broker_id, account_id, asset_id, last_trade_id, timestamp, quantity, price, quote_symbol)
-                            VALUES(%s, %s, %s, %s, %s, %s, %s, %s)
-                        ON CONFLICT (broker_id, asset_id) DO UPDATE SET 
-                            last_trade_id = %s, timestamp = %s, quantity = %s, price = %s, quote_symbol = %s""", (*ua, *ua[3:]))
+                for batch in self.batches(self.unique_rows(uai, 3)):
+                    t = time.perf_counter()
 
-                self._db.commit()
+                    execute_values(cursor, """
+                        INSERT INTO asset(broker_id, account_id, asset_id, last_trade_id, timestamp, quantity, price, quote_symbol) VALUES %s
+                        ON CONFLICT (broker_id, account_id, asset_id) DO UPDATE SET
+                            last_trade_id = EXCLUDED.last_trade_id, timestamp = EXCLUDED.timestamp, quantity = EXCLUDED.quantity,
+                            price = EXCLUDED.price, quote_symbol = EXCLUDED.quote_symbol""", batch, page_size=len(batch))
+
+                    self._db.commit()
+
+                    self.lock()
+                    self.add_batch_stat('asset', len(batch), time.perf_counter() - t)
+                    self.unlock()
             except Exception as e:
                 logger.error(repr(e))
+                self._db.rollback()
 
                 # retry the next time
                 self.lock()
@@ -409,21 +459,29 @@ class PgSql(Database):
 
         if uti:
             try:
+                from psycopg2.extras import execute_values
+
                 cursor = self._db.cursor()
 
-                query = ' '.join((
-                    "INSERT INTO user_trade(broker_id, account_id, market_id, appliance_id, trade_id, trade_type, data, operations) VALUES",
-                    ','.join(["('%s', '%s', '%s', '%s', %i, %i, '%s', '%s')" % (ut[0], ut[1], ut[2], ut[3], ut[4], ut[5],
-                            json.dumps(ut[6]).replace("'", "''"), json.dumps(ut[7]).replace("'", "''")) for ut in uti]),
-                    "ON CONFLICT (broker_id, account_id, market_id, appliance_id, trade_id) DO UPDATE SET data = EXCLUDED.data, operations = EXCLUDED.operations"
-                ))
+                rows = [(ut[0], ut[1], ut[2], ut[3], ut[4], ut[5], json.dumps(ut[6]), json.dumps(ut[7])) for ut in self.unique_rows(uti, 5)]
 
-                cursor.execute(query)
+                for batch in self.batches(rows):
+                    t = time.perf_counter()
 
-                self._db.commit()
+                    execute_values(cursor, """
+                        INSERT INTO user_trade(broker_id, account_id, market_id, appliance_id, trade_id, trade_type, data, operations) VALUES %s
+                        ON CONFLICT (broker_id, account_id, market_id, appliance_id, trade_id) DO UPDATE SET
+                            data = EXCLUDED.data, operations = EXCLUDED.operations""", batch, page_size=len(batch))
+
+                    self._db.commit()
+
+                    self.lock()
+                    self.add_batch_stat('user_trade', len(batch), time.perf_counter() - t)
+                    self.unlock()
             except Exception as e:
                 logger.error(repr(e))
                 error_logger.error(traceback.format_exc())
+                self._db.rollback()
 
                 # retry the next time
                 self.lock()
@@ -544,62 +602,13 @@ class PgSql(Database):
 
         if mks:
             try:
-                cursor = self._db.cursor()
+                while mks:
+                    mk = mks[0]
 
-                for mk in mks:
-                    if mk[6]:
-                        # last n
-                        cursor.execute("""SELECT COUNT(*) FROM ohlc WHERE broker_id = '%s' AND market_id = '%s' AND timeframe = %s""" % (mk[1], mk[2], mk[3]))
-                        count = int(cursor.fetchone()[0])
-                        offset = max(0, count - mk[6])
-
-                        # LIMIT should not be necessary then
-                        cursor.execute("""SELECT timestamp, bid_open, bid_high, bid_low, bid_close, ask_open, ask_high, ask_low, ask_close, volume FROM ohlc
-                                        WHERE broker_id = '%s' AND market_id = '%s' AND timeframe = %s ORDER BY timestamp ASC LIMIT %i OFFSET %i""" % (
-                                            mk[1], mk[2], mk[3], mk[6], offset))
-                    elif mk[4] and mk[5]:
-                        # from to
-                        cursor.execute("""SELECT timestamp, bid_open, bid_high, bid_low, bid_close, ask_open, ask_high, ask_low, ask_close, volume FROM ohlc
-                                        WHERE broker_id = '%s' AND market_id = '%s' AND timeframe = %s AND timestamp >= %i AND timestamp <= %i ORDER BY timestamp ASC""" % (
-                                            mk[1], mk[2], mk[3], mk[4], mk[5]))
-                    elif mk[4]:
-                        # from to now
-                        cursor.execute("""SELECT timestamp, bid_open, bid_high, bid_low, bid_close, ask_open, ask_high, ask_low, ask_close, volume FROM ohlc
-                                        WHERE broker_id = '%s' AND market_id = '%s' AND timeframe = %s AND timestamp >= %i ORDER BY timestamp ASC""" % (
-                                            mk[1], mk[2], mk[3], mk[4]))
-                    elif mk[5]:
-                        # to now
-                        cursor.execute("""SELECT timestamp, bid_open, bid_high, bid_low, bid_close, ask_open, ask_high, ask_low, ask_close, volume FROM ohlc
-                                        WHERE broker_id = '%s' AND market_id = '%s' AND timeframe = %s AND timestamp <= %i ORDER BY timestamp ASC""" % (
-                                            mk[1], mk[2], mk[3], mk[5]))
-                    else:
-                        # all
-                        cursor.execute("""SELECT timestamp, bid_open, bid_high, bid_low, bid_close, ask_open, ask_high, ask_low, ask_close, volume FROM ohlc
-                                        WHERE broker_id = '%s' AND market_id = '%s' AND timeframe = %s ORDER BY timestamp ASC""" % (
-                                            mk[1], mk[2], mk[3]))
+                    data = self.select_ohlc(mk[1], mk[2], mk[3], mk[4], mk[5], mk[6])
+                    mks.pop(0)
 
-                    rows = cursor.fetchall()
-
-                    ohlcs = []
-
-                    for row in rows:
-                        timestamp = float(row[0]) * 0.001  # to float second timestamp
-                        ohlc = Candle(timestamp, mk[3])
-
-                        ohlc.set_bid_ohlc(float(row[1]), float(row[2]), float(row[3]), float(row[4]))
-                        ohlc.set_ofr_ohlc(float(row[5]), float(row[6]), float(row[7]), float(row[8]))
-
-                        # if float(row[9]) <= 0:
-                        #   # prefer to ignore empty volume ohlc because it can broke volume signal and it is a no way but it could be
-                        #   # a lack of this information like on SPX500 of ig.com. So how to manage that cases...
-                        #   continue
-
-                        ohlc.set_volume(float(row[9]))
-
-                        if ohlc.timestamp >= Instrument.basetime(mk[3], time.time()):
-                            candle.set_consolidated(False)  # current
-
-                        ohlcs.append(ohlc)
+                    ohlcs = OhlcQuery.candles(data, mk[3])
 
                     # notify
                     mk[0].notify(Signal.SIGNAL_CANDLE_DATA_BULK, mk[1], (mk[2], mk[3], ohlcs))
@@ -607,7 +616,7 @@ class PgSql(Database):
                 # check database for valide ohlc and volumes
                 logger.error(repr(e))
 
-                # retry the next time
+                # retry the next time the remaining ones
                 self.lock()
                 self._pending_ohlc_select = mks + self._pending_ohlc_select
                 self.unlock()
@@ -616,43 +625,52 @@ class PgSql(Database):
         # insert market ohlcs
         #
 
-        if time.time() - self._last_ohlc_flush >= 60 or len(self._pending_ohlc_insert) > 500:
+        if self.need_ohlc_flush():
             self.lock()
             mkd = self._pending_ohlc_insert
             self._pending_ohlc_insert = []
             self.unlock()
 
             if mkd:
+                batches = self.batches(self.unique_rows(mkd, 4))
+
                 try:
                     cursor = self._db.cursor()
 
-                    elts = []
-                    data = set()
+                    while batches:
+                        batch = batches[0]
+                        t = time.perf_counter()
 
-                    for mk in mkd:
-                        if (mk[0], mk[1], mk[2], mk[3]) not in data:
-                            elts.append("('%s', '%s', %i, %i, '%s', '%s', '%s', '%s', '%s', '%s', '%s', '%s', '%s')" % (mk[0], mk[1], mk[2], mk[3], mk[4], mk[5], mk[6], mk[7], mk[8], mk[9], mk[10], mk[11], mk[12]))
-                            data.add((mk[0], mk[1], mk[2], mk[3]))
+                        # COPY the batch into the staging table, then upsert from it, in a single transaction
+                        buf = io.StringIO()
+                        buf.writelines("%s\t%s\t%i\t%i\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\n" % tuple(mk) for mk in batch)
+                        buf.seek(0)
 
-                    query = ' '.join(("INSERT INTO ohlc(broker_id, market_id, timestamp, timeframe, bid_open, bid_high, bid_low, bid_close, ask_open, ask_high, ask_low, ask_close, volume) VALUES",
-                                ','.join(elts),
-                                "ON CONFLICT (broker_id, market_id, timestamp, timeframe) DO UPDATE SET bid_open = EXCLUDED.bid_open, bid_high = EXCLUDED.bid_high, bid_low = EXCLUDED.bid_low, bid_close = EXCLUDED.bid_close, ask_open = EXCLUDED.ask_open, ask_high = EXCLUDED.ask_high, ask_low = EXCLUDED.ask_low, ask_close = EXCLUDED.ask_close, volume = EXCLUDED.volume"))
+                        cursor.copy_from(buf, 'ohlc_staging', columns=('broker_id', 'market_id', 'timestamp', 'timeframe',
+                                'bid_open', 'bid_high', 'bid_low', 'bid_close', 'ask_open', 'ask_high', 'ask_low', 'ask_close', 'volume'))
 
-                    # query = ' '.join((
-                    #     "INSERT INTO ohlc(broker_id, market_id, timestamp, timeframe, bid_open, bid_high, bid_low, bid_close, ask_open, ask_high, ask_low, ask_close, volume) VALUES",
-                    #     ','.join(["('%s', '%s', %i, %i, '%s', '%s', '%s', '%s', '%s', '%s', '%s', '%s', '%s')" % (mk[0], mk[1], mk[2], mk[3], mk[4], mk[5], mk[6], mk[7], mk[8], mk[9], mk[10], mk[11], mk[12]) for mk in mkd]),
-                    #     "ON CONFLICT (broker_id, market_id, timestamp, timeframe) DO UPDATE SET bid_open = EXCLUDED.bid_open, bid_high = EXCLUDED.bid_high, bid_low = EXCLUDED.bid_low, bid_close = EXCLUDED.bid_close, ask_open = EXCLUDED.ask_open, ask_high = EXCLUDED.ask_high, ask_low = EXCLUDED.ask_low, ask_close = EXCLUDED.ask_close, volume = EXCLUDED.volume"
-                    # ))
+                        cursor.execute("""INSERT INTO ohlc(broker_id, market_id, timestamp, timeframe, bid_open, bid_high, bid_low, bid_close, ask_open, ask_high, ask_low, ask_close, volume)
+                                        SELECT broker_id, market_id, timestamp, timeframe, bid_open, bid_high, bid_low, bid_close, ask_open, ask_high, ask_low, ask_close, volume FROM ohlc_staging
+                                        ON CONFLICT (broker_id, market_id, timestamp, timeframe) DO UPDATE SET
+                                            bid_open = EXCLUDED.bid_open, bid_high = EXCLUDED.bid_high, bid_low = EXCLUDED.bid_low, bid_close = EXCLUDED.bid_close,
+                                            ask_open = EXCLUDED.ask_open, ask_high = EXCLUDED.ask_high, ask_low = EXCLUDED.ask_low, ask_close = EXCLUDED.ask_close,
+                                            volume = EXCLUDED.volume""")
 
-                    cursor.execute(query)
+                        self._db.commit()
+                        batches.pop(0)
 
-                    self._db.commit()
+                        self.lock()
+                        self.add_batch_stat('ohlc', len(batch), time.perf_counter() - t)
+                        self.unlock()
+
+                        self.cache_ohlc(batch)
                 except Exception as e:
                     logger.error(repr(e))
+                    self._db.rollback()
 
-                    # retry the next time
+                    # retry the next time the remaining batches
                     self.lock()
-                    self._pending_ohlc_insert = mkd + self._pending_ohlc_insert
+                    self._pending_ohlc_insert = [mk for batch in batches for mk in batch] + self._pending_ohlc_insert
                     self.unlock()
 
                 self._last_ohlc_flush = time.time()
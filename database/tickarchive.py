@@ -0,0 +1,296 @@
+# @date 2019-03-16
+# @author Frederic SCHERMA
+# @license Copyright (c) 2019 Dream Overflow
+# Compressed tick archive
+
+import os
+import zlib
+import lzma
+import struct
+import pathlib
+
+import numpy as np
+
+import logging
+logger = logging.getLogger('siis.database.tickarchive')
+
+
+class TickArchive(object):
+    """
+    Block compressed monthly tick file : <markets-path>/<broker-id>/<market-id>/T/<YYYYMM><market-id>.tcz
+
+    Ticks are the same 4 float64 (t, b, o, v) as the binary .dat files, grouped per block of block_size ticks.
+    Each block is encoded losslessly :
+        - each column that is exactly decoded from decimal integers (ms timestamps, prices and volumes
+          at their precision) is delta encoded on these integers, with a zigzag for the negative deltas,
+        - else the column, seen as uint64, is delta encoded (timestamps and positive prices have monotonic
+          bit patterns),
+        - the bytes are shuffled (all the first bytes, then all the seconds...) to group the zeros,
+        - then compressed with zlib (or lzma), after the 8 bytes of the modes of the columns.
+
+    Layout :
+        - header of 32 bytes : magic, version, codec, block_size, num_blocks, index offset, num_ticks
+        - the compressed blocks
+        - the index, 32 bytes per block : first and last timestamp, offset, compressed size, number of ticks
+
+    The index is read at open, and a reader directly seeks and decompresses only the needed blocks.
+    """
+
+    MAGIC = b'SITZ'
+    VERSION = 1
+
+    CODEC_ZLIB = 1
+    CODEC_LZMA = 2
+
+    HEADER = struct.Struct('<4sHHIIQQ')  # 32 bytes
+    INDEX = struct.Struct('<ddQII')      # 32 bytes
+
+    DEFAULT_BLOCK_SIZE = 65536  # 2MB of raw ticks
+
+    NUM_COLUMNS = 4
+
+    def __init__(self, pathname):
+        self._pathname = pathname
+        self._file = None
+
+        self._codec = TickArchive.CODEC_ZLIB
+        self._num_ticks = 0
+
+        self._first_ts = np.empty(0)
+        self._last_ts = np.empty(0)
+        self._offsets = []
+        self._sizes = []
+        self._counts = []
+
+    @staticmethod
+    def filename(market_id, month):
+        """
+        @param month Tuple (year, month)
+        """
+        return "%04i%02i%s.tcz" % (month[0], month[1], market_id)
+
+    @property
+    def num_blocks(self):
+        return len(self._offsets)
+
+    @property
+    def num_ticks(self):
+        return self._num_ticks
+
+    def open(self):
+        self._file = open(self._pathname, 'rb')
+
+        header = self._file.read(TickArchive.HEADER.size)
+        magic, version, codec, block_size, num_blocks, index_offset, num_ticks = TickArchive.HEADER.unpack(header)
+
+        if magic != TickArchive.MAGIC or version != TickArchive.VERSION:
+            self.close()
+            raise ValueError("Invalid tick archive %s" % self._pathname)
+
+        self._codec = codec
+        self._num_ticks = num_ticks
+
+        self._file.seek(index_offset)
+        index = list(TickArchive.INDEX.iter_unpack(self._file.read(num_blocks * TickArchive.INDEX.size)))
+
+        self._first_ts = np.array([entry[0] for entry in index])
+        self._last_ts = np.array([entry[1] for entry in index])
+        self._offsets = [entry[2] for entry in index]
+        self._sizes = [entry[3] for entry in index]
+        self._counts = [entry[4] for entry in index]
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def find_block(self, timestamp):
+        """
+        Index of the first block having ticks at or after timestamp, num_blocks if none.
+        """
+        return int(np.searchsorted(self._last_ts, timestamp, side='left'))
+
+    def read_block(self, i):
+        """
+        Returns the ticks of the block i as a C contiguous float64 array of shape (n, 4).
+        """
+        self._file.seek(self._offsets[i])
+        return TickArchive.decode(self._file.read(self._sizes[i]), self._counts[i], self._codec)
+
+    #
+    # encoding
+    #
+
+    # decimal scales, as literals they are the same doubles as the ones used to convert the ms timestamps
+    SCALES = (1.0, 10.0, 100.0, 1000.0, 10000.0, 100000.0, 1000000.0, 10000000.0, 100000000.0)
+    INV_SCALES = (1.0, 0.1, 0.01, 0.001, 0.0001, 0.00001, 0.000001, 0.0000001, 0.00000001)
+
+    MODE_BITS = 0    # delta of the float64 bit patterns
+    MODE_DIV = 1     # delta of the integers, decoded as integer / 10^k
+    MODE_MUL = 2     # delta of the integers, decoded as integer * 10^-k
+
+    @staticmethod
+    def quantize(column):
+        """
+        Find the lesser number of decimals k for which the column is exactly (bit to bit) decoded from integers.
+        @return A tuple (mode, k, int64 array or None).
+        """
+        for k in range(len(TickArchive.SCALES)):
+            ints = np.round(column * TickArchive.SCALES[k])
+
+            if len(ints) and np.abs(ints).max() >= 2**53:
+                break
+
+            if np.array_equal(ints / TickArchive.SCALES[k], column):
+                return TickArchive.MODE_DIV, k, ints.astype(np.int64)
+
+            if np.array_equal(ints * TickArchive.INV_SCALES[k], column):
+                return TickArchive.MODE_MUL, k, ints.astype(np.int64)
+
+        return TickArchive.MODE_BITS, 0, None
+
+    @staticmethod
+    def encode(ticks, codec=CODEC_ZLIB):
+        """
+        @param ticks float64 array of shape (n, 4)
+        @return Bytes of the modes of the columns followed by the compressed deltas.
+        """
+        n = len(ticks)
+        ticks = np.ascontiguousarray(ticks, dtype='<f8')
+
+        deltas = np.empty((n, TickArchive.NUM_COLUMNS), dtype='<u8')
+        modes = []
+
+        for c in range(TickArchive.NUM_COLUMNS):
+            mode, k, ints = TickArchive.quantize(ticks[:, c])
+            modes.extend((mode, k))
+
+            if ints is not None:
+                d = np.diff(ints, prepend=0)
+                # zigzag, small negative deltas to small integers
+                deltas[:, c] = ((d << 1) ^ (d >> 63)).view('<u8')
+            else:
+                # uint64 arithmetic wraps around
+                u = ticks[:, c].view('<u8')
+                deltas[0, c] = u[0]
+                np.subtract(u[1:], u[:-1], out=deltas[1:, c])
+
+        # byte shuffle
+        data = np.ascontiguousarray(deltas.view(np.uint8).reshape(n, TickArchive.NUM_COLUMNS, 8).transpose(1, 2, 0)).tobytes()
+
+        if codec == TickArchive.CODEC_LZMA:
+            return bytes(modes) + lzma.compress(data)
+
+        return bytes(modes) + zlib.compress(data, 6)
+
+    @staticmethod
+    def decode(data, count, codec=CODEC_ZLIB):
+        modes = data[:2*TickArchive.NUM_COLUMNS]
+
+        if codec == TickArchive.CODEC_LZMA:
+            data = lzma.decompress(data[2*TickArchive.NUM_COLUMNS:])
+        else:
+            data = zlib.decompress(data[2*TickArchive.NUM_COLUMNS:])
+
+        shuffled = np.frombuffer(data, dtype=np.uint8).reshape(TickArchive.NUM_COLUMNS, 8, count)
+        u = np.ascontiguousarray(shuffled.transpose(2, 0, 1)).view('<u8').reshape(count, TickArchive.NUM_COLUMNS)
+
+        ticks = np.empty((count, TickArchive.NUM_COLUMNS), dtype='<f8')
+
+        for c in range(TickArchive.NUM_COLUMNS):
+            mode, k = modes[2*c], modes[2*c+1]
+
+            if mode == TickArchive.MODE_BITS:
+                ticks[:, c] = np.cumsum(u[:, c]).view('<f8')
+            else:
+                zz = u[:, c]
+                ints = np.cumsum((zz >> np.uint64(1)).view(np.int64) ^ -(zz & np.uint64(1)).view(np.int64))
+
+                if mode == TickArchive.MODE_DIV:
+                    ticks[:, c] = ints / TickArchive.SCALES[k]
+                else:
+                    ticks[:, c] = ints * TickArchive.INV_SCALES[k]
+
+        return ticks
+
+    @staticmethod
+    def write(pathname, ticks, block_size=DEFAULT_BLOCK_SIZE, codec=CODEC_ZLIB):
+        """
+        Write a complete archive from the ticks ordered by timestamp.
+        @param ticks float64 array of shape (n, 4)
+        @return Size of the archive in bytes.
+        """
+        tmpname = pathname + '.tmp'
+        index = []
+
+        with open(tmpname, 'wb') as f:
+            f.write(b'\0' * TickArchive.HEADER.size)
+
+            for i in range(0, len(ticks), block_size):
+                block = ticks[i:i+block_size]
+                data = TickArchive.encode(block, codec)
+
+                index.append(TickArchive.INDEX.pack(block[0, 0], block[-1, 0], f.tell(), len(data), len(block)))
+                f.write(data)
+
+            index_offset = f.tell()
+            f.write(b''.join(index))
+
+            size = f.tell()
+
+            f.seek(0)
+            f.write(TickArchive.HEADER.pack(TickArchive.MAGIC, TickArchive.VERSION, codec, block_size, len(index), index_offset, len(ticks)))
+
+        os.replace(tmpname, pathname)
+
+        return size
+
+
+class BinaryToArchive(object):
+    """
+    Convert the monthly binary (.dat) tick files of a market into compressed archives (.tcz).
+    The binary files are kept, and preferred by the streamer when both exist.
+    """
+
+    def __init__(self, markets_path, broker_id, market_id, from_date, to_date, block_size=TickArchive.DEFAULT_BLOCK_SIZE,
+            codec=TickArchive.CODEC_ZLIB):
+        """
+        @param from_date datetime Object
+        @param to_date datetime Object
+        """
+        self._markets_path = markets_path
+        self._broker_id = broker_id
+        self._market_id = market_id
+
+        self._from_date = from_date
+        self._to_date = to_date
+
+        self._block_size = block_size
+        self._codec = codec
+
+    def process(self):
+        """
+        @return A list of tuples (month, num ticks, binary size, archive size) of the converted months.
+        """
+        data_path = pathlib.Path(self._markets_path, self._broker_id, self._market_id, 'T')
+        month = (self._from_date.year, self._from_date.month)
+        last = (self._to_date.year, self._to_date.month)
+
+        results = []
+
+        while month <= last:
+            pathname = str(data_path.joinpath("%04i%02i%s.dat" % (month[0], month[1], self._market_id)))
+
+            if os.path.isfile(pathname):
+                ticks = np.fromfile(pathname, dtype='<f8')
+                ticks = ticks[:len(ticks) // 4 * 4].reshape(-1, 4)
+
+                if len(ticks):
+                    size = TickArchive.write(str(data_path.joinpath(TickArchive.filename(self._market_id, month))),
+                            ticks, self._block_size, self._codec)
+
+                    results.append((month, len(ticks), len(ticks) * 32, size))
+
+            month = (month[0]+1, 1) if month[1] == 12 else (month[0], month[1]+1)
+
+        return results
@@ -5,7 +5,6 @@
 
 import os
 import json
-import copy
 import time
 import threading
 import traceback
@@ -16,12 +15,68 @@ import collections
 import numpy as np
 
 from datetime import datetime
-from instrument.instrument import Tick
+from instrument.instrument import Tick, TickBatch
+
+from .tickarchive import TickArchive
 
 import logging
 logger = logging.getLogger('siis.database')
 
 
+class TickFileHandles(object):
+    """
+    LRU of the open tick files, shared by the tick storages, in way to keep the files of the active markets
+    opened between two flushes, and to close the least recently used ones over a maximum number of handles.
+    """
+
+    DEFAULT_MAX_HANDLES = 128
+
+    def __init__(self, max_handles=DEFAULT_MAX_HANDLES):
+        self._max_handles = max(1, max_handles)
+        self._handles = collections.OrderedDict()
+        self._mutex = threading.Lock()
+
+    def get(self, pathname, mode):
+        """
+        Returns the opened file, opening it if necessary.
+        """
+        self._mutex.acquire()
+        try:
+            handle = self._handles.get(pathname)
+
+            if handle is not None:
+                self._handles.move_to_end(pathname)
+                return handle
+
+            while len(self._handles) >= self._max_handles:
+                k, lru = self._handles.popitem(last=False)
+                lru.close()
+
+            handle = open(pathname, mode)
+            self._handles[pathname] = handle
+
+            return handle
+        finally:
+            self._mutex.release()
+
+    def close(self, pathname):
+        self._mutex.acquire()
+        handle = self._handles.pop(pathname, None)
+        self._mutex.release()
+
+        if handle is not None:
+            handle.close()
+
+    def close_all(self):
+        self._mutex.acquire()
+        handles = list(self._handles.values())
+        self._handles.clear()
+        self._mutex.release()
+
+        for handle in handles:
+            handle.close()
+
+
 class TickStorage(object):
     """
     Default implementation store in a single file but further one file per month.
@@ -31,10 +86,18 @@ class TickStorage(object):
     Price and volume should be formated with the asset precision if possible but scientific notation
     is tolerate.
 
+    Binary file format is a sequence of 4 float64 : timestamp (second since epoch) bid ask volume.
+
+    The whole pending ticks of a month are converted at once into a float64 array and written with
+    a single call, and the text lines are joined and written at once too. The files are kept opened
+    into the shared handles LRU (or a private one). The text format is optional.
+
     @todo Seek to file position before writing.
     """
 
-    def __init__(self, markets_path, broker_id, market_id, text=True, binary=True):
+    FLUSH_DELAY = 60.0  # save only once per minute
+
+    def __init__(self, markets_path, broker_id, market_id, text=True, binary=True, handles=None):
         self._markets_path = markets_path
         self._mutex = threading.Lock()
 
@@ -44,14 +107,13 @@ class TickStorage(object):
         self._last_save = 0
 
         self._ticks = []
-        self._curr_date = None
-
-        self._text_file = None
-        self._binary_file = None
 
         self._text = text
         self._binary = binary
 
+        self._handles = handles if handles is not None else TickFileHandles(2)
+        self._pathnames = set()  # files opened at least once
+
     def store(self, data):
         """
         @param data tuple with (broker_id, market_id, timestamp, bid, ofr, volume)
@@ -66,104 +128,157 @@ class TickStorage(object):
     def has_data(self):
         return len(self._ticks) > 0
 
-    def open(self, date_utc):
-        if self._text and not self._text_file:
-            try:
-                broker_path = pathlib.Path(self._markets_path, self._broker_id, self._market_id, 'T')  # use broker name as directory
-                if not broker_path.exists():
-                    broker_path.mkdir(parents=True)
-
-                self._curr_date = date_utc
+    def pathname(self, month, binary):
+        """
+        @param month Tuple (year, month)
+        """
+        # filename according to the month (UTC) of the timestamp, and use broker name as directory
+        filename = "%04i%02i%s%s" % (month[0], month[1], self._market_id, ".dat" if binary else "")
+        return str(pathlib.Path(self._markets_path, self._broker_id, self._market_id, 'T', filename))
 
-                # append to file, filename according to the month (UTC) of the timestamp
-                filename = self._curr_date.strftime('%Y%m') + self._market_id
-                self._text_file = open(str(broker_path) + '/' + filename, 'at')  # user market as file name
-            except Exception as e:
-                logger.error(repr(e))
+    def open(self, month, binary):
+        pathname = self.pathname(month, binary)
 
-        if self._binary and not self._binary_file:
-            try:
-                broker_path = pathlib.Path(self._markets_path, self._broker_id, self._market_id, 'T')  # use broker name as directory
-                if not broker_path.exists():
-                    broker_path.mkdir(parents=True)
+        if pathname not in self._pathnames:
+            broker_path = pathlib.Path(self._markets_path, self._broker_id, self._market_id, 'T')
+            if not broker_path.exists():
+                broker_path.mkdir(parents=True)
 
-                self._curr_date = date_utc
+            self._pathnames.add(pathname)
 
-                # append to file, filename according to the month (UTC) of the timestamp
-                filename = self._curr_date.strftime('%Y%m') + self._market_id + ".dat"
-                self._binary_file = open(str(broker_path) + '/' + filename, 'ab')  # user market as file name
-            except Exception as e:
-                logger.error(repr(e))
+        # append to file
+        return self._handles.get(pathname, 'ab' if binary else 'at')
 
     def close(self):
-        if self._text_file:
-            self._text_file.close()
-            self._text_file = None
+        for pathname in self._pathnames:
+            self._handles.close(pathname)
+
+        self._pathnames.clear()
+
+    @staticmethod
+    def months(ticks):
+        """
+        Split the ticks per month, in order.
+        @return A list of tuples ((year, month), ticks).
+        """
+        first = datetime.utcfromtimestamp(min(d[2] for d in ticks) * 0.001)
+        last = datetime.utcfromtimestamp(max(d[2] for d in ticks) * 0.001)
+
+        if first.year == last.year and first.month == last.month:
+            # mostly
+            return [((first.year, first.month), ticks)]
+
+        months = collections.OrderedDict()
+
+        for d in ticks:
+            date_utc = datetime.utcfromtimestamp(d[2] * 0.001)
+            months.setdefault((date_utc.year, date_utc.month), []).append(d)
+
+        return list(months.items())
+
+    def write_month(self, month, ticks):
+        """
+        Write the ticks of a month into any formats. On error the files are truncated back to their previous size,
+        in way to never have duplicated rows nor a partial binary record when the month is written again.
+        """
+        sizes = {}
+
+        try:
+            if self._text:
+                # convert to tabular rows
+                content = "".join(["%i\t%s\t%s\t%s\n" % (d[2], d[3], d[4], d[5]) for d in ticks])  # t b o v
+
+                text_file = self.open(month, False)
+                sizes[False] = os.fstat(text_file.fileno()).st_size
+
+                text_file.write(content)
+                text_file.flush()
+
+            if self._binary:
+                # convert to float64 t b o v (t in second)
+                arr = np.array([(d[2], d[3], d[4], d[5]) for d in ticks], dtype='<f8')
+                arr[:, 0] *= 0.001
 
-        if self._binary_file:
-            self._binary_file.close()
-            self._binary_file = None            
+                binary_file = self.open(month, True)
+                sizes[True] = os.fstat(binary_file.fileno()).st_size
+
+                binary_file.write(arr.tobytes())
+                binary_file.flush()
+        except Exception:
+            for binary, size in sizes.items():
+                self.rollback(month, binary, size)
+
+            raise
+
+    def rollback(self, month, binary, size):
+        """
+        Truncate a file back to its size before a failed write.
+        """
+        pathname = self.pathname(month, binary)
+
+        try:
+            # close before, a remaining buffer is written at close
+            self._handles.close(pathname)
+        except Exception as e:
+            logger.error(repr(e))
+
+        try:
+            os.truncate(pathname, size)
+        except Exception as e:
+            logger.error(repr(e))
 
     def flush(self, force=False):
         now = time.time()
 
-        # save only once per minute
-        if not force and ((now - self._last_save) < 60.0):
+        if not force and ((now - self._last_save) < TickStorage.FLUSH_DELAY):
             return
 
         self._mutex.acquire()
-        ticks = copy.copy(self._ticks)
-        self._ticks.clear()
+        ticks = self._ticks
+        self._ticks = []
         self._mutex.release()
 
         if not ticks:
             return
 
+        months = TickStorage.months(ticks)
+
         n = 0
         try:
-            for d in ticks:
-                date_utc = datetime.utcfromtimestamp(d[2] * 0.001)
-
-                if self._curr_date and (self._curr_date.year != date_utc.year or self._curr_date.month != date_utc.month):
-                    self.close()
-
-                self.open(date_utc)  # if necessary
-
-                if self._text_file: 
-                    # convert to a tabular row          
-                    content = "%i\t%s\t%s\t%s\n" % (d[2], d[3], d[4], d[5])  # t b o v
-                    self._text_file.write(content)
-
-                if self._binary_file:
-                    # convert to a struct
-                    f = [float(d[2]) * 0.001, float(d[3]), float(d[4]), float(d[5])]  # t b o v (t in second)
-                    s = struct.pack('<dddd', *f)
-                    self._binary_file.write(s)
-
+            for month, month_ticks in months:
+                self.write_month(month, month_ticks)
                 n += 1
         except Exception as e:
             logger.error(repr(e))
 
-            # retry the next time
+            # retry the next time, from the first month not entirely written
             self._mutex.acquire()
-            self._ticks = ticks + self._ticks[n:]
+            self._ticks = [d for month, month_ticks in months[n:] for d in month_ticks] + self._ticks
             self._mutex.release()
 
         self._last_save = time.time()
-        self.close()  # avoid too many handles
 
 
 class TickStreamer(object):
     """
     Streamer that read data from an initial position.
+
+    In mmap mode each binary month file is mapped as a numpy structured array (t, b, o, v),
+    the initial offset is found with a searchsorted, and next_array returns views
+    on the mapped file (zero-copy except when a result overlaps two months).
+
+    When there is no binary file for a month but a compressed archive (@see TickArchive), the block
+    of the initial position is found from the archive index, and the blocks are decompressed one at
+    a time as the current array.
     """
 
     TICK_SIZE = 4*8  # 32B
 
-    def __init__(self, markets_path, broker_id, market_id, from_date, to_date=None, buffer_size=1000, binary=True):
+    def __init__(self, markets_path, broker_id, market_id, from_date, to_date=None, buffer_size=1000, binary=True, use_mmap=False):
         """
         @param from_date datetime Object
         @param to_date datetime Object
+        @param use_mmap Map the binary files as numpy array (only for binary files, text files uses the buffer).
         """
 
         self._markets_path = markets_path
@@ -182,11 +297,22 @@ class TickStreamer(object):
         self._binary = binary  # use binary format
         self._is_binary = False
 
+        self._use_mmap = binary and use_mmap
+        self._array = None  # mapped month file, or decompressed block of an archive
+        self._pos = 0       # current index into the array
+
+        self._archive = None  # compressed month archive
+        self._block = -1      # current block of the archive
+
         self._struct = struct.Struct('dddd')
         self._tick_type = np.dtype([('t', 'float64'), ('b', 'float64'), ('o', 'float64'), ('v', 'float64')])
 
+    @property
+    def use_mmap(self):
+        return self._use_mmap
+
     def open(self):
-        if self._file:
+        if self._file or self._array is not None:
             return
 
         data_path = pathlib.Path(self._markets_path, self._broker_id, self._market_id, 'T')
@@ -199,6 +325,27 @@ class TickStreamer(object):
             filename = "%s%s.dat" % (self._curr_date.strftime('%Y%m'), self._market_id)
             pathname = '/'.join((str(data_path), filename))
 
+            if self._use_mmap and os.path.isfile(pathname):
+                self._is_binary = True
+                self._pos = 0
+
+                # ignore an incomplete trailing tick
+                count = os.stat(pathname).st_size // TickStreamer.TICK_SIZE
+
+                if count > 0:
+                    try:
+                        self._array = np.memmap(pathname, dtype=self._tick_type, mode='r', shape=(count,))
+                    except Exception as e:
+                        logger.error(repr(e))
+                        self._array = None
+
+                    if self._array is not None:
+                        # directly find the initial position
+                        self._pos = int(np.searchsorted(self._array['t'], self._curr_date.timestamp(), side='left'))
+
+                # empty file is processed as a consumed month
+                return
+
             if os.path.isfile(pathname):
                 self._file = open(pathname, "rb")
                 self._is_binary = True
@@ -241,6 +388,18 @@ class TickStreamer(object):
                     pos = max(0, left + ((right - left) // TickStreamer.TICK_SIZE) // 2 * TickStreamer.TICK_SIZE)
                     self._file.seek(pos, 0)
 
+            if not self._file:
+                # else with the compressed archive
+                filename = TickArchive.filename(self._market_id, (self._curr_date.year, self._curr_date.month))
+                pathname = '/'.join((str(data_path), filename))
+
+                if os.path.isfile(pathname):
+                    self._is_binary = True
+                    self.__open_archive(pathname)
+
+                    # consumed month if there is no more ticks
+                    return
+
         # if not binary asked or binary not found try with text file
         if not self._file:
             # no extension
@@ -258,11 +417,52 @@ class TickStreamer(object):
             self._file.close()
             self._file = None
 
+        if self._archive:
+            self._archive.close()
+            self._archive = None
+
+        # the mapping is released once the last view is released
+        self._array = None
+        self._pos = 0
+
+    def __open_archive(self, pathname):
+        self._archive = TickArchive(pathname)
+
+        try:
+            self._archive.open()
+        except Exception as e:
+            logger.error(repr(e))
+            self._archive = None
+            return
+
+        # directly decompress the block of the initial position
+        timestamp = self._curr_date.timestamp()
+        self._block = self._archive.find_block(timestamp) - 1
+
+        if self.__next_block():
+            self._pos = int(np.searchsorted(self._array['t'], timestamp, side='left'))
+        else:
+            self.close()
+
+    def __next_block(self):
+        """
+        Decompress the next block of the archive as the current array.
+        @return False if there is no more block (or no archive).
+        """
+        if self._archive is None or self._block + 1 >= self._archive.num_blocks:
+            return False
+
+        self._block += 1
+        self._array = self._archive.read_block(self._block).view(self._tick_type).reshape(-1)
+        self._pos = 0
+
+        return True
+
     def finished(self):
         """
         No more data into the buffer and "to date" reached.
         """
-        return (self._curr_date >= self._to_date) and not self._buffer
+        return (self._curr_date >= self._to_date) and not self._buffer and self._array is None
 
     def next(self, timestamp):
         results = []
@@ -315,14 +515,125 @@ class TickStreamer(object):
 
         return n
 
+    def next_array(self, timestamp):
+        """
+        Returns a structured array (t, b, o, v) of the ticks until timestamp (included).
+        In mmap mode the result is a view on the mapped file, excepted when it overlaps two months or
+        comes from a text file, in that case a copy is returned.
+        """
+        if not self._use_mmap:
+            return np.array(self.next(timestamp), dtype=self._tick_type)
+
+        chunks = []
+
+        while 1:
+            if self._buffer:
+                # remaining ticks from a text file
+                ticks = []
+
+                while self._buffer and self._buffer[0][0] <= timestamp:
+                    ticks.append(self._buffer.popleft())
+
+                if ticks:
+                    chunks.append(np.array(ticks, dtype=self._tick_type))
+
+                if self._buffer:
+                    break
+
+            if self._curr_date >= self._to_date:
+                break
+
+            if not self._file and self._array is None:
+                self.open()
+
+            if self._array is not None:
+                ts = self._array['t']
+                end = self._pos + int(np.searchsorted(ts[self._pos:], timestamp, side='right'))
+
+                if end > self._pos:
+                    chunks.append(self._array[self._pos:end])
+                    self._pos = end
+
+                if end < len(ts):
+                    # next tick is after timestamp
+                    break
+
+                if self.__next_block():
+                    continue
+
+                # month consumed
+                self.close()
+                self.__next_month()
+            else:
+                # text file or missing month
+                self.__bufferize()
+
+        if not chunks:
+            return np.empty(0, dtype=self._tick_type)
+
+        if len(chunks) == 1:
+            return chunks[0]
+
+        return np.concatenate(chunks)
+
+    def next_timestamp(self):
+        """
+        Timestamp of the next tick without consuming it, or None if there is no more ticks.
+        """
+        while 1:
+            if self._buffer:
+                return self._buffer[0][0]
+
+            if self._curr_date >= self._to_date:
+                return None
+
+            if not self._file and self._array is None:
+                self.open()
+
+            if self._array is not None:
+                if self._pos < len(self._array):
+                    return float(self._array[self._pos]['t'])
+
+                if self.__next_block():
+                    continue
+
+                # month consumed
+                self.close()
+                self.__next_month()
+            else:
+                # text or binary file, or missing month
+                self.__bufferize()
+
+    def next_batch(self, timestamp):
+        """
+        Returns a TickBatch of the ticks until timestamp (included), columns are views on next_array result.
+        """
+        return TickBatch.from_array(self.next_array(timestamp))
+
+    def __next_month(self):
+        if self._curr_date.month == 12:
+            self._curr_date = self._curr_date.replace(year=self._curr_date.year+1, month=1, day=1)
+        else:
+            self._curr_date = self._curr_date.replace(month=self._curr_date.month+1, day=1)
+
     def __bufferize(self):
         if self._curr_date < self._to_date:
-            if not self._file:
+            if not self._file and self._array is None:
                 self.open()
 
             file_end = False
 
-            if self._file:
+            if self._array is not None:
+                # from the mapped file
+                data = self._array[self._pos:self._pos+self._buffer_size].tolist()
+                self._pos += len(data)
+
+                if self._pos >= len(self._array):
+                    file_end = not self.__next_block()
+
+                self._buffer.extend(data)
+
+            elif self._file:
                 if self._is_binary:
                     arr = self._file.read(4*8*self._buffer_size)  # read 4 float64 * n
                     data = self._struct.iter_unpack(arr)
@@ -365,17 +676,22 @@ class TickStreamer(object):
                 self.close()
 
                 # next month/year
-                if self._curr_date.month == 12:
-                    self._curr_date = self._curr_date.replace(year=self._curr_date.year+1, month=1, day=1)
-                else:
-                    self._curr_date = self._curr_date.replace(month=self._curr_date.month+1, day=1)
+                self.__next_month()
 
 
 class TextToBinary(object):
     """
     Tab separated text format to binary file.
+
+    Each monthly text file is parsed per chunk of CHUNK_SIZE bytes cut at a line end, in one vectorized
+    np.fromstring per chunk, and each chunk is written with a single write into a temporary file that then
+    replaces the binary file. A chunk having a malformed row is parsed line by line, ignoring the invalid rows.
+
+    The months are independent, and convert_month can be run by as many worker processes as months.
     """
 
+    CHUNK_SIZE = 16*1024*1024
+
     def __init__(self, markets_path, broker_id, market_id, from_date, to_date):
         """
         @param from_date datetime Object
@@ -391,68 +707,140 @@ class TextToBinary(object):
 
         self._curr_date = from_date
 
-        self._buffer = []
-        
-        self._text_file = None
-        self._binary_file = None
+    def months(self):
+        """
+        List of the months (year, month) from from_date to to_date (excluded) having a text file.
+        """
+        data_path = pathlib.Path(self._markets_path, self._broker_id, self._market_id, 'T')
+        months = []
 
-    def open(self):
-        if self._text_file:
-            return
+        month = (self._from_date.year, self._from_date.month)
+        curr_date = self._from_date
 
-        data_path = pathlib.Path(self._markets_path, self._broker_id, self._market_id, 'T')
-        if not data_path.exists():
-            return
+        while curr_date < self._to_date:
+            if data_path.joinpath("%04i%02i%s" % (month[0], month[1], self._market_id)).is_file():
+                months.append(month)
 
-        # no extension
-        filename = "%s%s" % (self._curr_date.strftime('%Y%m'), self._market_id)
-        pathname = '/'.join((str(data_path), filename))
+            month = (month[0]+1, 1) if month[1] == 12 else (month[0], month[1]+1)
+            curr_date = curr_date.replace(year=month[0], month=month[1], day=1)
 
-        if os.path.isfile(pathname):
-            self._text_file = open(pathname, "rt")
+        return months
 
-        if self._text_file:
-            # with .dat extension
-            filename = "%s%s.dat" % (self._curr_date.strftime('%Y%m'), self._market_id)
-            pathname = '/'.join((str(data_path), filename))
+    @staticmethod
+    def parse(chunk):
+        """
+        Parse a chunk of complete text rows (ts in ms, bid, ofr, vol) to a float64 array of shape (n, 4), t in second.
+        """
+        num_rows = chunk.count('\n')
 
-            self._binary_file = open(pathname, "wb")
+        try:
+            data = np.fromstring(chunk, dtype='<f8', sep=' ')
+        except ValueError:
+            # unmatched data (raised or only warned according to the numpy version)
+            data = None
+
+        if data is None or len(data) != num_rows * 4:
+            # malformed row(s), slow path
+            rows = []
+
+            for row in chunk.split('\n'):
+                try:
+                    ts, bid, ofr, vol = row.split('\t')
+                    rows.append((float(ts), float(bid), float(ofr), float(vol)))
+                except ValueError:
+                    if row:
+                        logger.warning("Ignore invalid tick row %s" % repr(row))
+
+            data = np.array(rows, dtype='<f8').reshape(-1, 4)
+        else:
+            data = data.reshape(-1, 4)
 
-    def close(self):
-        if self._text_file:
-            self._text_file.close()
-            self._text_file = None
+        data[:, 0] *= 0.001
+
+        return data
+
+    @staticmethod
+    def convert(text_pathname, binary_pathname, chunk_size=CHUNK_SIZE):
+        """
+        @return A tuple (number of ticks, text size in bytes).
+        """
+        num_ticks = 0
+        tmpname = binary_pathname + '.tmp'
+
+        with open(text_pathname, 'rt') as text_file, open(tmpname, 'wb') as binary_file:
+            remainder = ''
+
+            while True:
+                data = text_file.read(chunk_size)
+                if not data:
+                    break
 
-        if self._binary_file:
-            self._binary_file.close()
-            self._binary_file = None
+                data = remainder + data
+                end = data.rfind('\n') + 1
+
+                remainder = data[end:]
+                if not end:
+                    continue
+
+                ticks = TextToBinary.parse(data[:end])
+                binary_file.write(ticks.tobytes())
+
+                num_ticks += len(ticks)
+
+            if remainder:
+                # last row without line end
+                ticks = TextToBinary.parse(remainder + '\n')
+                binary_file.write(ticks.tobytes())
+
+                num_ticks += len(ticks)
+
+        os.replace(tmpname, binary_pathname)
+
+        return num_ticks, os.path.getsize(text_pathname)
+
+    def convert_month(self, month):
+        """
+        @return A tuple (month, number of ticks, text size in bytes, duration in second).
+        """
+        data_path = pathlib.Path(self._markets_path, self._broker_id, self._market_id, 'T')
+        filename = "%04i%02i%s" % (month[0], month[1], self._market_id)
+
+        start = time.time()
+        num_ticks, size = TextToBinary.convert(str(data_path.joinpath(filename)), str(data_path.joinpath(filename + ".dat")))
+
+        return month, num_ticks, size, time.time() - start
 
     def process(self):
+        """
+        Convert the months sequentially.
+        @return A list of results (@see convert_month).
+        """
+        results = []
+
         while not self.finished():
-            self.next()
+            result = self.next()
+            if result:
+                results.append(result)
+
+        return results
 
     def finished(self):
         return (self._curr_date >= self._to_date)
 
     def next(self):
-        if self._curr_date < self._to_date:
-            self.open()
-
-            if self._text_file and self._binary_file:
-                for row in self._text_file:
-                    ts, bid, ofr, vol = row.rstrip('\n').split('\t')
-
-                    ts = float(ts) * 0.001
+        result = None
 
-                    # convert to a struct
-                    f = [ts, float(bid), float(ofr), float(vol)]  # t b o v (t in second)
-                    s = struct.pack('<dddd', *f)
-                    self._binary_file.write(s)
+        if self._curr_date < self._to_date:
+            month = (self._curr_date.year, self._curr_date.month)
+            filename = "%04i%02i%s" % (month[0], month[1], self._market_id)
 
-            self.close()
+            if pathlib.Path(self._markets_path, self._broker_id, self._market_id, 'T', filename).is_file():
+                result = self.convert_month(month)
 
             # next month/year
             if self._curr_date.month == 12:
                 self._curr_date = self._curr_date.replace(year=self._curr_date.year+1, month=1)
             else:
                 self._curr_date = self._curr_date.replace(month=self._curr_date.month+1)
+
+        return result
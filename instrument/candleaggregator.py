@@ -0,0 +1,282 @@
+# @date 2019-03-24
+# @author Frederic SCHERMA
+# @license Copyright (c) 2019 Dream Overflow
+# Multi-timeframe current candles aggregator.
+
+import math
+
+import numpy as np
+
+from instrument.instrument import Instrument, Candle
+
+
+class CandleAggregator(object):
+    """
+    Build the current candles of a market for many timeframes at once.
+
+    The state is an array with one row per timeframe (timestamp, bid OHLC, ofr OHLC, volume). Until the next close,
+    that is the nearest end of the current candles, every row receives the same updates, so an update is only
+    aggregated into the scalar OHLCV of the current segment, whatever the number of timeframes. The segment is
+    then applied to every row with a few vectorized operations, when the next close is reached (roll), or when
+    the current candles are read.
+
+    A candle opened without price (rolled by the timer, or by a volume only update) starts flat at the previous
+    close until its first price.
+
+    @note The updates older than the most recent current candle are ignored.
+    """
+
+    TS, BO, BH, BL, BC, OO, OH, OL, OC, VOL = range(10)
+    NUM_COLUMNS = 10
+
+    __slots__ = '_timeframes', '_index', '_state', '_next', '_active', '_bid_pending', '_ofr_pending', \
+        '_any_pending', '_any_inactive', '_next_close', '_last_open', '_seg_bid', '_seg_ofr', '_seg_vol'
+
+    def __init__(self, timeframes):
+        """
+        @param timeframes List of non zero timeframes in second.
+        """
+        self._timeframes = []
+        self._index = {}
+
+        self._state = np.zeros((0, CandleAggregator.NUM_COLUMNS))
+        self._next = np.zeros(0)                   # timestamp of the end of the current candle
+        self._active = np.zeros(0, dtype=bool)     # True if the row has a current candle
+        self._bid_pending = np.zeros(0, dtype=bool)
+        self._ofr_pending = np.zeros(0, dtype=bool)
+        self._any_pending = False
+        self._any_inactive = False
+
+        self._next_close = math.inf   # nearest end of a current candle
+        self._last_open = 0.0         # most recent timestamp of a current candle
+
+        # OHLCV of the updates not yet applied to the rows
+        self._seg_bid = None
+        self._seg_ofr = None
+        self._seg_vol = 0.0
+
+        for tf in timeframes:
+            self.add_timeframe(tf)
+
+    @property
+    def timeframes(self):
+        return self._timeframes
+
+    @property
+    def next_close(self):
+        return self._next_close
+
+    def add_timeframe(self, timeframe):
+        if timeframe <= 0 or timeframe in self._index:
+            return
+
+        self._index[timeframe] = len(self._timeframes)
+        self._timeframes.append(timeframe)
+
+        self._state = np.vstack((self._state, np.zeros((1, CandleAggregator.NUM_COLUMNS))))
+        self._next = np.append(self._next, -math.inf)  # opened at the next update
+        self._active = np.append(self._active, False)
+        self._bid_pending = np.append(self._bid_pending, True)
+        self._ofr_pending = np.append(self._ofr_pending, True)
+        self._any_pending = True
+        self._any_inactive = True
+
+    #
+    # candles
+    #
+
+    def __candle(self, i, consolidated):
+        s = self._state[i].tolist()
+
+        candle = Candle(s[CandleAggregator.TS], self._timeframes[i])
+
+        candle.set_bid_ohlc(s[CandleAggregator.BO], s[CandleAggregator.BH], s[CandleAggregator.BL], s[CandleAggregator.BC])
+        candle.set_ofr_ohlc(s[CandleAggregator.OO], s[CandleAggregator.OH], s[CandleAggregator.OL], s[CandleAggregator.OC])
+        candle.set_volume(s[CandleAggregator.VOL])
+        candle.set_consolidated(consolidated)
+
+        return candle
+
+    def candle(self, timeframe):
+        """
+        @return A new Candle of the current state for the timeframe, or None.
+        """
+        i = self._index.get(timeframe)
+        if i is None or not self._active[i]:
+            return None
+
+        self.__apply()
+
+        return self.__candle(i, False)
+
+    def candles(self):
+        """
+        @return A list of new Candle of the current state of each timeframe.
+        """
+        self.__apply()
+
+        return [self.__candle(i, False) for i in np.flatnonzero(self._active)]
+
+    def set_candle(self, candle):
+        """
+        Set the current candle of its timeframe, for example from the history.
+        """
+        self.__apply()
+
+        self.add_timeframe(candle.timeframe)
+        i = self._index[candle.timeframe]
+
+        self._state[i] = (candle.timestamp, candle.bid_open, candle.bid_high, candle.bid_low, candle.bid_close,
+                candle.ofr_open, candle.ofr_high, candle.ofr_low, candle.ofr_close, candle.volume)
+
+        self._next[i] = candle.timestamp + candle.timeframe
+        self._active[i] = True
+        self._bid_pending[i] = False
+        self._ofr_pending[i] = False
+        self._any_pending = bool(self._bid_pending.any() or self._ofr_pending.any())
+
+        self.__update_bounds()
+
+    def __update_bounds(self):
+        if self._active.any():
+            self._next_close = float(self._next[self._active].min())
+            self._last_open = float(self._state[self._active, CandleAggregator.TS].max())
+        else:
+            self._next_close = math.inf
+            self._last_open = 0.0
+
+        self._any_inactive = not self._active.all()
+
+    #
+    # updates
+    #
+
+    def roll(self, timestamp):
+        """
+        Close the current candles ended at timestamp, and open the next ones (and the never opened), without price.
+        @return The list of the closed candles, consolidated.
+        """
+        self.__apply()
+
+        due = np.flatnonzero(self._next <= timestamp)
+
+        if not len(due):
+            return []
+
+        closed = [self.__candle(i, True) for i in due if self._active[i]]
+
+        s = self._state
+
+        for i in due:
+            tf = self._timeframes[i]
+            base_time = Instrument.basetime(tf, timestamp)
+
+            if self._active[i]:
+                # flat at the previous close until a price
+                s[i, CandleAggregator.BO:CandleAggregator.BC+1] = s[i, CandleAggregator.BC]
+                s[i, CandleAggregator.OO:CandleAggregator.OC+1] = s[i, CandleAggregator.OC]
+
+            s[i, CandleAggregator.TS] = base_time
+            s[i, CandleAggregator.VOL] = 0.0
+
+            self._next[i] = base_time + tf
+            self._active[i] = True
+
+        self._bid_pending[due] = True
+        self._ofr_pending[due] = True
+        self._any_pending = True
+
+        self.__update_bounds()
+
+        return closed
+
+    def update(self, updates):
+        """
+        @param updates List of tuples (timestamp, bid, ofr, volume), bid, ofr and volume can be None or 0.
+        @return The list of the candles closed by these updates, consolidated.
+        """
+        closed = []
+
+        next_close = -math.inf if self._any_inactive else self._next_close
+        last_open = self._last_open
+
+        seg_bid, seg_ofr, seg_vol = self._seg_bid, self._seg_ofr, self._seg_vol
+
+        for timestamp, bid, ofr, volume in updates:
+            if timestamp >= next_close:
+                self._seg_bid, self._seg_ofr, self._seg_vol = seg_bid, seg_ofr, seg_vol
+
+                closed.extend(self.roll(timestamp))
+
+                seg_bid, seg_ofr, seg_vol = None, None, 0.0
+                next_close, last_open = self._next_close, self._last_open
+
+            if timestamp < last_open:
+                continue
+
+            if bid:
+                if seg_bid is None:
+                    seg_bid = [bid, bid, bid, bid]
+                else:
+                    if bid > seg_bid[1]:
+                        seg_bid[1] = bid
+                    elif bid < seg_bid[2]:
+                        seg_bid[2] = bid
+
+                    seg_bid[3] = bid
+
+            if ofr:
+                if seg_ofr is None:
+                    seg_ofr = [ofr, ofr, ofr, ofr]
+                else:
+                    if ofr > seg_ofr[1]:
+                        seg_ofr[1] = ofr
+                    elif ofr < seg_ofr[2]:
+                        seg_ofr[2] = ofr
+
+                    seg_ofr[3] = ofr
+
+            if volume:
+                seg_vol += volume
+
+        self._seg_bid, self._seg_ofr, self._seg_vol = seg_bid, seg_ofr, seg_vol
+
+        return closed
+
+    def __apply(self):
+        """
+        Apply the OHLCV of the current segment to every row.
+        """
+        s = self._state
+
+        if self._seg_vol:
+            s[:, CandleAggregator.VOL] += self._seg_vol
+
+        bid = self._seg_bid
+        ofr = self._seg_ofr
+
+        if self._any_pending:
+            # first prices of the opened candles
+            if bid and self._bid_pending.any():
+                s[self._bid_pending, CandleAggregator.BO:CandleAggregator.BC+1] = bid[0]
+                self._bid_pending[:] = False
+
+            if ofr and self._ofr_pending.any():
+                s[self._ofr_pending, CandleAggregator.OO:CandleAggregator.OC+1] = ofr[0]
+                self._ofr_pending[:] = False
+
+            self._any_pending = bool(self._bid_pending.any() or self._ofr_pending.any())
+
+        if bid:
+            np.maximum(s[:, CandleAggregator.BH], bid[1], out=s[:, CandleAggregator.BH])
+            np.minimum(s[:, CandleAggregator.BL], bid[2], out=s[:, CandleAggregator.BL])
+            s[:, CandleAggregator.BC] = bid[3]
+
+        if ofr:
+            np.maximum(s[:, CandleAggregator.OH], ofr[1], out=s[:, CandleAggregator.OH])
+            np.minimum(s[:, CandleAggregator.OL], ofr[2], out=s[:, CandleAggregator.OL])
+            s[:, CandleAggregator.OC] = ofr[3]
+
+        self._seg_bid = None
+        self._seg_ofr = None
+        self._seg_vol = 0.0
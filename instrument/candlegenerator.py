@@ -3,10 +3,12 @@
 # @license Copyright (c) 2018 Dream Overflow
 # Higher candle generator.
 
+import numpy as np
+
 from datetime import datetime, timedelta
 from common.utils import UTC
 
-from instrument.instrument import Candle
+from instrument.instrument import Candle, TickBatch
 
 
 class CandleGenerator(object):
@@ -17,7 +19,7 @@ class CandleGenerator(object):
         """
         @param to_tf Generated candle time unit.
         """
-        if from_tf and (int(to_tf) % int(from_tf) != 0):
+        if from_tf and int(to_tf) != 30*24*60*60 and (int(to_tf) % int(from_tf) != 0):
             raise(ValueError("From timeframe %s must be an integral divider of to timeframe %s" % (from_tf, to_tf)))
 
         self._from_tf = float(from_tf)
@@ -73,7 +75,15 @@ class CandleGenerator(object):
     def generate_from_ticks(self, from_ticks):
         """
         Generate as many higher candles as possible from the array of ticks given in parameters.
+        @param from_ticks List of tuples, TickBatch or structured array (t, b, o, v).
         """
+        if isinstance(from_ticks, np.ndarray):
+            # structured array (t, b, o, v)
+            from_ticks = TickBatch.from_array(from_ticks)
+
+        if isinstance(from_ticks, TickBatch):
+            return self.generate_from_tick_batch(from_ticks)
+
         to_candles = []
         self._last_consumed = 0
 
@@ -86,6 +96,147 @@ class CandleGenerator(object):
 
         return to_candles
 
+    def generate_from_tick_batch(self, from_ticks):
+        """
+        Vectorized version of generate_from_ticks for a TickBatch, with the same results.
+        Ticks are grouped by basetime and each group is reduced in one pass (reduceat).
+        """
+        to_candles = []
+        self._last_consumed = len(from_ticks)
+
+        if not len(from_ticks):
+            return to_candles
+
+        t = from_ticks.timestamp
+
+        # ignore any tick older or equal than a previous one (already done)
+        prev_max = np.empty(len(t))
+        prev_max[0] = self._last_timestamp
+        np.maximum(np.maximum.accumulate(t)[:-1], self._last_timestamp, out=prev_max[1:])
+
+        keep = t > prev_max
+        if not keep.all():
+            from_ticks = from_ticks.mask(keep)
+            t = from_ticks.timestamp
+
+        if not len(t):
+            return to_candles
+
+        bid = from_ticks.bid
+        ofr = from_ticks.ofr
+
+        # group by basetime
+        base_times = self.basetimes(t)
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(base_times)) + 1))
+        ends = np.concatenate((starts[1:], [len(t)])) - 1
+
+        to_candles = self.update_from_groups(
+                base_times[starts].tolist(),
+                bid[starts].tolist(), np.maximum.reduceat(bid, starts).tolist(), np.minimum.reduceat(bid, starts).tolist(), bid[ends].tolist(),
+                ofr[starts].tolist(), np.maximum.reduceat(ofr, starts).tolist(), np.minimum.reduceat(ofr, starts).tolist(), ofr[ends].tolist(),
+                np.add.reduceat(from_ticks.volume, starts).tolist())
+
+        # keep last timestamp
+        self._last_timestamp = float(t[-1])
+
+        return to_candles
+
+    def generate_from_ohlc(self, ohlc):
+        """
+        Vectorized generation from an array of consolidated candles of the from timeframe.
+        Works for any timeframe including week and month (@see basetimes).
+
+        @param ohlc 2d float array with one row per candle and columns :
+            timestamp (in second), bid open, high, low, close, ofr open, high, low, close, volume
+        @return List of the closed generated candles, the last one is kept as current.
+        """
+        self._last_consumed = len(ohlc)
+
+        if not len(ohlc):
+            return []
+
+        # ignore already done candles
+        ohlc = ohlc[ohlc[:, 0] > self._last_timestamp]
+        if not len(ohlc):
+            return []
+
+        t = ohlc[:, 0]
+
+        base_times = self.basetimes(t)
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(base_times)) + 1))
+        ends = np.concatenate((starts[1:], [len(t)])) - 1
+
+        to_candles = self.update_from_groups(
+                base_times[starts].tolist(),
+                ohlc[starts, 1].tolist(), np.maximum.reduceat(ohlc[:, 2], starts).tolist(),
+                np.minimum.reduceat(ohlc[:, 3], starts).tolist(), ohlc[ends, 4].tolist(),
+                ohlc[starts, 5].tolist(), np.maximum.reduceat(ohlc[:, 6], starts).tolist(),
+                np.minimum.reduceat(ohlc[:, 7], starts).tolist(), ohlc[ends, 8].tolist(),
+                np.add.reduceat(ohlc[:, 9], starts).tolist())
+
+        # keep last timestamp
+        self._last_timestamp = float(t[-1])
+
+        return to_candles
+
+    def update_from_groups(self, base_times, bid_open, bid_high, bid_low, bid_close, ofr_open, ofr_high, ofr_low, ofr_close, volumes):
+        """
+        Update the current candle and create the new ones from already reduced groups of data, one group per basetime.
+        The first group continue the current candle if they have the same basetime.
+
+        @return List of the closed candles.
+        """
+        to_candles = []
+
+        for i in range(0, len(base_times)):
+            if i == 0 and self._candle and base_times[0] == self._candle.timestamp:
+                # continue the current candle
+                candle = self._candle
+
+                candle._bid_high = max(candle._bid_high, bid_high[0])
+                candle._bid_low = min(candle._bid_low, bid_low[0])
+                candle._bid_close = bid_close[0]
+
+                candle._ofr_high = max(candle._ofr_high, ofr_high[0])
+                candle._ofr_low = min(candle._ofr_low, ofr_low[0])
+                candle._ofr_close = ofr_close[0]
+
+                candle._volume += volumes[0]
+                continue
+
+            if self._candle:
+                # close the current candle
+                self._candle.set_consolidated(True)
+                to_candles.append(self._candle)
+
+            # open a new one
+            self._candle = Candle(base_times[i], self._to_tf)
+            self._candle.set_consolidated(False)
+
+            self._candle.set_bid_ohlc(bid_open[i], bid_high[i], bid_low[i], bid_close[i])
+            self._candle.set_ofr_ohlc(ofr_open[i], ofr_high[i], ofr_low[i], ofr_close[i])
+
+            self._candle._volume = volumes[i]
+
+        return to_candles
+
+    def basetimes(self, timestamps):
+        """
+        Vectorized basetime for an array of timestamps (in second).
+        Week starts on monday 00h00 UTC, month on the first day 00h00 UTC.
+        """
+        if self._to_tf < 7*24*60*60:
+            return np.floor(timestamps / self._to_tf) * self._to_tf
+        elif self._to_tf == 7*24*60*60:
+            # 1970-01-01 is a thursday, so monday is 3 days before
+            days = np.floor(timestamps / 86400.0)
+            return (days - np.mod(days + 3, 7)) * 86400.0
+        elif self._to_tf == 30*24*60*60:
+            months = np.floor(timestamps).astype(np.int64).astype('datetime64[s]').astype('datetime64[M]')
+            return months.astype('datetime64[s]').astype(np.float64)
+
+        return np.zeros(len(timestamps))
+
     def basetime(self, timestamp):
         if self._to_tf < 7*24*60*60:
             # simplest
@@ -225,3 +376,56 @@ class CandleGenerator(object):
         self._last_timestamp = from_candle.timestamp
 
         return ended_candle
+
+
+class CascadedCandleGenerator(object):
+    """
+    Generate in one pass every higher timeframe from a bulk of candles of a base timeframe.
+    Each higher timeframe is directly generated from the base candles, not chained, giving the same
+    results as a chain of CandleGenerator but with week and month properly bucketed.
+
+    Can be called successively with the next chunks of candles, the non closed candles are kept
+    by the generators.
+    """
+
+    __slots__ = '_from_tf', '_generators'
+
+    def __init__(self, from_tf, to_tfs):
+        """
+        @param from_tf Base timeframe of the given candles (not tick).
+        @param to_tfs List of higher timeframes to generate.
+        """
+        self._from_tf = float(from_tf)
+        self._generators = [CandleGenerator(from_tf, to_tf) for to_tf in sorted(to_tfs) if to_tf > from_tf]
+
+    @property
+    def from_tf(self):
+        return self._from_tf
+
+    @property
+    def generators(self):
+        return self._generators
+
+    def generate_from_ohlc(self, ohlc):
+        """
+        @param ohlc 2d float array (@see CandleGenerator.generate_from_ohlc).
+        @return dict of lists of closed candles per generated timeframe.
+        """
+        return {generator.to_tf: generator.generate_from_ohlc(ohlc) for generator in self._generators}
+
+    def generate_from_candles(self, from_candles):
+        """
+        Same as generate_from_ohlc but from a list of consolidated Candle of the base timeframe.
+        """
+        return self.generate_from_ohlc(CascadedCandleGenerator.candles_to_ohlc(from_candles))
+
+    @staticmethod
+    def candles_to_ohlc(candles):
+        """
+        Convert a list of candles to a 2d float array (timestamp, bid ohlc, ofr ohlc, volume).
+        """
+        if not candles:
+            return np.empty((0, 10))
+
+        return np.array([(c._timestamp, c._bid_open, c._bid_high, c._bid_low, c._bid_close,
+                c._ofr_open, c._ofr_high, c._ofr_low, c._ofr_close, c._volume) for c in candles], dtype=np.float64)
@@ -3,6 +3,8 @@
 # @license Copyright (c) 2018 Dream Overflow
 # Instrument symbol
 
+import numpy as np
+
 from datetime import datetime, timedelta
 from common.utils import UTC, timeframe_to_str, truncate, decimal_place
 
@@ -185,6 +187,292 @@ class Candle(object):
             self._ofr_close)
 
 
+class CandleView(object):
+    """
+    Read-only contiguous view on a range of candles of a CandleBuffer.
+    Behaves like a list of candles (len, index, slice, iteration) and exposes the underlying arrays,
+    the columnar prices and volume arrays are views too and can be used directly by the indicators.
+
+    @note A view stays valid after further appends or reallocations of the buffer, only a replaced
+        last candle could be reflected.
+    """
+
+    __slots__ = '_candles', '_timestamps', '_ohlc'
+
+    def __init__(self, candles, timestamps, ohlc):
+        self._candles = candles        # object array view
+        self._timestamps = timestamps  # float64 array view
+        self._ohlc = ohlc              # float64 2d array view (one row per column)
+
+    @property
+    def candles(self):
+        return self._candles
+
+    @property
+    def timestamps(self):
+        return self._timestamps
+
+    @property
+    def bid_open(self):
+        return self._ohlc[CandleBuffer.BID_OPEN]
+
+    @property
+    def bid_high(self):
+        return self._ohlc[CandleBuffer.BID_HIGH]
+
+    @property
+    def bid_low(self):
+        return self._ohlc[CandleBuffer.BID_LOW]
+
+    @property
+    def bid_close(self):
+        return self._ohlc[CandleBuffer.BID_CLOSE]
+
+    @property
+    def ofr_open(self):
+        return self._ohlc[CandleBuffer.OFR_OPEN]
+
+    @property
+    def ofr_high(self):
+        return self._ohlc[CandleBuffer.OFR_HIGH]
+
+    @property
+    def ofr_low(self):
+        return self._ohlc[CandleBuffer.OFR_LOW]
+
+    @property
+    def ofr_close(self):
+        return self._ohlc[CandleBuffer.OFR_CLOSE]
+
+    @property
+    def volume(self):
+        return self._ohlc[CandleBuffer.VOLUME]
+
+    @property
+    def open(self):
+        """Mid open prices"""
+        return self._ohlc[CandleBuffer.OPEN]
+
+    @property
+    def high(self):
+        """Mid high prices"""
+        return self._ohlc[CandleBuffer.HIGH]
+
+    @property
+    def low(self):
+        """Mid low prices"""
+        return self._ohlc[CandleBuffer.LOW]
+
+    @property
+    def close(self):
+        """Mid close prices"""
+        return self._ohlc[CandleBuffer.CLOSE]
+
+    @property
+    def hlc3(self):
+        """Mid (H+L+C)/3 prices"""
+        return self._ohlc[CandleBuffer.HLC3]
+
+    @property
+    def ohlc4(self):
+        """Mid (O+H+L+C)/4 prices"""
+        return self._ohlc[CandleBuffer.OHLC4]
+
+    def __len__(self):
+        return len(self._candles)
+
+    def __bool__(self):
+        return len(self._candles) > 0
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return CandleView(self._candles[key], self._timestamps[key], self._ohlc[:, key])
+
+        return self._candles[key]
+
+    def __iter__(self):
+        return iter(self._candles)
+
+    def __reversed__(self):
+        return iter(self._candles[::-1])
+
+    def tolist(self):
+        return self._candles.tolist()
+
+
+class CandleBuffer(object):
+    """
+    Array backed buffer of candles of a same timeframe ordered by timestamp, with a capacity.
+
+    The candles are stored into a preallocated object array (with a parallel array of timestamps)
+    of twice the capacity. Append and replace last are O(1), dropping the older candles only moves
+    the start index (their slots are never overwritten, so the views stay valid), and once the end of the array is reached the remaining candles are moved to
+    a new array (amortized O(1)). Then any range is contiguous and returned as a view, and
+    timestamps lookups are done by bisection.
+
+    In step with the candles, a columnar float64 array keeps the bid/ofr OHLC, the volume and the
+    mid prices (OHLC, HLC3, OHLC4) computed once at insertion.
+
+    @param capacity Max number of kept candles, or -1 for unlimited (the array grows as necessary).
+    """
+
+    __slots__ = '_capacity', '_candles', '_timestamps', '_ohlc', '_start', '_end'
+
+    INITIAL_SIZE = 128
+
+    BID_OPEN = 0
+    BID_HIGH = 1
+    BID_LOW = 2
+    BID_CLOSE = 3
+    OFR_OPEN = 4
+    OFR_HIGH = 5
+    OFR_LOW = 6
+    OFR_CLOSE = 7
+    VOLUME = 8
+    OPEN = 9
+    HIGH = 10
+    LOW = 11
+    CLOSE = 12
+    HLC3 = 13
+    OHLC4 = 14
+
+    NUM_COLUMNS = 15
+
+    def __init__(self, capacity=-1):
+        self._capacity = capacity if capacity > 0 else -1
+
+        size = max(2*capacity, CandleBuffer.INITIAL_SIZE) if capacity > 0 else CandleBuffer.INITIAL_SIZE
+
+        self._candles = np.empty(size, dtype=object)
+        self._timestamps = np.zeros(size)
+        self._ohlc = np.zeros((CandleBuffer.NUM_COLUMNS, size))
+
+        self._start = 0
+        self._end = 0
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    @capacity.setter
+    def capacity(self, capacity):
+        self._capacity = capacity if capacity > 0 else -1
+        self.trim(self._capacity)
+
+    def __len__(self):
+        return self._end - self._start
+
+    def __bool__(self):
+        return self._end > self._start
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return self.view()[key]
+
+        if key < 0:
+            key += self._end
+        else:
+            key += self._start
+
+        if key < self._start or key >= self._end:
+            raise IndexError("candle index out of range")
+
+        return self._candles[key]
+
+    def __iter__(self):
+        return iter(self._candles[self._start:self._end])
+
+    def __reversed__(self):
+        return iter(self._candles[self._start:self._end][::-1])
+
+    def view(self, start=0):
+        """
+        Contiguous view from the start index (relative to the buffer) to the last candle.
+        """
+        return CandleView(self._candles[self._start+start:self._end], self._timestamps[self._start+start:self._end],
+                self._ohlc[:, self._start+start:self._end])
+
+    def append(self, candle):
+        if self._end >= len(self._candles):
+            self.__make_room()
+
+        self._candles[self._end] = candle
+        self._timestamps[self._end] = candle._timestamp
+        self.__set_columns(self._end, candle)
+        self._end += 1
+
+        if self._capacity > 0 and self._end - self._start > self._capacity:
+            # drop the oldest, the slot is left as is for the views, and released at the next reallocation
+            self._start += 1
+
+    def extend(self, candles):
+        for candle in candles:
+            self.append(candle)
+
+    def replace_last(self, candle):
+        self._candles[self._end-1] = candle
+        self._timestamps[self._end-1] = candle._timestamp
+        self.__set_columns(self._end-1, candle)
+
+    def trim(self, n):
+        """
+        Keep only the n last candles.
+        """
+        if n > 0 and self._end - self._start > n:
+            # as for append the dropped slots are left as is until the next reallocation
+            self._start = self._end - n
+
+    def index_from(self, from_ts):
+        """
+        Index (relative to the buffer) of the first candle having timestamp >= from_ts.
+        """
+        return int(np.searchsorted(self._timestamps[self._start:self._end], from_ts, side='left'))
+
+    def index_after(self, after_ts):
+        """
+        Index (relative to the buffer) of the first candle having timestamp > after_ts.
+        """
+        return int(np.searchsorted(self._timestamps[self._start:self._end], after_ts, side='right'))
+
+    def __set_columns(self, i, candle):
+        o = (candle._bid_open + candle._ofr_open) * 0.5
+        h = (candle._bid_high + candle._ofr_high) * 0.5
+        l = (candle._bid_low + candle._ofr_low) * 0.5
+        c = (candle._bid_close + candle._ofr_close) * 0.5
+
+        self._ohlc[:, i] = (
+            candle._bid_open, candle._bid_high, candle._bid_low, candle._bid_close,
+            candle._ofr_open, candle._ofr_high, candle._ofr_low, candle._ofr_close,
+            candle._volume,
+            o, h, l, c,
+            (h + l + c) / 3.0,
+            (o + h + l + c) / 4.0)
+
+    def __make_room(self):
+        n = self._end - self._start
+        size = len(self._candles)
+
+        if n * 2 > size:
+            # grow if unlimited or more than the capacity
+            size *= 2
+
+        # new arrays, then previous views stay valid
+        candles = np.empty(size, dtype=object)
+        timestamps = np.zeros(size)
+        ohlc = np.zeros((CandleBuffer.NUM_COLUMNS, size))
+
+        candles[:n] = self._candles[self._start:self._end]
+        timestamps[:n] = self._timestamps[self._start:self._end]
+        ohlc[:, :n] = self._ohlc[:, self._start:self._end]
+
+        self._candles = candles
+        self._timestamps = timestamps
+        self._ohlc = ohlc
+
+        self._start = 0
+        self._end = n
+
+
 class BuySellSignal(object):
 
     ORDER_ENTRY = 0
@@ -289,6 +577,102 @@ class Tick(object):
         return tick[OFR] - tick[BID]
 
 
+class TickBatch(object):
+    """
+    Columnar batch of ticks, with one array per field (timestamp, bid, ofr, volume).
+    Arrays could be views (on a mapped tick file for example), slicing returns views too.
+
+    Indexing by an integer returns a tick tuple like the Tick helper does, so a batch can
+    be used in place of a list of ticks.
+
+    @note ofr is a synonym for ask.
+    """
+
+    __slots__ = '_timestamp', '_bid', '_ofr', '_volume'
+
+    def __init__(self, timestamp, bid, ofr, volume):
+        self._timestamp = timestamp
+        self._bid = bid
+        self._ofr = ofr
+        self._volume = volume
+
+    @classmethod
+    def from_array(cls, array):
+        """
+        From a structured array (t, b, o, v), arrays are views on the fields.
+        """
+        return cls(array['t'], array['b'], array['o'], array['v'])
+
+    @classmethod
+    def from_ticks(cls, ticks):
+        """
+        From a list of tick tuples.
+        """
+        if not ticks:
+            return cls.empty()
+
+        data = np.array(ticks, dtype=np.float64)
+        return cls(data[:, 0], data[:, 1], data[:, 2], data[:, 3])
+
+    @classmethod
+    def empty(cls):
+        return cls(np.empty(0), np.empty(0), np.empty(0), np.empty(0))
+
+    @property
+    def timestamp(self):
+        return self._timestamp
+
+    @property
+    def bid(self):
+        return self._bid
+
+    @property
+    def ofr(self):
+        return self._ofr
+
+    @property
+    def volume(self):
+        return self._volume
+
+    @property
+    def price(self):
+        return (self._bid + self._ofr) * 0.5
+
+    def __len__(self):
+        return len(self._timestamp)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return TickBatch(self._timestamp[key], self._bid[key], self._ofr[key], self._volume[key])
+
+        return (float(self._timestamp[key]), float(self._bid[key]), float(self._ofr[key]), float(self._volume[key]))
+
+    def __iter__(self):
+        return zip(self._timestamp.tolist(), self._bid.tolist(), self._ofr.tolist(), self._volume.tolist())
+
+    def after(self, after_ts):
+        """
+        Returns a view on the ticks having timestamp > after_ts.
+        """
+        return self[int(np.searchsorted(self._timestamp, after_ts, side='right')):]
+
+    def mask(self, where):
+        """
+        Returns a new batch (copy) with only the ticks where the boolean array is True.
+        """
+        return TickBatch(self._timestamp[where], self._bid[where], self._ofr[where], self._volume[where])
+
+    def concatenate(self, other):
+        """
+        Returns a new batch (copy) with the ticks of other appended.
+        """
+        return TickBatch(np.concatenate((self._timestamp, other._timestamp)), np.concatenate((self._bid, other._bid)),
+                np.concatenate((self._ofr, other._ofr)), np.concatenate((self._volume, other._volume)))
+
+    def tolist(self):
+        return list(self.__iter__())
+
+
 class Instrument(object):
     """
     Instrument is the strategy side of the market model.
@@ -392,7 +776,8 @@ class Instrument(object):
 
     __slots__ = '_watchers', '_name', '_symbol', '_market_id', '_alias', '_base_exchange_rate', '_tradeable', '_currency', '_trade_quantity', '_leverage', \
                 '_market_bid', '_market_ofr', '_last_update_time', '_vol24h_base', '_vol24h_quote', '_fees', '_size_limits', '_price_limits', '_notional_limits', \
-                '_ticks', '_candles', '_buy_sells', '_wanted', '_base', '_quote', '_trade', '_orders', '_hedging',
+                '_ticks', '_candles', '_buy_sells', '_wanted', '_base', '_quote', '_trade', '_orders', '_hedging', \
+                '_order_book',
 
     def __init__(self, name, symbol, market_id, alias=None):
         self._watchers = {}
@@ -422,6 +807,8 @@ class Instrument(object):
         self._vol24h_base = None
         self._vol24h_quote = None
 
+        self._order_book = ([], [])  # last depth (bids, asks) of (price, size), best first
+
         self._fees = ([0.0, 0.0], [0.0, 0.0])  # ((maker fee, taker fee), (maker commission, taker commission))
 
         self._size_limits = (0.0, 0.0, 0.0, 0)
@@ -429,7 +816,7 @@ class Instrument(object):
         self._notional_limits = (0.0, 0.0, 0.0, 0)
 
         self._ticks = []      # list of tuple(timestamp, bid, ofr, volume)
-        self._candles = {}    # list per timeframe
+        self._candles = {}    # CandleBuffer per timeframe
         self._buy_sells = {}  # list per timeframe
 
         self._wanted = []  # list of wanted timeframe before be ready (its only for initialization)
@@ -575,6 +962,21 @@ class Instrument(object):
     def vol24h_quote(self, v):
         self._vol24h_quote = v
 
+    def set_order_book(self, bids, asks):
+        """
+        @param bids List of (price, size) best first.
+        @param asks List of (price, size) best first.
+        """
+        self._order_book = (bids, asks)
+
+    @property
+    def order_book(self):
+        """
+        Last received depth of the order book, a tuple (bids, asks) of list of (price, size) best first,
+        empty if not watched.
+        """
+        return self._order_book
+
     @property
     def base_exchange_rate(self):
         """
@@ -675,10 +1077,33 @@ class Instrument(object):
     #     return None
 
     def add_tick(self, tick):
-        if not tick:
+        if tick is None or not len(tick):
             return
 
-        if isinstance(tick, list):
+        if isinstance(tick, np.ndarray):
+            # structured array of ticks (t, b, o, v) from a mapped streamer
+            tick = TickBatch.from_array(tick)
+
+        if isinstance(self._ticks, TickBatch) and not isinstance(tick, TickBatch):
+            # mixed sources, continue with a list of tuples
+            self._ticks = self._ticks.tolist()
+
+        if isinstance(tick, TickBatch):
+            if len(self._ticks):
+                # only add the more recent ticks
+                tick = tick.after(self._ticks[-1][0])
+                if not len(tick):
+                    return
+
+                if isinstance(self._ticks, TickBatch):
+                    self._ticks = self._ticks.concatenate(tick)
+                else:
+                    self._ticks.extend(tick.tolist())
+            else:
+                # keep the batch (could be a view)
+                self._ticks = tick
+
+        elif isinstance(tick, list):
             ticks = self._ticks
 
             if len(ticks) > 0:
@@ -698,7 +1123,7 @@ class Instrument(object):
                 self._ticks.append(tick)
 
     def clear_ticks(self):
-        self._ticks.clear()
+        self._ticks = []
 
     def add_candle(self, candle, max_candles=-1):
         """
@@ -710,64 +1135,56 @@ class Instrument(object):
         if not candle:
             return
 
-        if isinstance(candle, list):
+        if isinstance(candle, (list, CandleView)):
             # array of candles
             tf = candle[0]._timeframe
 
-            if self._candles.get(tf):
-                candles = self._candles[tf]
-
-                if len(candles) > 0:
-                    for c in candle:
-                        # for each candle only add it if more recent or replace a non consolidated
-                        if c.timestamp > candles[-1].timestamp:
-                            if not candles[-1].ended:
-                                # remove the last candle if was not consolidated
-                                candles.pop(-1)
+            candles = self._candles.get(tf)
+            if candles is None:
+                candles = self._candles[tf] = CandleBuffer(max_candles)
 
+            if len(candles) > 0:
+                for c in candle:
+                    # for each candle only add it if more recent or replace a non consolidated
+                    if c._timestamp > candles[-1]._timestamp:
+                        if not candles[-1].ended:
+                            # replace the last candle if was not consolidated
+                            candles.replace_last(c)
+                        else:
                             candles.append(c)
 
-                        elif c.timestamp == candles[-1].timestamp and not candles[-1].ended:
-                            # replace the last candle if was not consolidated
-                            candles[-1] = c
-                else:
-                    # initiate array
-                    candles.extend(candle)
+                    elif c._timestamp == candles[-1]._timestamp and not candles[-1].ended:
+                        # replace the last candle if was not consolidated
+                        candles.replace_last(c)
             else:
-                self._candles[tf] = candle
-
-            # keep safe size
-            if max_candles > 1:
-                candles = self._candles[tf]
-                while(len(candles)) > max_candles:
-                    candles.pop(0)
+                # initiate array
+                candles.extend(candle)
         else:
             # single candle
-            if self._candles.get(candle._timeframe):
-                candles = self._candles[candle._timeframe]
+            tf = candle._timeframe
 
-                if len(candles) > 0:
-                    # ignore the candle if older than the latest
-                    if candle.timestamp > candles[-1].timestamp:
-                        if not candles[-1].ended:
-                            # replace the last candle if was not consolidated
-                            candles[-1] = candle
-                        else:
-                            candles.append(candle)
+            candles = self._candles.get(tf)
+            if candles is None:
+                candles = self._candles[tf] = CandleBuffer(max_candles)
 
-                    elif candle.timestamp == candles[-1].timestamp and not candles[-1].ended:
+            if len(candles) > 0:
+                # ignore the candle if older than the latest
+                if candle._timestamp > candles[-1]._timestamp:
+                    if not candles[-1].ended:
                         # replace the last candle if was not consolidated
-                        candles[-1] = candle
-                else:
-                    candles.append(candle)
+                        candles.replace_last(candle)
+                    else:
+                        candles.append(candle)
+
+                elif candle._timestamp == candles[-1]._timestamp and not candles[-1].ended:
+                    # replace the last candle if was not consolidated
+                    candles.replace_last(candle)
             else:
-                self._candles[candle._timeframe] = [candle]
+                candles.append(candle)
 
-            # keep safe size
-            if max_candles > 1:
-                candles = self._candles[candle._timeframe]
-                while(len(candles)) > max_candles:
-                    candles.pop(0)
+        # keep safe size
+        if max_candles > 1:
+            candles.trim(max_candles)
 
     def last_prices(self, tf, price_type, number):
         prices = [0] * number
@@ -775,7 +1192,7 @@ class Instrument(object):
         if tf == 0:
             # get from ticks
             ticks = self._ticks
-            if ticks:
+            if len(ticks):
                 j = number - 1
                 for i in range(len(ticks)-1, max(-1, len(ticks)-number-1), -1):
                     prices[j] = (ticks[i][1] + ticks[i][2]) * 0.5
@@ -796,7 +1213,7 @@ class Instrument(object):
         if tf == 0:
             # get from ticks
             ticks = self._ticks
-            if ticks:
+            if len(ticks):
                 j = number - 1
                 for i in range(len(ticks)-1, max(-1, len(ticks)-number-1), -1):
                     volumes[j] = ticks[i][3]
@@ -854,99 +1271,53 @@ class Instrument(object):
         Returns candle having timestamp >= from_ts in seconds.
         @param tf Timeframe
         @param from_ts In second timestamp from when to get candles
+        @return CandleView
 
         @note this is not really a good idea to fill the gap and to have this extra cost of processing because :
             for market closing weekend or night we don't, but on another side candles must be adjacent to have
             further calculations corrects
         """
-        results = []
-
         candles = self._candles.get(tf)
         if candles:
-            # process for most recent to the past
-            for c in reversed(candles):
-                if c.timestamp >= from_ts:
-                    # is there a gap between the prev and current candles, introduce missing ones
-                    if len(results) and (results[0].timestamp - c.timestamp > tf):
-                        ts = results[0].timestamp - tf
-
-                        while ts > c.timestamp:
-                            filler = Candle(ts, tf)
-
-                            # same as previous
-                            filler.copy_bid(results[-1])
-                            filler.copy_ofr(results[-1])
-
-                            # empty volume
-                            filler._volume = 0
+            return Instrument.fill_gaps(tf, candles.view(candles.index_from(from_ts)))
 
-                            results.insert(0, filler)
-                            ts -= tf
-
-                    results.insert(0, c)
-                else:
-                    break
-
-        return results
+        return []
 
     def candles_after(self, tf, after_ts):
         """
         Returns candle having timestamp >= after_ts in seconds.
         @param tf Timeframe
         @param after_ts In second timestamp after when to get candles
+        @return CandleView
         """
-        results = []
-
         candles = self._candles.get(tf)
         if candles:
-            # process for most recent to the past
-            for c in reversed(candles):
-                if c.timestamp > after_ts:
-                    # is there a gap between the prev and current candles, introduce missing ones
-                    if len(results) and (results[0].timestamp - c.timestamp > tf):
-                        ts = results[0].timestamp - tf
+            return Instrument.fill_gaps(tf, candles.view(candles.index_after(after_ts)))
 
-                        while ts > c.timestamp:
-                            filler = Candle(ts, tf)
-
-                            # same as previous
-                            filler.copy_bid(results[-1])
-                            filler.copy_ofr(results[-1])
-
-                            # empty volume
-                            filler._volume = 0
-
-                            results.insert(0, filler)
-                            ts -= tf
-
-                    results.insert(0, c)
-                else:
-                    break
-
-        return results      
+        return []
 
     def ticks_after(self, after_ts):
         """
         Returns ticks having timestamp > from_ts in seconds.
+        @note If ticks are a TickBatch the result is a view.
         """
-        results = []
-
         ticks = self._ticks
-        if ticks:
-            # process for more recent to the past
-            for t in reversed(ticks):
-                if t[0] > after_ts:
-                    results.insert(0, t)
-                else:
-                    break
 
-        return results
+        if isinstance(ticks, TickBatch):
+            return ticks.after(after_ts)
+
+        # process for more recent to the past
+        i = len(ticks)
+        while i > 0 and ticks[i-1][0] > after_ts:
+            i -= 1
+
+        return ticks[i:]
 
     def last_ticks(self, number):
         results = [Ticks()] * number
 
         ticks = self._ticks
-        if ticks:
+        if len(ticks):
             j = number - 1
             for i in range(len(ticks)-1, max(-1, len(ticks)-number-1), -1):
                 results[j] = ticks[i]
@@ -978,7 +1349,7 @@ class Instrument(object):
                         issues.append(('buysell', tf, i, i-1, candles[i-1].timestamp, buy_sells[i].timestamp - buy_sells[i-1].timestamp))
 
         ticks = self._ticks
-        if ticks:
+        if len(ticks):
             number = len(ticks)
             for i in range(len(ticks)-1, max(-1, len(ticks)-number-1), -1):
                 if ticks[i][0] - ticks[i-1][0] != tf:                    
@@ -992,7 +1363,7 @@ class Instrument(object):
         Returns the last more recent spread.
         @todo need to update market data
         """
-        if self._ticks:
+        if len(self._ticks):
             return self._ticks[-1][2] - self._ticks[-1][1]
         else:
             candles = None
@@ -1012,7 +1383,7 @@ class Instrument(object):
         Returns the last more recent bid (close) price.
         @param tf At desired timeframe or at the most precise found
         """
-        if self._ticks:
+        if len(self._ticks):
             return self._ticks[-1][1]
         else:
             candles = None
@@ -1033,7 +1404,7 @@ class Instrument(object):
         Returns the last more recent offer (close) price.
         @param tf At desired timeframe or at the most precise found
         """
-        if self._ticks:
+        if len(self._ticks):
             return self._ticks[-1][2]
         else:
             candles = None
@@ -1054,7 +1425,7 @@ class Instrument(object):
         Returns the last more recent mid (close) price.
         @param tf At desired timeframe or at the most precise found
         """
-        if self._ticks:
+        if len(self._ticks):
             return (self._ticks[-1][1] + self._ticks[-1][2]) * 0.5
         else:
             candles = None
@@ -1097,8 +1468,8 @@ class Instrument(object):
         if tf > 0:
             candles = self._candles.get(tf)
             if candles and len(candles) > n:
-                self._candles[tf] = candles[-n:]
-        elif self._ticks and len(self._ticks) > n:
+                candles.trim(n)
+        elif len(self._ticks) > n:
             self._ticks = self._ticks[-n:]
 
     def purge(self, older_than=60*60*24, n_last=100):
@@ -1129,7 +1500,7 @@ class Instrument(object):
 
             if m > 0:
                 # keep the m+1 recents
-                self._candles[tf] = candles[m:]
+                candles.trim(len(candles) - m)
 
         # per tf of buy/sell signals
         for tf, buy_sells in self._buy_sells.items():
@@ -1368,6 +1739,49 @@ class Instrument(object):
     # static
     #
 
+    @staticmethod
+    def fill_gaps(tf, candles):
+        """
+        If there is some gaps in the view of candles returns a new view with the missing candles introduced,
+        else returns the view as is.
+        """
+        timestamps = candles.timestamps
+        if len(timestamps) < 2 or not (np.diff(timestamps) > tf).any():
+            return candles
+
+        results = []
+        last = candles[-1]
+        prev = None
+
+        for c in candles:
+            # is there a gap between the prev and current candles, introduce missing ones
+            if prev is not None and (c.timestamp - prev.timestamp > tf):
+                fillers = []
+                ts = c.timestamp - tf
+
+                while ts > prev.timestamp:
+                    filler = Candle(ts, tf)
+
+                    # same as previous
+                    filler.copy_bid(last)
+                    filler.copy_ofr(last)
+
+                    # empty volume
+                    filler._volume = 0
+
+                    fillers.append(filler)
+                    ts -= tf
+
+                results.extend(reversed(fillers))
+
+            results.append(c)
+            prev = c
+
+        buffer = CandleBuffer()
+        buffer.extend(results)
+
+        return buffer.view()
+
     @staticmethod
     def basetime(tf, timestamp):
         if tf < 7*24*60*60:
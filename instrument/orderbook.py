@@ -0,0 +1,240 @@
+# @date 2019-03-25
+# @author Frederic SCHERMA
+# @license Copyright (c) 2019 Dream Overflow
+# Incremental order book.
+
+from bisect import bisect_left
+
+
+class OrderBook(object):
+    """
+    Incremental order book of a market, the same for any broker.
+
+    Each side is a dict of the sizes per price, and a sorted array of its prices, best first (the bid prices are
+    stored negated), so the best bid and ask are the first levels, and a top-N depth is a slice.
+
+    A level update is a bisect (O(log n)), and for a new or a removed price an insert or a remove into the array,
+    that is O(n) by a memmove of the following prices. The books are bounded by the depth of the broker streams
+    (BitMEX 25 levels, Kraken the subscribed depth, Binance ORDER_BOOK_LIMIT), or by the depth parameter, and up
+    to a thousand levels this memmove is cheaper than the logarithmic updates of a tree in Python (about 0.5 to
+    0.8 us per update from 25 to 1000 levels).
+
+    A book is initialized by a snapshot and then updated incrementally. For the brokers providing sequence ids,
+    an update not contiguous to the last applied one marks the book as out of sync : it must be resnapshot.
+
+    @note Not thread safe, a book is updated by the thread of its broker stream.
+    """
+
+    __slots__ = '_market_id', '_depth', '_bids', '_asks', '_bid_prices', '_ask_prices', '_sequence', '_synced'
+
+    def __init__(self, market_id, depth=None):
+        """
+        @param depth Max number of levels kept per side, the worst ones are removed, None for unlimited
+            (then the depth must be bounded by the stream, @see the cost of an update).
+        """
+        self._market_id = market_id
+        self._depth = depth
+
+        self._bids = {}         # price : size
+        self._asks = {}
+        self._bid_prices = []   # negated prices, ascending, so best first
+        self._ask_prices = []   # prices, ascending
+
+        self._sequence = None   # last applied sequence id
+        self._synced = False
+
+    @property
+    def market_id(self):
+        return self._market_id
+
+    @property
+    def sequence(self):
+        return self._sequence
+
+    @property
+    def synced(self):
+        return self._synced
+
+    def reset(self):
+        self._bids = {}
+        self._asks = {}
+        self._bid_prices = []
+        self._ask_prices = []
+
+        self._sequence = None
+        self._synced = False
+
+    #
+    # updates
+    #
+
+    def snapshot(self, bids, asks, sequence=None):
+        """
+        Initialize the book.
+        @param bids List of (price, size) in any order.
+        @param asks List of (price, size) in any order.
+        @param sequence Sequence id of the snapshot if any.
+        """
+        self._bids = {float(price): float(size) for price, size in bids if float(size) > 0.0}
+        self._asks = {float(price): float(size) for price, size in asks if float(size) > 0.0}
+
+        self._bid_prices = sorted(-price for price in self._bids)
+        self._ask_prices = sorted(self._asks)
+
+        if self._depth:
+            for price in [-p for p in self._bid_prices[self._depth:]]:
+                del self._bids[price]
+
+            for price in self._ask_prices[self._depth:]:
+                del self._asks[price]
+
+            del self._bid_prices[self._depth:]
+            del self._ask_prices[self._depth:]
+
+        self._sequence = sequence
+        self._synced = True
+
+    def set_bid(self, price, size):
+        """
+        Set the size of a bid level, a null size removes it.
+        """
+        self.__set_level(self._bids, self._bid_prices, float(price), -float(price), float(size))
+
+    def set_ask(self, price, size):
+        """
+        Set the size of an ask level, a null size removes it.
+        """
+        self.__set_level(self._asks, self._ask_prices, float(price), float(price), float(size))
+
+    def __set_level(self, levels, prices, price, key, size):
+        if size > 0.0:
+            if price not in levels:
+                i = bisect_left(prices, key)
+
+                if self._depth and i >= self._depth:
+                    # worse than the kept levels
+                    return
+
+                prices.insert(i, key)
+
+                if self._depth and len(prices) > self._depth:
+                    worst = prices.pop()
+                    del levels[abs(worst)]
+
+            levels[price] = size
+
+        elif price in levels:
+            del levels[price]
+
+            i = bisect_left(prices, key)
+            if i < len(prices) and prices[i] == key:
+                del prices[i]
+
+    def update(self, bids, asks, first_sequence=None, last_sequence=None):
+        """
+        Apply an incremental update.
+        @param bids List of (price, size), a null size removes the level.
+        @param asks List of (price, size), a null size removes the level.
+        @param first_sequence First sequence id of the update, or None if the broker does not provide them.
+        @param last_sequence Last sequence id of the update, or None.
+        @return False if the book is out of sync and must be resnapshot, else True.
+        """
+        if not self._synced:
+            return False
+
+        if first_sequence is not None and self._sequence is not None:
+            if last_sequence is not None and last_sequence <= self._sequence:
+                # older than the book, ignored
+                return True
+
+            if first_sequence > self._sequence + 1:
+                # gap, missing updates
+                self._synced = False
+                return False
+
+        for price, size in bids:
+            self.set_bid(price, size)
+
+        for price, size in asks:
+            self.set_ask(price, size)
+
+        if last_sequence is not None:
+            self._sequence = last_sequence
+
+        return True
+
+    #
+    # reading
+    #
+
+    @property
+    def best_bid(self):
+        """
+        @return A tuple (price, size) or None.
+        """
+        if self._bid_prices:
+            price = -self._bid_prices[0]
+            return price, self._bids[price]
+
+        return None
+
+    @property
+    def best_ask(self):
+        """
+        @return A tuple (price, size) or None.
+        """
+        if self._ask_prices:
+            price = self._ask_prices[0]
+            return price, self._asks[price]
+
+        return None
+
+    @property
+    def spread(self):
+        if self._bid_prices and self._ask_prices:
+            return self._ask_prices[0] + self._bid_prices[0]
+
+        return None
+
+    def bids(self, n=None):
+        """
+        @return List of the n best bid levels (price, size), best first.
+        """
+        bids = self._bids
+        return [(-key, bids[-key]) for key in self._bid_prices[:n]]
+
+    def asks(self, n=None):
+        """
+        @return List of the n best ask levels (price, size), best first.
+        """
+        asks = self._asks
+        return [(key, asks[key]) for key in self._ask_prices[:n]]
+
+    def top(self, n=None):
+        """
+        @return A tuple (market_id, bids, asks) of the n best levels, @see Signal.SIGNAL_ORDER_BOOK.
+        """
+        return self._market_id, self.bids(n), self.asks(n)
+
+    @staticmethod
+    def exec_price(levels, quantity):
+        """
+        Average execution price of a quantity taken from the levels.
+        @param levels List of (price, size) best first.
+        @return The average price, or None if no level. If the quantity exceeds the depth the remaining
+            is taken at the worst level.
+        """
+        if not levels:
+            return None
+
+        remaining = quantity
+        cost = 0.0
+
+        for price, size in levels:
+            if size >= remaining:
+                return (cost + remaining * price) / quantity if quantity > 0.0 else levels[0][0]
+
+            cost += size * price
+            remaining -= size
+
+        return (cost + remaining * levels[-1][0]) / quantity
@@ -8,17 +8,147 @@ from notifier.notifiable import Notifiable
 
 
 class Notifier(object):
+	"""
+	Signal bus of a service.
+
+	The listeners added with add_listener receive any signal (broadcast), excepted the routed signals for those
+	added with all_topics=False. The routed signals (market data) are only delivered to the listeners subscribed
+	to their topic (source_name, signal_type, market_id, timeframe), a subscription with a None timeframe matching
+	any timeframe.
+
+	The listeners and the routes are immutable tuples and dicts, replaced on each change (copy-on-write), so
+	notify never locks, and a listener added or removed during a notify only applies to the next signals.
+	A counter of the delivered signals is maintained per subscribed topic.
+	"""
+
+	ROUTED_SIGNALS = (
+		Signal.SIGNAL_TICK_DATA,
+		Signal.SIGNAL_CANDLE_DATA,
+		Signal.SIGNAL_TICK_DATA_BULK,
+		Signal.SIGNAL_CANDLE_DATA_BULK,
+		Signal.SIGNAL_ORDER_BOOK,
+		Signal.SIGNAL_MARKET_DATA,
+		Signal.SIGNAL_MARKET_INFO_DATA)
 
 	def __init__(self, service):
 		self._service = service
-		self._listeners = []
 
-	def add_listener(self, listener):
-		self._listeners.append(listener)
+		self._listeners = ()   # receive any signal
+		self._unrouted = ()    # receive any signal excepted the routed ones
+		self._routes = {}      # topic : tuple of listeners
+
+		self._counters = {}    # topic : [number of delivered signals]
+
+	def add_listener(self, listener, all_topics=True):
+		"""
+		@param all_topics If False the routed signals are only received from the subscribed topics.
+		"""
+		if all_topics:
+			self._listeners = self._listeners + (listener,)
+		else:
+			self._unrouted = self._unrouted + (listener,)
 
 	def remove_listener(self, listener):
-		self._listeners.remove(listener)
+		self._listeners = tuple(l for l in self._listeners if l is not listener)
+		self._unrouted = tuple(l for l in self._unrouted if l is not listener)
+
+		self.unsubscribe(listener)
+
+	#
+	# topics
+	#
+
+	@staticmethod
+	def topic(signal):
+		"""
+		Topic (source_name, signal_type, market_id, timeframe) of a routed signal.
+		"""
+		if signal.signal_type == Signal.SIGNAL_CANDLE_DATA:
+			return signal.source_name, signal.signal_type, signal.data[0], signal.data[1].timeframe
+		elif signal.signal_type in (Signal.SIGNAL_TICK_DATA_BULK, Signal.SIGNAL_CANDLE_DATA_BULK):
+			return signal.source_name, signal.signal_type, signal.data[0], signal.data[1]
+
+		return signal.source_name, signal.signal_type, signal.data[0], None
+
+	def subscribe(self, listener, source_name, signal_type, market_id, timeframe=None):
+		"""
+		Receive the routed signals of a topic.
+		@param timeframe Timeframe for the candles data, None for any.
+		"""
+		topic = (source_name, signal_type, market_id, timeframe)
+
+		routes = dict(self._routes)
+		listeners = routes.get(topic, ())
+
+		if listener in listeners:
+			return
+
+		routes[topic] = listeners + (listener,)
+
+		if topic not in self._counters:
+			counters = dict(self._counters)
+			counters[topic] = [0]
+			self._counters = counters
+
+		self._routes = routes
+
+	def unsubscribe(self, listener, source_name=None, signal_type=None, market_id=None):
+		"""
+		Remove the subscriptions of a listener, for any source, signal type or market if not specified.
+		"""
+		routes = {}
+
+		for topic, listeners in self._routes.items():
+			if ((source_name is None or topic[0] == source_name) and (signal_type is None or topic[1] == signal_type) and
+					(market_id is None or topic[2] == market_id)):
+				listeners = tuple(l for l in listeners if l is not listener)
+
+			if listeners:
+				routes[topic] = listeners
+
+		self._routes = routes
+
+	def stats(self):
+		"""
+		@return A dict with per subscribed topic a tuple (number of subscribers, number of delivered signals).
+		@note The counters are incremented without lock, they are indicative only.
+		"""
+		routes = self._routes
+		return {topic: (len(routes.get(topic, ())), counter[0]) for topic, counter in self._counters.items()}
+
+	#
+	# processing
+	#
 
 	def notify(self, signal):
 		for listener in self._listeners:
 			listener.receiver(signal)
+
+		if signal.signal_type in Notifier.ROUTED_SIGNALS:
+			routes = self._routes
+
+			if not routes:
+				return
+
+			topic = Notifier.topic(signal)
+
+			listeners = routes.get(topic)
+			if listeners:
+				self._counters[topic][0] += 1
+
+				for listener in listeners:
+					listener.receiver(signal)
+
+			if topic[3] is not None:
+				# subscribers to any timeframe
+				topic = topic[:3] + (None,)
+
+				listeners = routes.get(topic)
+				if listeners:
+					self._counters[topic][0] += 1
+
+					for listener in listeners:
+						listener.receiver(signal)
+		else:
+			for listener in self._unrouted:
+				listener.receiver(signal)
@@ -22,7 +22,7 @@ class Signal(object):
 	SIGNAL_TICK_DATA_BULK = 103         # data is a tuple of (market_id, tf, Tick[])
 	SIGNAL_SOCIAL_ORDER = 104           # data is a tuple with (str market id, dict position details)
 	SIGNAL_BUY_SELL_ORDER = 105         # data is BuySellSignal
-	SIGNAL_ORDER_BOOK = 106             # data is a tuple with (market_id, buys array, sells array)
+	SIGNAL_ORDER_BOOK = 106             # data is a tuple with (market_id, bids list, asks list) of (price, size) best first
 
 	SIGNAL_WATCHER_CONNECTED = 200      # data is None
 	SIGNAL_WATCHER_DISCONNECTED = 201   # data is None
@@ -103,9 +103,18 @@ def application(argv):
                 elif arg == '--binarize':
                     # use the binarizer
                     options['binarize'] = True
+                elif arg == '--compress':
+                    # binarizer also writes the compressed tick archives
+                    options['compress'] = True
                 elif arg == '--optimize':
                     # use the optimizer
                     options['optimize'] = True
+                elif arg.startswith('--gap='):
+                    # optimizer minimal duration of a reported gap in second
+                    options['gap'] = float(arg.split('=')[1])
+                elif arg == '--refetch':
+                    # optimizer re-fetch the ohlc gaps that cannot be rebuilt from the ticks
+                    options['refetch'] = True
                 elif arg == '--sync':
                     # use the syncer
                     options['sync'] = True
@@ -117,6 +126,9 @@ def application(argv):
                 elif arg.startswith('--timestep='):
                     # backesting timestep, default is 60 second
                     options['timestep'] = float(arg.split('=')[1])
+                elif arg == '--event-clock':
+                    # backtesting clock jumps to the next timestep having data
+                    options['event-clock'] = True
                 elif arg.startswith('--time-factor='):
                     # backtesting time-factor
                     options['time-factor'] = float(arg.split('=')[1])
@@ -147,6 +159,14 @@ def application(argv):
                     # fetch cascaded ohlc generation
                     options['cascaded'] = arg.split('=')[1]
 
+                elif arg == '--process-pool':
+                    # strategy computations on shard worker processes
+                    options['process-pool'] = True
+                elif arg.startswith('--process-pool='):
+                    # strategy computations on N shard worker processes
+                    options['process-pool'] = True
+                    options['process-pool-workers'] = int(arg.split('=')[1])
+
                 elif arg == '--watcher-only':
                     # feed only with live data (not compatible with --read-only)
                     options['watcher-only'] = True
@@ -498,6 +518,7 @@ def application(argv):
                                     trader_service.ping()
                                     strategy_service.ping()
                                     monitor_service.ping()
+                                    Database.inst().ping()
 
                                 elif value == ' ':
                                     # a simple mark on the terminal
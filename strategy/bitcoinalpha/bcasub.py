@@ -18,6 +18,11 @@ class BitcoinAlphaStrategySub(TimeframeBasedSub):
         # indicators
         for ind, param in params['indicators'].items():
             if param is not None:
-                setattr(self, ind, self.strategy_trader.strategy.indicator(param[0])(self.tf, *param[1:]))
+                indicator = self.strategy_trader.strategy.indicator(param[0])(self.tf, *param[1:])
+
+                # only the last sample is computed at each update, the running state is reseeded on a gap
+                indicator.incremental = params.get('incremental', False)
+
+                setattr(self, ind, indicator)
             else:
                 setattr(self, ind, None)
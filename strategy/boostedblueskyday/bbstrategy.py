@@ -122,7 +122,7 @@ class BoostedBlueSkyDayStrategy(Strategy):
             self.reset()
 
             # listen to watchers and strategy signals
-            self.watcher_service.add_listener(self)
+            self.watcher_service.add_listener(self, all_topics=False)
             self.service.add_listener(self)
 
             return True
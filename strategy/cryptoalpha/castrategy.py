@@ -46,7 +46,7 @@ class CryptoAlphaStrategy(Strategy):
             self.reset()
 
             # listen to watchers and strategy signals
-            self.watcher_service.add_listener(self)
+            self.watcher_service.add_listener(self, all_topics=False)
             self.service.add_listener(self)
 
             return True
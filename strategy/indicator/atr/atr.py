@@ -22,7 +22,7 @@ class ATRIndicator(Indicator):
         - ATR est une moyenne mobile (habituellement a 14 jours) de ces True Ranges
     """
 
-    __slots__ = '_length', '_coeff', '_atrs', '_last', '_prev', '_long_sl', '_short_sl'
+    __slots__ = '_length', '_coeff', '_atrs', '_last', '_prev', '_long_sl', '_short_sl', '_atr'
 
     @classmethod
     def indicator_type(cls):
@@ -42,6 +42,7 @@ class ATRIndicator(Indicator):
         self._coeff = coeff
 
         self._atrs = np.array([])
+        self._atr = 0.0  # ATR of the previous sample (incremental mode)
 
         self._last = 0.0
         self._prev = 0.0
@@ -69,6 +70,10 @@ class ATRIndicator(Indicator):
     def atrs(self):
         return self._atrs
 
+    @staticmethod
+    def true_range(high, low, prev_close):
+        return max(high - low, abs(high - prev_close), abs(low - prev_close))
+
     def stop_loss(self, direction):
         if direction > 0:
             return self._long_sl
@@ -129,7 +134,23 @@ class ATRIndicator(Indicator):
 
         # self._last = ta_SMA(atr, self._length)
 
-        self._atrs = ta_ATR(high, low, close, timeperiod=self._length)
+        N = self._length
+        step = self.step(timestamp, len(close), N+2)
+
+        if step == Indicator.STEP_RESEED:
+            self._atrs = ta_ATR(high, low, close, timeperiod=self._length)
+
+            if self._seeded:
+                self._atr = self._atrs[-2]
+        else:
+            if step == Indicator.STEP_NEXT:
+                # close the previous sample with its final prices
+                self._atr = (self._atr * (N-1) + ATRIndicator.true_range(high[-2], low[-2], close[-3])) / N
+                self._atrs[-1] = self._atr
+
+            atr = (self._atr * (N-1) + ATRIndicator.true_range(high[-1], low[-1], close[-2])) / N
+            self._atrs = Indicator.push(self._atrs, atr, step, len(close))
+
         self._last = self._atrs[-1]
 
         # update the last ATR stop-loss for long and short directions
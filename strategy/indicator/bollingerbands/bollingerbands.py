@@ -19,7 +19,8 @@ class BollingerBandsIndicator(Indicator):
     https://www.fidelity.com/learning-center/trading-investing/technical-analysis/technical-indicator-guide/bollinger-band-width
     """
 
-    __slots__ = '_length', '_prev_bottom', '_prev_ma', '_prev_top', '_last_bottom', '_last_ma', '_last_top'
+    __slots__ = '_length', '_prev_bottom', '_prev_ma', '_prev_top', '_last_bottom', '_last_ma', '_last_top', \
+                '_tops', '_mas', '_bottoms', '_sum', '_sum_sq'
 
     @classmethod
     def indicator_type(cls):
@@ -42,6 +43,13 @@ class BollingerBandsIndicator(Indicator):
         self._last_ma = 0.0
         self._last_top = 0.0
 
+        self._tops = np.array([])
+        self._mas = np.array([])
+        self._bottoms = np.array([])
+
+        self._sum = 0.0     # sum of the window ending at the previous sample (incremental mode)
+        self._sum_sq = 0.0  # sum of squares of the same window (incremental mode)
+
     @property
     def length(self):
         return self._length
@@ -90,6 +98,29 @@ class BollingerBandsIndicator(Indicator):
     def last_top(self):
         return self._last_top
 
+    @property
+    def tops(self):
+        return self._tops
+
+    @property
+    def mas(self):
+        return self._mas
+
+    @property
+    def bottoms(self):
+        return self._bottoms
+
+    @staticmethod
+    def bands(N, total, total_sq):
+        """
+        Top, middle and bottom values from the sum and the sum of squares of a window of N prices.
+        """
+        ma = total / N
+        variance = total_sq / N - ma * ma
+        dev = 2.0 * np.sqrt(variance) if variance > 0.0 else 0.0
+
+        return ma + dev, ma, ma - dev
+
     @staticmethod
     def BB(N, data):
         mm = MM_n(N, data)
@@ -136,16 +167,41 @@ class BollingerBandsIndicator(Indicator):
         self._prev_ma = self._last_ma
         self._prev_bottom = self._last_bottom
 
-        # bottom, ma, top = BollingerBandsIndicator.BB(self._length, prices)
-        top, ma, bottom = ta_BBANDS(prices, timeperiod=self._length, nbdevup=2, nbdevdn=2, matype=0)
+        N = self._length
+        step = self.step(timestamp, len(prices), N+2)
+
+        if step == Indicator.STEP_RESEED:
+            # bottom, ma, top = BollingerBandsIndicator.BB(self._length, prices)
+            self._tops, self._mas, self._bottoms = ta_BBANDS(prices, timeperiod=self._length, nbdevup=2, nbdevdn=2, matype=0)
+
+            if self._seeded:
+                window = prices[-N-1:-1]
+
+                self._sum = np.sum(window)
+                self._sum_sq = np.dot(window, window)
+        else:
+            if step == Indicator.STEP_NEXT:
+                # close the previous sample with its final price
+                self._sum += prices[-2] - prices[-N-2]
+                self._sum_sq += prices[-2] * prices[-2] - prices[-N-2] * prices[-N-2]
+
+                self._tops[-1], self._mas[-1], self._bottoms[-1] = BollingerBandsIndicator.bands(N, self._sum, self._sum_sq)
+
+            top, ma, bottom = BollingerBandsIndicator.bands(N,
+                    self._sum + prices[-1] - prices[-N-1],
+                    self._sum_sq + prices[-1] * prices[-1] - prices[-N-1] * prices[-N-1])
+
+            self._tops = Indicator.push(self._tops, top, step, len(prices))
+            self._mas = Indicator.push(self._mas, ma, step, len(prices))
+            self._bottoms = Indicator.push(self._bottoms, bottom, step, len(prices))
 
-        self._last_top = top[-1]
-        self._last_ma = ma[-1]
-        self._last_bottom = bottom[-1]
+        self._last_top = self._tops[-1]
+        self._last_ma = self._mas[-1]
+        self._last_bottom = self._bottoms[-1]
 
         self._last_timestamp = timestamp
 
-        return top, ma, bottom
+        return self._tops, self._mas, self._bottoms
 
     def trace(self):
         return tuple(self._last_top, self._last_ma, self._last_bottom)
@@ -16,7 +16,7 @@ class EMAIndicator(Indicator):
     Exponential Moving Average indicator
     """
 
-    __slots__ = '_length', '_prev', '_last', '_emas'
+    __slots__ = '_length', '_prev', '_last', '_emas', '_ema'
 
     @classmethod
     def indicator_type(cls):
@@ -38,6 +38,7 @@ class EMAIndicator(Indicator):
         self._last = 0.0
 
         self._emas = np.array([])
+        self._ema = 0.0  # EMA of the previous sample (incremental mode)
 
     @property
     def length(self):
@@ -75,9 +76,23 @@ class EMAIndicator(Indicator):
     def compute(self, timestamp, prices):
         self._prev = self._last
 
-        # self._emas = EMAIndicator.EMA_n_sf(self._length, prices)
-        # self._emas = MMexp_n(self._length, prices)
-        self._emas = ta_EMA(prices, self._length)
+        k = 2.0 / (self._length + 1)
+        step = self.step(timestamp, len(prices), self._length+1)
+
+        if step == Indicator.STEP_RESEED:
+            # self._emas = EMAIndicator.EMA_n_sf(self._length, prices)
+            # self._emas = MMexp_n(self._length, prices)
+            self._emas = ta_EMA(prices, self._length)
+
+            if self._seeded:
+                self._ema = self._emas[-2]
+        else:
+            if step == Indicator.STEP_NEXT:
+                # close the previous sample with its final price
+                self._ema += k * (prices[-2] - self._ema)
+                self._emas[-1] = self._ema
+
+            self._emas = Indicator.push(self._emas, self._ema + k * (prices[-1] - self._ema), step, len(prices))
 
         self._last = self._emas[-1]
 
@@ -3,13 +3,18 @@
 # @license Copyright (c) 2018 Dream Overflow
 # Indicator base class
 
+import copy
+
+import numpy as np
+
+
 class Indicator(object):
     """
     Base class for an indicator.
     @todo https://www.centralcharts.com/fr/forums/12-analyse-technique/1366-indicateur-chande-kroll-stop
     """
 
-    __slots__ = '_name', '_timeframe', '_last_timestamp'
+    __slots__ = '_name', '_timeframe', '_last_timestamp', '_incremental', '_seeded'
 
     TYPE_UNKNOWN = 0
     TYPE_AVERAGE_PRICE = 1
@@ -28,6 +33,10 @@ class Indicator(object):
     CLS_OVERLAY = 4
     CLS_CYCLE = 5
 
+    STEP_RESEED = 0  # full recompute from the given history
+    STEP_UPDATE = 1  # the last sample has changed
+    STEP_NEXT = 2    # the last sample is closed and a new one follows
+
     @classmethod
     def indicator_type(cls):
         return Indicator.TYPE_UNKNOWN
@@ -41,6 +50,8 @@ class Indicator(object):
         self._timeframe = timeframe
 
         self._last_timestamp = 0  # last compute timestamp
+        self._incremental = False  # if True only the last sample is computed at each call
+        self._seeded = False       # True when the running state of the incremental mode is valid
 
     @property
     def name(self):
@@ -58,9 +69,82 @@ class Indicator(object):
     def timeframe(self):
         return self._timeframe
 
+    @property
+    def incremental(self):
+        return self._incremental
+
+    @incremental.setter
+    def incremental(self, incremental):
+        self._incremental = incremental
+        # the running state must be seeded again from the next history
+        self._seeded = False
+
+    def step(self, timestamp, size, min_size):
+        """
+        Determine how the next compute is done in incremental mode, from the timestamp of the last
+        sample. Any gap, a first call or a history too short to contains the running state leads to a reseed,
+        and the running state must then be seeded from the history if the seeded flag is set.
+
+        @param timestamp Timestamp of the last sample of the given history.
+        @param size Size of the given history.
+        @param min_size Minimal size of the history to compute in incremental mode.
+        """
+        if self._seeded and size >= min_size:
+            if timestamp == self._last_timestamp:
+                return Indicator.STEP_UPDATE
+
+            if timestamp == self._last_timestamp + self._timeframe:
+                return Indicator.STEP_NEXT
+
+        self._seeded = self._incremental and size >= min_size
+
+        return Indicator.STEP_RESEED
+
+    @staticmethod
+    def push(values, value, step, size):
+        """
+        Update the last or append a new value to an array of results, keeping it aligned with
+        the size of the history.
+        """
+        if step == Indicator.STEP_UPDATE:
+            values[-1] = value
+            return values
+
+        values = np.append(values[-(size-1):] if size > 1 else values[:0], value)
+
+        if len(values) < size:
+            values = np.concatenate((np.full(size - len(values), np.nan), values))
+
+        return values
+
     def compute(self, timestamp):
         return None
 
+    def tail(self, depth):
+        """
+        Return a shallow copy of the indicator whose arrays of results (even into a list or tuple) are reduced to
+        their last depth values, the scalar states being kept, for example to send its last state to another process.
+        """
+        def reduce(value):
+            if isinstance(value, np.ndarray):
+                return value[-depth:].copy()
+            elif isinstance(value, (list, tuple)) and any(isinstance(v, np.ndarray) for v in value):
+                return type(value)(reduce(v) for v in value)
+
+            return value
+
+        indicator = copy.copy(self)
+
+        for cls in type(self).__mro__:
+            for attr in getattr(cls, '__slots__', ()):
+                if hasattr(self, attr):
+                    setattr(indicator, attr, reduce(getattr(self, attr)))
+
+        for attr, value in getattr(self, '__dict__', {}).items():
+            setattr(indicator, attr, reduce(value))
+
+        return indicator
+
     def trace(self):
         """
         Return a tuple or dict of the state of the indicator.
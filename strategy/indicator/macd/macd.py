@@ -6,7 +6,7 @@
 
 from strategy.indicator.indicator import Indicator
 from strategy.indicator.utils import down_sample, MMexp_n, MM_n
-from talib import MACD as ta_MACD
+from talib import MACD as ta_MACD, EMA as ta_EMA
 
 import numpy as np
 
@@ -17,7 +17,7 @@ class MACDIndicator(Indicator):
     https://fr.wikipedia.org/wiki/MACD
     """
 
-    __slots__ = '_short_l', '_long_l', '_signal_l', '_prev', '_last', '_macds'
+    __slots__ = '_short_l', '_long_l', '_signal_l', '_prev', '_last', '_macds', '_fast', '_slow'
 
     @classmethod
     def indicator_type(cls):
@@ -39,6 +39,9 @@ class MACDIndicator(Indicator):
 
         self._macds = np.array([])
 
+        self._fast = 0.0  # short EMA of the previous sample (incremental mode)
+        self._slow = 0.0  # long EMA of the previous sample (incremental mode)
+
     @property
     def prev(self):
         return self._prev
@@ -92,8 +95,30 @@ class MACDIndicator(Indicator):
     def compute(self, timestamp, prices):
         self._prev = self._last
 
-        # self._macds = MACDIndicator.MACD(self._short_l, self._long_l, prices)
-        self._macds, macdsignal, macdhist = MACD(prices, fastperiod=self._short_l, slowperiod=self._long_l, signalperiod=self._short_l)
+        k_fast = 2.0 / (self._short_l + 1)
+        k_slow = 2.0 / (self._long_l + 1)
+
+        step = self.step(timestamp, len(prices), self._long_l+1)
+
+        if step == Indicator.STEP_RESEED:
+            # self._macds = MACDIndicator.MACD(self._short_l, self._long_l, prices)
+            self._macds, macdsignal, macdhist = ta_MACD(prices, fastperiod=self._short_l, slowperiod=self._long_l, signalperiod=self._signal_l)
+
+            if self._seeded:
+                # TA-Lib starts the short EMA at the same sample as the long one
+                self._fast = ta_EMA(prices[self._long_l-self._short_l:-1], self._short_l)[-1]
+                self._slow = ta_EMA(prices[:-1], self._long_l)[-1]
+        else:
+            if step == Indicator.STEP_NEXT:
+                # close the previous sample with its final price
+                self._fast += k_fast * (prices[-2] - self._fast)
+                self._slow += k_slow * (prices[-2] - self._slow)
+                self._macds[-1] = self._fast - self._slow
+
+            fast = self._fast + k_fast * (prices[-1] - self._fast)
+            slow = self._slow + k_slow * (prices[-1] - self._slow)
+
+            self._macds = Indicator.push(self._macds, fast - slow, step, len(prices))
 
         self._last = self._macds[-1]
         self._last_timestamp = timestamp
@@ -6,6 +6,8 @@
 from strategy.indicator.indicator import Indicator
 from strategy.indicator.utils import down_sample
 
+from instrument.instrument import CandleView
+
 import numpy as np
 
 
@@ -13,6 +15,9 @@ class PriceIndicator(Indicator):
     """
     Simple average price indicator using candle data.
     Always use the average of bid and ofr prices.
+
+    With a CandleView the prices are directly the columnar views of the instrument candles (no copy),
+    they must not be modified in place.
     """
 
     PRICE_CLOSE = 0   # return close price
@@ -92,6 +97,16 @@ class PriceIndicator(Indicator):
     def Price(method, data):
         prices = []
 
+        if isinstance(data, CandleView):
+            if method == PriceIndicator.PRICE_CLOSE:
+                return data.close
+            elif method == PriceIndicator.PRICE_HLC3:
+                return data.hlc3
+            elif method == PriceIndicator.PRICE_OHLC4:
+                return data.ohlc4
+
+            return prices
+
         if method == PriceIndicator.PRICE_CLOSE:
             # average of bid/ofr close price
             prices = np.array([x.close for x in data])
@@ -161,7 +176,16 @@ class PriceIndicator(Indicator):
         self._prev = self._last
 
         # price = PriceIndicator.Price(self._method, candles)  # , self._step, self._filtering)
-        if self._method == PriceIndicator.PRICE_CLOSE:
+        if isinstance(candles, CandleView):
+            # columnar views, computed once at candle insertion
+            self._open = candles.open
+            self._high = candles.high
+            self._low = candles.low
+            self._close = candles.close
+
+            self._prices = PriceIndicator.Price(self._method, candles)
+
+        elif self._method == PriceIndicator.PRICE_CLOSE:
             # average of bid/ofr close price
             self._prices = np.array([x.close for x in candles])
 
@@ -199,11 +223,14 @@ class PriceIndicator(Indicator):
         #     print(">-2 ", candles[-2], ">-1 ", candles[-1])
 
         # related timestamps
-        self._timestamp = np.array([x.timestamp for x in candles])
+        if isinstance(candles, CandleView):
+            self._timestamp = candles.timestamps
+        else:
+            self._timestamp = np.array([x.timestamp for x in candles])
 
         # low/high
-        self._min = min(self._prices)
-        self._max = max(self._prices)
+        self._min = np.min(self._prices)
+        self._max = np.max(self._prices)
 
         self._last = self._prices[-1]
         self._last_timestamp = timestamp
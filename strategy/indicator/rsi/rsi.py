@@ -16,7 +16,7 @@ class RSIIndicator(Indicator):
     Relative Strengh Index indicator
     """
 
-    __slots__ = '_length', '_prev', '_last', '_rsis'
+    __slots__ = '_length', '_prev', '_last', '_rsis', '_gain', '_loss'
 
     @classmethod
     def indicator_type(cls):
@@ -35,6 +35,9 @@ class RSIIndicator(Indicator):
 
         self._rsis = np.array([])
 
+        self._gain = 0.0  # average gain at the previous sample (incremental mode)
+        self._loss = 0.0  # average loss at the previous sample (incremental mode)
+
     @property
     def length(self):
         return self._length
@@ -68,8 +71,8 @@ class RSIIndicator(Indicator):
         # b = np.array(list(map(lambda x: abs(min(x,0)), variations)))
 
         # or that to avoid zeros
-        h = np.array(list(map(lambda x: max(x,0.000000001), variations)))
-        b = np.array(list(map(lambda x: abs(min(x,-0.000000001)), variations)))
+        h = np.maximum(variations, 0.000000001)
+        b = np.abs(np.minimum(variations, -0.000000001))
 
         # exp or linear
         hn = MM_n(N, h)  # MMexp_n(N, h)
@@ -96,8 +99,8 @@ class RSIIndicator(Indicator):
         # b = np.array(list(map(lambda x: abs(min(x,0)), variations)))
 
         # or that to avoid zeros
-        h = np.array(list(map(lambda x: max(x,0.000000001), variations)))
-        b = np.array(list(map(lambda x: abs(min(x,-0.000000001)), variations)))
+        h = np.maximum(variations, 0.000000001)
+        b = np.abs(np.minimum(variations, -0.000000001))
 
         # exp or linear
         # hn = np.interp(range(len(data)), t_subdata[1:], MMexp_n(N, h))
@@ -110,10 +113,61 @@ class RSIIndicator(Indicator):
         rsi = hn/(hn+bn)
         return rsi
 
+    @staticmethod
+    def wilder(N, prices):
+        """
+        Wilder average gain and loss at the last price, seeded with the simple average
+        of the N first variations like does TA-Lib.
+        """
+        variations = np.diff(prices)
+
+        gains = np.maximum(variations, 0.0)
+        losses = np.maximum(-variations, 0.0)
+
+        gain = np.sum(gains[:N]) / N
+        loss = np.sum(losses[:N]) / N
+
+        for g, l in zip(gains[N:].tolist(), losses[N:].tolist()):
+            gain = (gain * (N-1) + g) / N
+            loss = (loss * (N-1) + l) / N
+
+        return gain, loss
+
+    @staticmethod
+    def wilder_next(N, gain, loss, variation):
+        """
+        Next Wilder average gain and loss from the previous ones and a price variation.
+        """
+        if variation < 0.0:
+            return gain * (N-1) / N, (loss * (N-1) - variation) / N
+
+        return (gain * (N-1) + variation) / N, loss * (N-1) / N
+
+    @staticmethod
+    def rsi(gain, loss):
+        total = gain + loss
+        return gain / total if abs(total) >= 0.00000001 else 0.0
+
     def compute(self, timestamp, prices):
         self._prev = self._last
-        # self._rsis = RSIIndicator.RSI_n_sf(self._length, prices)  # , self._step, self._filtering)
-        self._rsis = ta_RSI(prices, self._length) * 0.01
+
+        N = self._length
+        step = self.step(timestamp, len(prices), N+2)
+
+        if step == Indicator.STEP_RESEED:
+            # self._rsis = RSIIndicator.RSI_n_sf(self._length, prices)  # , self._step, self._filtering)
+            self._rsis = ta_RSI(prices, self._length) * 0.01
+
+            if self._seeded:
+                self._gain, self._loss = RSIIndicator.wilder(N, prices[:-1])
+        else:
+            if step == Indicator.STEP_NEXT:
+                # close the previous sample with its final price
+                self._gain, self._loss = RSIIndicator.wilder_next(N, self._gain, self._loss, prices[-2] - prices[-3])
+                self._rsis[-1] = RSIIndicator.rsi(self._gain, self._loss)
+
+            gain, loss = RSIIndicator.wilder_next(N, self._gain, self._loss, prices[-1] - prices[-2])
+            self._rsis = Indicator.push(self._rsis, RSIIndicator.rsi(gain, loss), step, len(prices))
 
         self._last = self._rsis[-1]
         self._last_timestamp = timestamp
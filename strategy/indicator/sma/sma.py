@@ -16,7 +16,7 @@ class SMAIndicator(Indicator):
     Simple Moving Average indicator
     """
 
-    __slots__ = '_length', '_prev', '_last', '_smas'
+    __slots__ = '_length', '_prev', '_last', '_smas', '_sum'
 
     @classmethod
     def indicator_type(cls):
@@ -35,6 +35,7 @@ class SMAIndicator(Indicator):
         self._last = 0.0
 
         self._smas = np.array([])
+        self._sum = 0.0  # sum of the window ending at the previous sample (incremental mode)
 
     @property
     def length(self):
@@ -72,9 +73,24 @@ class SMAIndicator(Indicator):
     def compute(self, timestamp, prices):
         self._prev = self._last
 
-        # self._smas = SMAIndicator.SMA_n_sf(self._length, prices)  # , self._step, self._filtering)
-        # self._smas = MM_n(self._length, prices)
-        self._smas = ta_SMA(prices, self._length)
+        N = self._length
+        step = self.step(timestamp, len(prices), N+2)
+
+        if step == Indicator.STEP_RESEED:
+            # self._smas = SMAIndicator.SMA_n_sf(self._length, prices)  # , self._step, self._filtering)
+            # self._smas = MM_n(self._length, prices)
+            self._smas = ta_SMA(prices, self._length)
+
+            if self._seeded:
+                self._sum = np.sum(prices[-N-1:-1])
+        else:
+            if step == Indicator.STEP_NEXT:
+                # close the previous sample with its final price
+                self._sum += prices[-2] - prices[-N-2]
+                self._smas[-1] = self._sum / N
+
+            self._smas = Indicator.push(self._smas, (self._sum + prices[-1] - prices[-N-1]) / N, step, len(prices))
+
         self._last = self._smas[-1]
 
         self._last_timestamp = timestamp
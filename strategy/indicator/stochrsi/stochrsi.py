@@ -6,9 +6,12 @@
 
 from strategy.indicator.indicator import Indicator
 from strategy.indicator.utils import down_sample, MMexp_n, MM_n
+from strategy.indicator.rsi.rsi import RSIIndicator
+
+from collections import deque
 
 import numpy as np
-from talib import STOCHRSI as ta_STOCHRSI
+from talib import STOCHRSI as ta_STOCHRSI, RSI as ta_RSI
 
 
 class StochRSIIndicator(Indicator):
@@ -17,7 +20,8 @@ class StochRSIIndicator(Indicator):
     https://www.fidelity.com/learning-center/trading-investing/technical-analysis/technical-indicator-guide/stochrsi
     """
 
-    __slots__ = '_length', '_len_K', '_len_D', '_prev_k', '_last_k', '_prev_d', '_last_d', '_ks', '_ds'
+    __slots__ = '_length', '_len_K', '_len_D', '_prev_k', '_last_k', '_prev_d', '_last_d', '_ks', '_ds', \
+                '_gain', '_loss', '_rsis_window', '_ks_window'
 
     @classmethod
     def indicator_type(cls):
@@ -43,6 +47,12 @@ class StochRSIIndicator(Indicator):
         self._ks = np.array([])
         self._ds = np.array([])
 
+        # incremental mode state at the previous sample
+        self._gain = 0.0
+        self._loss = 0.0
+        self._rsis_window = deque(maxlen=max(len_K-1, 1))  # len_K-1 previous RSI
+        self._ks_window = deque(maxlen=max(len_D-1, 1))    # len_D-1 previous K
+
     @property
     def length(self):
         return self._length
@@ -93,8 +103,8 @@ class StochRSIIndicator(Indicator):
         # b = np.array(list(map(lambda x: abs(min(x,0)), variations)))
 
         # or that to avoid zeros
-        h = np.array(list(map(lambda x: max(x,0.000001), variations)))
-        b = np.array(list(map(lambda x: abs(min(x,-0.000001)), variations)))
+        h = np.maximum(variations, 0.000001)
+        b = np.abs(np.minimum(variations, -0.000001))
 
         # exp or linear
         hn = MM_n(N, h)  # MMexp_n(N, h)
@@ -117,8 +127,8 @@ class StochRSIIndicator(Indicator):
         # b = np.array(list(map(lambda x: abs(min(x,0)), variations)))
 
         # or that to avoid zeros
-        h = np.array(list(map(lambda x: max(x,0.000001), variations)))
-        b = np.array(list(map(lambda x: abs(min(x,-0.000001)), variations)))
+        h = np.maximum(variations, 0.000001)
+        b = np.abs(np.minimum(variations, -0.000001))
 
         # exp or linear
         # hn = np.interp(range(len(data)), t_subdata[1:], MMexp_n(N, h))
@@ -149,16 +159,59 @@ class StochRSIIndicator(Indicator):
         D = MM_n(N_D, K)   
         return K, D
 
+    def stoch(self, rsi):
+        """
+        K and D values of a sample from its RSI and the windows of the previous ones, like the TA-Lib fast stochastic.
+        """
+        highest = max(rsi, max(self._rsis_window)) if self._len_K > 1 else rsi
+        lowest = min(rsi, min(self._rsis_window)) if self._len_K > 1 else rsi
+
+        k = (rsi - lowest) * 100.0 / (highest - lowest) if highest != lowest else 0.0
+        d = (sum(self._ks_window) + k) / self._len_D if self._len_D > 1 else k
+
+        return k, d
+
     def compute(self, timestamp, prices):
         self._prev_k = self._last_k
         self._prev_d = self._last_d
 
-        # k, d = StochRSIIndicator.StochRSI(
-        #     self._len_K,
-        #     StochRSIIndicator.RSI_n(self._length, prices),  # , self._step, self._filtering),
-        #     self._len_D)
+        N = self._length
+        step = self.step(timestamp, len(prices), N + self._len_K + self._len_D)
+
+        if step == Indicator.STEP_RESEED:
+            # k, d = StochRSIIndicator.StochRSI(
+            #     self._len_K,
+            #     StochRSIIndicator.RSI_n(self._length, prices),  # , self._step, self._filtering),
+            #     self._len_D)
+
+            self._ks, self._ds = ta_STOCHRSI(prices, self._length, self._len_K, self._len_D, 0)
+
+            if self._seeded:
+                self._gain, self._loss = RSIIndicator.wilder(N, prices[:-1])
+
+                self._rsis_window.clear()
+                self._rsis_window.extend(ta_RSI(prices, N)[-self._len_K:-1].tolist())
+
+                self._ks_window.clear()
+                self._ks_window.extend(self._ks[-self._len_D:-1].tolist())
+        else:
+            if step == Indicator.STEP_NEXT:
+                # close the previous sample with its final price
+                self._gain, self._loss = RSIIndicator.wilder_next(N, self._gain, self._loss, prices[-2] - prices[-3])
+                rsi = RSIIndicator.rsi(self._gain, self._loss) * 100.0
+
+                self._ks[-1], self._ds[-1] = self.stoch(rsi)
+
+                if self._len_K > 1:
+                    self._rsis_window.append(rsi)
+                if self._len_D > 1:
+                    self._ks_window.append(self._ks[-1])
+
+            gain, loss = RSIIndicator.wilder_next(N, self._gain, self._loss, prices[-1] - prices[-2])
+            k, d = self.stoch(RSIIndicator.rsi(gain, loss) * 100.0)
 
-        self._ks, self._ds = ta_STOCHRSI(prices, self._length, self._len_K, self._len_D, 0)
+            self._ks = Indicator.push(self._ks, k, step, len(prices))
+            self._ds = Indicator.push(self._ds, d, step, len(prices))
 
         self._last_k = self._ks[-1]
         self._last_d = self._ds[-1]
@@ -14,13 +14,23 @@ def down_sample(data, factor, n=4, ftype='iir'):
 def MM_n(N, data):
     """
     Calcul de la moyenne mobile sur N points.
+    Les N premiers points sont la moyenne des j+1 premiers echantillons.
     """
+    data = np.asarray(data, dtype=np.float64)
     out = np.zeros(len(data))
 
-    for j in range(N):
-        out[j] = np.average(data[:j+1])
-    for (j,d) in enumerate(data[N-1:]):
-        out[j+N-1] = np.average(data[j:j+N])
+    if not len(data):
+        return out
+
+    # sum of the windows from the cumulative sum, centered on the first value to limit the rounding errors
+    base = data[0]
+    cumsum = np.concatenate(([0.0], np.cumsum(data - base)))
+    n = min(N, len(data))
+
+    out[:n] = cumsum[1:n+1] / np.arange(1, n+1) + base
+
+    if len(data) > N:
+        out[n:] = (cumsum[N+1:] - cumsum[1:len(data)-N+1]) / N + base
 
     return out
 
@@ -33,17 +43,25 @@ def MMexp_n(N, data, has_previous_val = False, previous_value = 0):
     n=1, 2, 3, ..., N pour les N premiers echantillons
     """
     An = 2.0 / (1.0 + N)
+    data = np.asarray(data, dtype=np.float64)
     out = np.zeros(len(data))
 
+    if not len(data):
+        return out
+
+    # out[j] = An*data[j] + (1-An)*out[j-1] as a first order IIR filter
+    b = [An]
+    a = [1.0, -(1.0-An)]
+
     if (has_previous_val):
-        out[0] = data[0]*An + (1-An)*previous_value 
-        for (j,d) in enumerate(data[1:]):
-            out[j+1] = d*An + (1-An)*out[j]
+        out[:], zf = signal.lfilter(b, a, data, zi=[(1.0-An)*previous_value])
     else:
-        for j in range(N):
-            out[j] = np.average(data[:j+1])
-        for (j,d) in enumerate(data[N-1:]):
-            out[j+N-1] = d*An + (1-An)*out[j+N-2]
+        n = min(N, len(data))
+        out[:n] = np.cumsum(data[:n]) / np.arange(1, n+1)
+
+        if len(data) >= N:
+            prev = out[N-2] if N > 1 else 0.0
+            out[N-1:], zf = signal.lfilter(b, a, data[N-1:], zi=[(1.0-An)*prev])
 
     return out
 
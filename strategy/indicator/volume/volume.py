@@ -6,6 +6,8 @@
 from strategy.indicator.indicator import Indicator
 from strategy.indicator.utils import down_sample
 
+from instrument.instrument import CandleView
+
 import numpy as np
 
 
@@ -57,6 +59,10 @@ class VolumeIndicator(Indicator):
 
     @staticmethod
     def Volume(method, data):
+        if isinstance(data, CandleView):
+            # columnar view of the instrument candles (no copy)
+            return data.volume
+
         if method == VolumeIndicator.VOLUME_TICK:
             return np.array([x.volume for x in data])
         else:
@@ -4,6 +4,8 @@
 # service worker for strategy
 
 import time
+import math
+import heapq
 import threading
 
 from datetime import datetime
@@ -22,6 +24,65 @@ from notifier.signal import Signal
 from config import config, utils
 
 
+class BacktestEventClock(object):
+    """
+    Event clock of the backtesting, it jumps to the first timestep having data on any feeder, using a heap merge
+    of the next timestamp of each feeder.
+
+    A feeder that consumed nothing during a step (not ready strategy, no instrument) keeps the same next timestamp,
+    it is then retried at the next timestep, and never stalls the clock.
+    """
+
+    def __init__(self, s, e, ts):
+        """
+        @param s Beginning timestamp.
+        @param e Ending timestamp.
+        @param ts Timestep.
+        """
+        self.s = s
+        self.e = e
+        self.ts = ts
+
+        self.feeders = []
+        self.heap = []  # next data timestamp per feeder index
+
+    def init(self, feeders):
+        self.feeders = list(feeders)
+        self.heap = []
+
+        for i, feeder in enumerate(self.feeders):
+            timestamp = feeder.next_timestamp()
+            if timestamp is not None:
+                self.heap.append((timestamp, i))
+
+        heapq.heapify(self.heap)
+
+    def next_step(self, c):
+        """
+        Next timestamp of the clock after the current timestamp c.
+        """
+        # the feeders consumed until the current timestamp have a new next timestamp
+        while self.heap and self.heap[0][0] <= c:
+            timestamp, i = heapq.heappop(self.heap)
+
+            timestamp = self.feeders[i].next_timestamp()
+            if timestamp is not None:
+                # nothing consumed, then retried at the next timestep
+                heapq.heappush(self.heap, (timestamp if timestamp > c else c + self.ts, i))
+
+        if not self.heap:
+            # no more data, goes to the end
+            return max(c + self.ts, self.e + self.ts)
+
+        timestamp = self.heap[0][0]
+
+        if timestamp <= c + self.ts:
+            return c + self.ts
+
+        # aligned on the timesteps from the start
+        return self.s + math.ceil((timestamp - self.s) / self.ts) * self.ts
+
+
 class StrategyService(Service):
 
     def __init__(self, watcher_service, trader_service, monitor_service, options):
@@ -54,6 +115,7 @@ class StrategyService(Service):
         self._from_date = options.get('from')  # UTC tz
         self._to_date = options.get('to')  # UTC tz
         self._timestep = options.get('timestep', 60.0)
+        self._event_clock = options.get('event-clock', False)  # skip the timesteps without data
 
         self._timestamp = 0  # in backtesting current processed timestamp
 
@@ -85,6 +147,10 @@ class StrategyService(Service):
         # worker pool of jobs for running data analysis
         self._worker_pool = WorkerPool()
 
+        # or shard worker processes per appliance
+        self._process_pool_mode = options.get('process-pool', False)
+        self._process_pool_workers = options.get('process-pool-workers', None)
+
     @property
     def watcher_service(self):
         return self._watcher_service
@@ -101,6 +167,14 @@ class StrategyService(Service):
     def worker_pool(self):
         return self._worker_pool
 
+    @property
+    def process_pool_mode(self):
+        return self._process_pool_mode
+
+    @property
+    def process_pool_workers(self):
+        return self._process_pool_workers
+
     @property
     def tradeops(self):
         return self._tradeops
@@ -274,7 +348,7 @@ class StrategyService(Service):
                 # start the time thread once all appliance get theirs data and are ready
                 class TimeStepThread(threading.Thread):
 
-                    def __init__(self, service, s, e, ts, tf=0.0):
+                    def __init__(self, service, s, e, ts, tf=0.0, event_clock=False):
                         super().__init__(name="backtest")
 
                         self.service = service
@@ -286,6 +360,32 @@ class StrategyService(Service):
                         self.ppc = 0
                         self.tf = tf
 
+                        self.event_clock = BacktestEventClock(s, e, ts) if event_clock else None
+
+                    def init_event_clock(self, appliances):
+                        self.event_clock.init(feeder for appl in appliances for feeder in appl.feeders.values())
+
+                    def next_step(self):
+                        """
+                        Next timestamp of the clock, @see BacktestEventClock.
+                        """
+                        if not self.event_clock:
+                            return self.c + self.ts
+
+                        return self.event_clock.next_step(self.c)
+
+                    def failed(self, appliances):
+                        """
+                        True if the data of a feeder cannot be fetched, the backtesting must then be aborted.
+                        """
+                        for appl in appliances:
+                            for market_id, feeder in appl.feeders.items():
+                                if feeder.failed():
+                                    Terminal.inst().error("Backtesting aborted, failed to fetch the data of %s" % market_id, view='status')
+                                    return True
+
+                        return False
+
                     def run(self):
                         prev = self.c
                         min_limit = 0.0001
@@ -306,6 +406,9 @@ class StrategyService(Service):
                             if appl.trader() and appl.trader() not in traders:
                                 traders.append(appl.trader())
 
+                        if self.event_clock:
+                            self.init_event_clock(appliances)
+
                         if len(appliances) == 1:
                             # a signe appliance, don't need to parellelize, and to sync, python sync suxx a lot, avoid the overload in most of the
                             # backtesting usage
@@ -316,11 +419,13 @@ class StrategyService(Service):
 
                                 appl.backtest_update(self.c, self.e)
 
+                                next_c = self.next_step()
+
                                 if self.tf > 0:
                                     # wait factor of time step, so 1 mean realtime simulation, 0 mean as fast as possible
-                                    time.sleep((1/self.tf)*self.ts)
+                                    time.sleep((1/self.tf)*(next_c - self.c))
 
-                                self.c += self.ts  # add one time step
+                                self.c = next_c  # add one or more time step
                                 self.service._timestamp = self.c
 
                                 # one more step then we can update traders (limits orders, P/L update...)
@@ -329,7 +434,7 @@ class StrategyService(Service):
 
                                 time.sleep(0)  # yield
 
-                                if self.abort:
+                                if self.abort or self.failed(appliances):
                                     break
                         else:
                             # multiple appliances, parralelise them
@@ -355,11 +460,13 @@ class StrategyService(Service):
                                         break
 
                                 if not wait:
+                                    next_c = self.next_step()
+
                                     if self.tf > 0:
                                         # wait factor of time step, so 1 mean realtime simulation, 0 mean as fast as possible
-                                        time.sleep((1/self.tf)*self.ts)
+                                        time.sleep((1/self.tf)*(next_c - self.c))
 
-                                    self.c += self.ts  # add one time step
+                                    self.c = next_c  # add one or more time step
                                     self.service._timestamp = self.c
 
                                     # one more step then we can update traders (limits orders, P/L update...)
@@ -368,10 +475,10 @@ class StrategyService(Service):
 
                                 time.sleep(0)  # yield
 
-                                if self.abort:
+                                if self.abort or self.failed(appliances):
                                     break
 
-                self._timestep_thread = TimeStepThread(self, self._start_ts, self._end_ts, self._timestep, self._time_factor)
+                self._timestep_thread = TimeStepThread(self, self._start_ts, self._end_ts, self._timestep, self._time_factor, self._event_clock)
                 self._timestep_thread.setDaemon(True)
                 self._timestep_thread.start()
 
@@ -13,6 +13,7 @@ from datetime import datetime
 from terminal.terminal import Terminal, Color
 
 from common.runnable import Runnable
+from common.workerpool import ProcessWorkerPool
 from monitor.streamable import Streamable, StreamMemberFloat, StreamMemberBool
 from common.utils import timeframe_to_str, timeframe_from_str
 
@@ -53,7 +54,7 @@ class Strategy(Runnable):
     @todo Move Each COMMAND_ to command/ and have a registry
     """
 
-    MAX_SIGNALS = 2000   # max size of the signals messages queue before ignore some market data (tick, ohlc)
+    MAX_SIGNALS = 2000   # size of the signals messages queue from which the strategy is considered overloaded
 
     COMMAND_SHOW_STATS = 1
     COMMAND_SHOW_HISTORY = 2
@@ -91,6 +92,13 @@ class Strategy(Runnable):
 
         self._signals = collections.deque()  # filtered received signals
 
+        # coalescing inbox of the market data from the watchers, per market id
+        self._inbox_mutex = threading.Lock()
+        self._inbox_ticks = {}        # received ticks, appended
+        self._inbox_market_data = {}  # latest market data only
+        self._inbox_market_info = {}  # latest market info only
+        self._inbox_order_book = {}   # latest order book only
+
         self._instruments = {}       # mapped instruments
         self._feeders = {}           # feeders mapped by market id
         self._strategy_traders = {}  # per instrument strategy data analyser
@@ -103,6 +111,10 @@ class Strategy(Runnable):
 
         self._cpu_load = 0.0   # global CPU for all the instruments managed by a strategy
 
+        self._process_pool = None    # shard worker processes when the process pool mode is enabled, False if not supported
+        self._remote_candles = {}    # candles received from the watchers and waiting to be posted to the shards
+        self._remote_results = collections.deque()  # results returned by the shard worker processes
+
         if options.get('trader'):
             trader_conf = options['trader']
             if trader_conf.get('name'):
@@ -278,13 +290,17 @@ class Strategy(Runnable):
     def post_run(self):
         Terminal.inst().info("Joining appliance %s - %s..." % (self._name, self._identifier), view='content')
 
+        if self._process_pool:
+            self._process_pool.stop()
+            self._process_pool = None
+
     def post_update(self):
         # load of the strategy
         self._cpu_load = len(self._signals) / float(Strategy.MAX_SIGNALS)
 
-        # strategy must consume its signal else there is first a warning, and then some market data could be ignored
+        # strategy must consume its signal else there is a warning
         if len(self._signals) > Strategy.MAX_SIGNALS:
-            Terminal.inst().warning("Appliance %s has more than %s waiting signals, some market data could be ignored !" % (
+            Terminal.inst().warning("Appliance %s has more than %s waiting signals !" % (
                 self.name, Strategy.MAX_SIGNALS), view='debug')
 
         # dont waste the CPU in live mode
@@ -377,6 +393,9 @@ class Strategy(Runnable):
                     else:
                         instrument = self._instruments.get(mapped_symbol)
 
+                    # receive the market data of this instrument only
+                    self.subscribe_market(watcher_name, mapped_symbol)
+
                     if watcher.has_prices_and_volumes:
                         instrument.add_watcher(Watcher.WATCHER_PRICE_AND_VOLUME, watcher)
 
@@ -528,6 +547,10 @@ class Strategy(Runnable):
 
         return None
 
+    @property
+    def feeders(self):
+        return self._feeders
+
     def feeder(self, market_id):
         return self._feeders.get(market_id)
 
@@ -557,9 +580,45 @@ class Strategy(Runnable):
         Does not override this method. Internal update mecanism.
         """
         do_update = {}
-        count = 0
 
-        while self._signals:
+        # the coalesced market data, and the ticks received since the last update
+        self._inbox_mutex.acquire()
+
+        inbox_ticks, self._inbox_ticks = self._inbox_ticks, {}
+        inbox_market_data, self._inbox_market_data = self._inbox_market_data, {}
+        inbox_market_info, self._inbox_market_info = self._inbox_market_info, {}
+        inbox_order_book, self._inbox_order_book = self._inbox_order_book, {}
+
+        self._inbox_mutex.release()
+
+        for market_id, market in inbox_market_info.items():
+            instrument = self.instrument(market_id)
+            if instrument is not None and market:
+                self.update_market_info(instrument, market)
+
+        for market_id, data in inbox_market_data.items():
+            instrument = self.instrument(market_id)
+            if instrument is not None:
+                self.update_market_data(instrument, data)
+
+        for market_id, data in inbox_order_book.items():
+            instrument = self.instrument(market_id)
+            if instrument is not None:
+                instrument.set_order_book(data[1], data[2])
+
+        for market_id, ticks in inbox_ticks.items():
+            instrument = self.instrument(market_id)
+            if instrument is None:
+                continue
+
+            # add the new ticks to the instrument in live mode
+            if instrument.ready():
+                instrument.add_tick(ticks)
+
+            do_update[instrument] = 0
+
+        # the others signals are processed in order, but no more than the ones received before this update
+        for i in range(len(self._signals)):
             signal = self._signals.popleft()
 
             if signal.source == Signal.SOURCE_STRATEGY:
@@ -580,19 +639,7 @@ class Strategy(Runnable):
                                 trader.set_market(market)
 
                             # put interesting market data into the instrument
-                            instrument.trade = market.trade
-                            instrument.orders = market.orders
-                            instrument.hedging = market.hedging
-                            instrument.tradeable = market.is_open
-                            instrument.set_base(market.base)
-                            instrument.set_quote(market.quote)
-
-                            instrument.set_price_limits(market.min_price, market.max_price, market.step_price)
-                            instrument.set_notional_limits(market.min_notional, market.max_notional, market.step_notional)
-                            instrument.set_size_limits(market.min_size, market.max_size, market.step_size)
-
-                            instrument.set_fees(market.maker_fee, market.taker_fee)
-                            instrument.set_commissions(market.maker_commission, market.taker_commission)
+                            self.update_market_info(instrument, market)
 
                     if self.service.backtesting:
                         # retrieve the feeder by the relating instrument market_id or symbol
@@ -623,21 +670,8 @@ class Strategy(Runnable):
                             strategy_trader.loads(data[2], data[3])
 
             elif signal.source == Signal.SOURCE_WATCHER:
-                if signal.signal_type == Signal.SIGNAL_TICK_DATA:
-                    # interest in tick data
-
-                    # symbol mapping
-                    instrument = self.instrument(signal.data[0])
-                    if instrument is None:
-                        continue
-
-                    # add the new candle to the instrument in live mode
-                    if instrument.ready():
-                        instrument.add_tick(signal.data[1])
-
-                    do_update[instrument] = 0
-
-                elif signal.signal_type == Signal.SIGNAL_CANDLE_DATA:
+                # ticks (and bulks of), market data and market info are received from the inbox
+                if signal.signal_type == Signal.SIGNAL_CANDLE_DATA:
                     # interest in candle data
 
                     # symbol mapping
@@ -649,25 +683,15 @@ class Strategy(Runnable):
                     if instrument.ready():
                         instrument.add_candle(signal.data[1])
 
+                        if self._process_pool:
+                            # and to the instrument of its shard worker process
+                            self._remote_candles.setdefault(instrument, []).append(signal.data[1])
+
                     if instrument not in do_update:
                         do_update[instrument] = signal.data[1].timeframe
                     else:
                         do_update[instrument] = min(signal.data[1].timeframe, do_update[instrument])
 
-                elif signal.signal_type == Signal.SIGNAL_TICK_DATA_BULK:
-                    # incoming bulk of history ticks
-                    instrument = self.instrument(signal.data[0])
-                    if instrument is None:
-                        continue
-
-                    # initials ticks loaded
-                    instrument.ack_timeframe(0)
-
-                    # insert the bulk of ticks into the instrument
-                    if signal.data[1]:
-                        instrument.add_tick(signal.data[1])
-                        do_update[instrument] = 0
-
                 elif signal.signal_type == Signal.SIGNAL_CANDLE_DATA_BULK:
                     # incoming bulk of history candles
                     instrument = self.instrument(signal.data[0])
@@ -696,48 +720,6 @@ class Strategy(Runnable):
                         else:
                             do_update[instrument] = min(signal.data[1], do_update[instrument])
 
-                elif signal.signal_type == Signal.SIGNAL_MARKET_DATA:
-                    # update market data
-                    instrument = self.instrument(signal.data[0])
-                    if instrument is None:
-                        continue
-
-                    # update instrument data
-                    instrument.tradeable = signal.data[1]
-
-                    if signal.data[1]:
-                        instrument.last_update_time = signal.data[2]
-                        instrument.market_bid = signal.data[3]
-                        instrument.market_ofr = signal.data[4]
-
-                        instrument.base_exchange_rate = signal.data[5]
-                        instrument.vol24h_base = signal.data[8]
-                        instrument.vol24h_quote = signal.data[9]
-
-                elif signal.signal_type == Signal.SIGNAL_MARKET_INFO_DATA:
-                    # update market info data
-                    instrument = self.instrument(signal.data[0])
-                    if instrument is None:
-                        continue
-
-                    market = signal.data[1]
-
-                    if market:
-                        # put interesting market data into the instrument
-                        instrument.trade = market.trade
-                        instrument.orders = market.orders
-                        instrument.hedging = market.hedging
-                        instrument.tradeable = market.is_open
-                        instrument.set_base(market.base)
-                        instrument.set_quote(market.quote)
-
-                        instrument.set_price_limits(market.min_price, market.max_price, market.step_price)
-                        instrument.set_notional_limits(market.min_notional, market.max_notional, market.step_notional)
-                        instrument.set_size_limits(market.min_size, market.max_size, market.step_size)
-
-                        instrument.set_fees(market.maker_fee, market.taker_fee)
-                        instrument.set_commissions(market.maker_commission, market.taker_commission)
-
                 elif signal.signal_type == Signal.SIGNAL_WATCHER_CONNECTED:
                     # initiate the strategy prefetch initial data, only once all watchers are ready
                     if self.check_watchers() and not self._preset:
@@ -755,14 +737,24 @@ class Strategy(Runnable):
                     # trade signal
                     self.order_signal(signal.signal_type, signal.data)
 
-            count += 1
-            if count > 10:
-                # no more than 10 signals per loop
-                break
+        # fork the shard worker processes once the instruments are ready
+        if self._process_pool is None and self.service.process_pool_mode and self.ready():
+            self.setup_process_pool()
 
         # only for normal processing
         if not self.service.backtesting:
-            if do_update:
+            if self._process_pool:
+                for instrument, tf in do_update.items():
+                    if instrument.ready():
+                        # compute on the shard worker process owning the instrument
+                        self.post_remote_update(tf, instrument)
+
+                self._process_pool.flush()
+
+                # and process the signals of the previous computations
+                self.process_remote_results()
+
+            elif do_update:
                 if len(self._instruments) >= 1:
                     # @todo might not need sync in live mode, so add any jobs directly
                     count_down = None  # self.service.worker_pool.new_count_down(len(self._instruments))
@@ -791,6 +783,39 @@ class Strategy(Runnable):
 
         return True
 
+    def update_market_data(self, instrument, data):
+        """
+        Update the instrument from a market data tuple (@see Signal.SIGNAL_MARKET_DATA).
+        """
+        instrument.tradeable = data[1]
+
+        if data[1]:
+            instrument.last_update_time = data[2]
+            instrument.market_bid = data[3]
+            instrument.market_ofr = data[4]
+
+            instrument.base_exchange_rate = data[5]
+            instrument.vol24h_base = data[8]
+            instrument.vol24h_quote = data[9]
+
+    def update_market_info(self, instrument, market):
+        """
+        Put interesting market info data into the instrument.
+        """
+        instrument.trade = market.trade
+        instrument.orders = market.orders
+        instrument.hedging = market.hedging
+        instrument.tradeable = market.is_open
+        instrument.set_base(market.base)
+        instrument.set_quote(market.quote)
+
+        instrument.set_price_limits(market.min_price, market.max_price, market.step_price)
+        instrument.set_notional_limits(market.min_notional, market.max_notional, market.step_notional)
+        instrument.set_size_limits(market.min_size, market.max_size, market.step_size)
+
+        instrument.set_fees(market.maker_fee, market.taker_fee)
+        instrument.set_commissions(market.maker_commission, market.taker_commission)
+
     def update_strategy(self, tf, instrument):
         """
         Override this method to compute a strategy step per instrument.
@@ -809,16 +834,23 @@ class Strategy(Runnable):
         self._next_backtest_update = (timestamp, total_ts)
         self.unlock()
 
-    def backtest_update_instrument(self, trader, instrument, timestamp):
+    def backtest_feed_instrument(self, trader, instrument, timestamp):
+        """
+        Feed the instrument up to the timestamp and returns the list of updated timeframes.
+        """
         # retrieve the feeder by market_id or symbol
         feeder = self._feeders.get(instrument.market_id) or self._feeders.get(instrument.symbol)
 
         # feed of candles prior equal the timestamp and update if new candles on configured timeframe
         updated = feeder.feed(timestamp)
 
+        if self._process_pool and feeder.fed_candles:
+            # and to the instrument of its shard worker process
+            self._remote_candles.setdefault(instrument, []).extend(feeder.fed_candles)
+
         if trader:
             if not trader.has_market(instrument.market_id):
-                return
+                return []
 
             # update market at minor candles
             if updated:
@@ -829,6 +861,11 @@ class Strategy(Runnable):
                 trader.on_update_market(instrument.market_id, True, instrument.last_update_time,
                         instrument.market_bid, instrument.market_ofr, instrument.base_exchange_rate)
 
+        return updated
+
+    def backtest_update_instrument(self, trader, instrument, timestamp):
+        updated = self.backtest_feed_instrument(trader, instrument, timestamp)
+
         # update strategy as necessary
         if updated:
             self.update_strategy(updated[0], instrument)
@@ -846,7 +883,28 @@ class Strategy(Runnable):
         # processing timestamp
         self._timestamp = timestamp
 
-        if len(self._instruments) > 3:
+        if self._process_pool:
+            updates = []
+
+            for market_id, instrument in self._instruments.items():
+                updated = self.backtest_feed_instrument(trader, instrument, timestamp)
+                if updated:
+                    updates.append((updated[0], instrument))
+
+            # compute on the shard worker processes
+            count_down = self._process_pool.new_count_down(len(updates))
+
+            for tf, instrument in updates:
+                self.post_remote_update(tf, instrument, count_down)
+
+            self._process_pool.flush()
+
+            # sync before processing the signals
+            count_down.wait()
+
+            self.process_remote_results()
+
+        elif len(self._instruments) > 3:
             count_down = self.service.worker_pool.new_count_down(len(self._instruments))
 
             for market_id, instrument in self._instruments.items():
@@ -863,6 +921,105 @@ class Strategy(Runnable):
         # last done timestamp, to manage progression
         self._last_done_ts = timestamp
 
+    #
+    # process worker pool
+    #
+
+    def setup_process_pool(self):
+        """
+        Fork the shard worker processes, each one owning the instruments and strategy traders of its shard.
+        Only strategy traders supporting the remote compute (timeframe based) are supported, else it fallback
+        to the threads worker pool.
+        """
+        for instrument, strategy_trader in self._strategy_traders.items():
+            if not hasattr(strategy_trader, 'remote_compute'):
+                Terminal.inst().warning("Appliance %s does not support the process pool mode, use the threads pool" % self._name, view='status')
+                self._process_pool = False
+                return
+
+        self._process_pool = ProcessWorkerPool(self.remote_update, self.on_remote_results, self.service.process_pool_workers, self.init_remote)
+        self._process_pool.start()
+
+        Terminal.inst().info("Appliance %s started %s shard worker processes" % (self._name, self._process_pool.num_workers), view='status')
+
+    def init_remote(self):
+        """
+        Run once into the shard worker process after the fork. The lockers could be owned by another thread
+        of the parent process at the time of the fork, so they are renewed.
+        """
+        self._mutex = threading.RLock()
+
+        for instrument, strategy_trader in self._strategy_traders.items():
+            strategy_trader._mutex = threading.RLock()
+
+    def post_remote_update(self, tf, instrument, count_down=None):
+        """
+        Post the deltas of data of the instrument to its shard worker process.
+        """
+        strategy_trader = self._strategy_traders.get(instrument)
+        if not strategy_trader:
+            if count_down:
+                count_down.done()
+            return
+
+        strategy_trader.lock()
+
+        ticks = instrument.ticks_after(0)
+        instrument.clear_ticks()
+
+        candles = self._remote_candles.pop(instrument, [])
+
+        # same gating as the process of the strategy trader, the data are posted in any case
+        compute = instrument.ready() and strategy_trader.remote_filter(tf, self.timestamp)
+
+        strategy_trader.unlock()
+
+        self._process_pool.add_job(instrument.market_id, count_down, (instrument.market_id, tf, self.timestamp, ticks, candles,
+                (instrument.last_update_time, instrument.market_bid, instrument.market_ofr), compute))
+
+    def remote_update(self, data):
+        """
+        Run into the shard worker process, apply the deltas of data to the instrument and compute its strategy trader.
+        """
+        market_id, tf, timestamp, ticks, candles, prices, compute = data
+
+        instrument = self._instruments.get(market_id)
+        strategy_trader = self._strategy_traders.get(instrument)
+
+        if not strategy_trader:
+            return None
+
+        instrument.last_update_time, instrument.market_bid, instrument.market_ofr = prices
+
+        if len(ticks):
+            instrument.add_tick(ticks)
+
+        for candle in candles:
+            instrument.add_candle(candle)
+
+        return market_id, tf, strategy_trader.remote_compute(tf, timestamp, compute)
+
+    def on_remote_results(self, results):
+        """
+        Results of a shard worker process, received from the reader thread of the process pool.
+        """
+        if results:
+            self._remote_results.append(results)
+
+    def process_remote_results(self):
+        """
+        Process the signals computed by the shard worker processes (trades management).
+        """
+        while self._remote_results:
+            market_id, tf, results = self._remote_results.popleft()
+
+            instrument = self._instruments.get(market_id)
+            strategy_trader = self._strategy_traders.get(instrument)
+
+            if strategy_trader:
+                strategy_trader.set_remote_results(results)
+                self.update_strategy(tf, instrument)
+
     def reset(self):
         # backtesting only, the last processed timestamp
         self._last_done_ts = 0
@@ -1065,24 +1222,33 @@ class Strategy(Runnable):
                 # not interested by this watcher
                 return
 
-            # filter by instrument for tick data
-            if signal.signal_type == Signal.SIGNAL_TICK_DATA:
-                if Instrument.TF_TICK != self.base_timeframe():
-                    # must be equal to the base timeframe only
-                    return
+            # the market data (ticks, candles, market info...) are routed per instrument (@see subscribe_market)
 
-                if signal.data[0] not in self._instruments:
-                    # non interested by this instrument/symbol
-                    return
+            # ticks are batched, and only the latest market data and info are kept, per market
+            if signal.signal_type == Signal.SIGNAL_TICK_DATA_BULK:
+                if signal.data[2]:
+                    self._inbox_mutex.acquire()
+                    self._inbox_ticks.setdefault(signal.data[0], []).extend(signal.data[2])
+                    self._inbox_mutex.release()
+                return
 
-            elif signal.signal_type == Signal.SIGNAL_CANDLE_DATA:
-                if signal.data[1].timeframe != self.base_timeframe():
-                    # must be of equal to the base timeframe only
-                    return
+            elif signal.signal_type == Signal.SIGNAL_MARKET_DATA:
+                self._inbox_mutex.acquire()
+                self._inbox_market_data[signal.data[0]] = signal.data
+                self._inbox_mutex.release()
+                return
 
-                if signal.data[0] not in self._instruments:
-                    # non interested by this instrument/symbol
-                    return
+            elif signal.signal_type == Signal.SIGNAL_MARKET_INFO_DATA:
+                self._inbox_mutex.acquire()
+                self._inbox_market_info[signal.data[0]] = signal.data[1]
+                self._inbox_mutex.release()
+                return
+
+            elif signal.signal_type == Signal.SIGNAL_ORDER_BOOK:
+                self._inbox_mutex.acquire()
+                self._inbox_order_book[signal.data[0]] = signal.data
+                self._inbox_mutex.release()
+                return
 
             # filter by instrument for buy/sell signal
             elif signal.signal_type == Signal.SIGNAL_BUY_SELL_ORDER:
@@ -1090,22 +1256,7 @@ class Strategy(Runnable):
                     # non interested by this instrument/symbol
                     return
 
-            elif signal.signal_type == Signal.SIGNAL_MARKET_DATA:
-                if signal.data[0] not in self._instruments:
-                    # non interested by this instrument/symbol
-                    return
-
-            elif signal.signal_type == Signal.SIGNAL_MARKET_INFO_DATA:
-                if signal.data[0] not in self._instruments:
-                    # non interested by this instrument/symbol
-                    return
-
-            if len(self._signals) > Strategy.MAX_SIGNALS:
-                # if strategy message queue saturate its mostly because of market data too many update
-                # from the watcher (in live) so then ignore some of those message, the others ones are too important to be ignored
-                return
-
-            # signal of interest
+            # signal of interest, candles, orders and positions are never coalesced nor ignored
             self._signals.append(signal)
 
         elif signal.source == Signal.SOURCE_TRADER:
@@ -1113,6 +1264,21 @@ class Strategy(Runnable):
                 # signal of interest
                 self._signals.append(signal)
 
+    def subscribe_market(self, watcher_name, market_id):
+        """
+        Subscribe to the market data signals of an instrument from a watcher, the ticks or the candles being
+        received at the base timeframe only, and the bulks of candles history at any timeframe.
+        """
+        if self.base_timeframe() == Instrument.TF_TICK:
+            # the ticks are notified by batches, only processed by the tick based strategies
+            self.watcher_service.subscribe(self, watcher_name, Signal.SIGNAL_TICK_DATA_BULK, market_id)
+        else:
+            self.watcher_service.subscribe(self, watcher_name, Signal.SIGNAL_CANDLE_DATA, market_id, self.base_timeframe())
+
+        for signal_type in (Signal.SIGNAL_CANDLE_DATA_BULK, Signal.SIGNAL_MARKET_DATA, Signal.SIGNAL_MARKET_INFO_DATA,
+                Signal.SIGNAL_ORDER_BOOK):
+            self.watcher_service.subscribe(self, watcher_name, signal_type, market_id)
+
     def position_signal(self, signal_type, data):
         """
         Receive of the position signals. Dispatch if mapped instrument.
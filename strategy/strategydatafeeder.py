@@ -14,9 +14,10 @@ class StrategyDataFeeder(object):
     Ticks and candles data feeder for strategy backtesting. It read data from specific streamer.
     """
 
-    def __init__(self, strategy, market_id, timeframes, ticks):
+    def __init__(self, strategy, market_id, timeframes, ticks, use_mmap=True):
         """
         For backtesting only fetch data from database and stream them according the timestamp.
+        @param use_mmap Map the binary tick files and feed the instrument with array slices.
         """
         self._strategy = strategy
         self._initialized = False
@@ -29,8 +30,10 @@ class StrategyDataFeeder(object):
 
         self._fetch_ticks = ticks
         self._tick_streamer = None
+        self._use_mmap = use_mmap
 
         self._finished = False
+        self._fed_candles = []  # candles fed at the last feed
 
     @property
     def strategy(self):
@@ -44,6 +47,11 @@ class StrategyDataFeeder(object):
     def instrument(self):
         return self._instrument
 
+    @property
+    def fed_candles(self):
+        """Candles fed to the instrument by the last feed, for any timeframes."""
+        return self._fed_candles
+
     def initialize(self, watcher_name, from_date, to_date):
         """
         Initialize data streamer.
@@ -52,7 +60,8 @@ class StrategyDataFeeder(object):
             self._candle_streamer[tf] = Database.inst().create_ohlc_streamer(watcher_name, self._market_id, tf, from_date=from_date, to_date=to_date)
 
         if self._fetch_ticks:
-            self._tick_streamer = Database.inst().create_tick_streamer(watcher_name, self._market_id, from_date=from_date, to_date=to_date)
+            self._tick_streamer = Database.inst().create_tick_streamer(watcher_name, self._market_id,
+                    from_date=from_date, to_date=to_date, use_mmap=self._use_mmap)
 
         self._initialized = True
 
@@ -68,6 +77,27 @@ class StrategyDataFeeder(object):
         """Returns True if there is no more data for any timeframes."""
         return self._finished
 
+    def failed(self):
+        """Returns True if the data of a timeframe cannot be fetched, the feed is then incomplete."""
+        return any(streamer is not None and streamer.failed() for streamer in self._candle_streamer.values())
+
+    def next_timestamp(self):
+        """
+        Timestamp of the next data to feed for any timeframes, or None if there is no more data.
+        """
+        timestamps = []
+
+        for tf, streamer in self._candle_streamer.items():
+            if streamer is not None and not streamer.finished():
+                timestamps.append(streamer.next_timestamp())
+
+        if self._tick_streamer and not self._tick_streamer.finished():
+            timestamps.append(self._tick_streamer.next_timestamp())
+
+        timestamps = [ts for ts in timestamps if ts is not None]
+
+        return min(timestamps) if timestamps else None
+
     def feed(self, timestamp):
         """
         Feed the next candles to fill the passed timestamp, for the predefined timeframes and instrument.
@@ -78,6 +108,8 @@ class StrategyDataFeeder(object):
         updated = []
         finished = True
 
+        self._fed_candles = []
+
         # need instrument be ready
         if self._instrument is None:
             return []
@@ -92,13 +124,14 @@ class StrategyDataFeeder(object):
 
             if candles:
                 self._instrument.add_candle(candles)
+                self._fed_candles.extend(candles)
                 updated.append(tf)
 
                 # defines the last market price
                 self.instrument.market_bid = candles[-1].bid_close
                 self.instrument.market_ofr = candles[-1].ofr_close
 
-            finished = streamer.finished() and not candles
+            finished = finished and streamer.finished() and not candles
 
         # ticks must be ready
         if self._tick_streamer and not self._tick_streamer.finished():
@@ -108,8 +141,23 @@ class StrategyDataFeeder(object):
             #   self._instrument.add_tick(ticks)
             #   updated.append(0)
 
+            if self._tick_streamer.use_mmap:
+                # columnar batch version, zero-copy from the mapped file
+                ticks = self._tick_streamer.next_batch(timestamp)
+
+                if len(ticks):
+                    self._instrument.add_tick(ticks)
+                    updated.append(0)
+
+                    # defines the last market price
+                    last_tick = ticks[-1]
+
+                    self.instrument.last_update_time = last_tick[0]
+                    self.instrument.market_bid = last_tick[1]
+                    self.instrument.market_ofr = last_tick[2]
+
             # speedup version, direct fill the instrument array
-            if self._tick_streamer.next_to(timestamp, self._instrument._ticks):
+            elif self._tick_streamer.next_to(timestamp, self._instrument._ticks):
                 updated.append(0)
 
                 # defines the last market price (prefer at tick if we have candles and ticks)
@@ -117,7 +165,7 @@ class StrategyDataFeeder(object):
                 self.instrument.market_bid = self._instrument._ticks[-1][1]
                 self.instrument.market_ofr = self._instrument._ticks[-1][2]
 
-            finished = self._tick_streamer.finished()
+            finished = finished and self._tick_streamer.finished()
 
         if finished:
             # fed all data
@@ -5,11 +5,14 @@
 
 import copy
 
+import numpy as np
+
 from terminal.terminal import Terminal
 
 from strategy.strategy import Strategy
 from strategy.strategytrader import StrategyTrader
 from strategy.strategysignal import StrategySignal
+from strategy.indicator.indicator import Indicator
 
 from instrument.instrument import Instrument, Candle
 from instrument.candlegenerator import CandleGenerator
@@ -33,6 +36,8 @@ class TimeframeBasedStrategyTrader(StrategyTrader):
     @see Strategy.base_timeframe
     """
 
+    REMOTE_STATE_DEPTH = 3  # number of the last values of the arrays of the indicators returned by remote_compute
+
     def __init__(self, strategy, instrument, base_timeframe=Instrument.TF_TICK, wait_next_update=False):
         """
         @param strategy Parent strategy (mandatory)
@@ -49,6 +54,8 @@ class TimeframeBasedStrategyTrader(StrategyTrader):
         self.timeframes = {}  # analyser per timeframe
         self.tfs_chain = []
 
+        self._remote_results = None  # signals computed by a shard worker process, waiting to be processed
+
     @property
     def base_timeframe(self):
         return self._base_timeframe
@@ -71,6 +78,12 @@ class TimeframeBasedStrategyTrader(StrategyTrader):
         """
         self.lock()
 
+        if self._remote_results is not None:
+            # candles are generated by the shard worker process and received with the results,
+            # and the ticks are cleared once posted
+            self.unlock()
+            return
+
         # at tick we update any timeframes because we want the non consolidated candle
         for tf, sub in self.timeframes.items():
             # update at tick
@@ -169,6 +182,13 @@ class TimeframeBasedStrategyTrader(StrategyTrader):
         If wait_next_update is set then it will only compute signal for a particular timeframe
         when the need_update method return True. The standard implementation is to compute signal at a candle close.
         """
+        if self._remote_results is not None:
+            # already computed by the shard worker process
+            entries, exits = self._remote_results
+            self._remote_results = None
+
+            return entries, exits
+
         # split entries from exits signals
         entries = []
         exits = []
@@ -201,6 +221,89 @@ class TimeframeBasedStrategyTrader(StrategyTrader):
 
         return entries, exits
 
+    #
+    # process worker pool
+    #
+
+    def filter_market(self, timestamp):
+        """
+        The first boolean mean accept, the second compute.
+        Override to filter the market, default accept and compute any market.
+        """
+        return True, True
+
+    def remote_filter(self, timeframe, timestamp):
+        """
+        Same gating as the process, evaluated by the parent process before posting to the shard worker process.
+        Returns True if the signals must be computed.
+        """
+        if timeframe != self.base_timeframe:
+            return False
+
+        accept, compute = self.filter_market(timestamp)
+
+        return accept and compute
+
+    def remote_compute(self, timeframe, timestamp, compute=True):
+        """
+        Generate the candles and compute the signals of the subs, from the shard worker process owning this instrument.
+        Returns the signals, the updated candles and the last state of the subs, to be applied to the strategy trader
+        of the parent process with set_remote_results before its process.
+
+        The state of a sub is limited to what the process reads : the scalars, the signals, and the indicators
+        with only the last REMOTE_STATE_DEPTH values of their arrays (@see Indicator.tail).
+
+        @param compute If False only the candles are generated, without signals (@see remote_filter).
+        """
+        last_timestamps = {}
+
+        for tf in self.timeframes.keys():
+            candle = self.instrument.candle(tf)
+            last_timestamps[tf] = candle.timestamp if candle else 0
+
+        if timeframe == self.base_timeframe:
+            self.gen_candles_from_ticks(timestamp)
+
+        entries, exits = self.compute(timeframe, timestamp) if compute else ([], [])
+
+        candles = {}
+        states = {}
+
+        for tf, sub in self.timeframes.items():
+            candles[tf] = list(self.instrument.candles_from(tf, last_timestamps[tf]))
+
+            # anything excepted the references to the parent and the generator
+            states[tf] = {k: self.__remote_state(v) for k, v in sub.__dict__.items() if k not in ('strategy_trader', 'candles_gen')}
+
+        return entries, exits, candles, states
+
+    def __remote_state(self, value):
+        if isinstance(value, Indicator):
+            return value.tail(TimeframeBasedStrategyTrader.REMOTE_STATE_DEPTH)
+        elif isinstance(value, np.ndarray):
+            return value[-TimeframeBasedStrategyTrader.REMOTE_STATE_DEPTH:].copy()
+
+        return value
+
+    def set_remote_results(self, results):
+        """
+        Apply the results of remote_compute, the next process will use its signals in place of a local compute.
+        """
+        entries, exits, candles, states = results
+
+        self.lock()
+
+        for tf, sub in self.timeframes.items():
+            if candles.get(tf):
+                self.instrument.add_candle(candles[tf], sub.history)
+
+            if tf in states:
+                sub.__dict__.update(states[tf])
+
+        self._remote_results = (entries, exits)
+
+        self.unlock()
+
     def parent_timeframe(self, tf):
         # higher timeframe if not the root else himself
         timeframe = self.timeframes.get(tf, None)
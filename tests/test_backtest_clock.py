@@ -0,0 +1,85 @@
+# @date 2019-03-27
+# @author Frederic SCHERMA
+# @license Copyright (c) 2019 Dream Overflow
+# Event clock of the backtesting.
+
+import unittest
+
+from strategy.service import BacktestEventClock
+
+
+class Feeder(object):
+    """
+    Feeder of data at the given timestamps, consuming them when fed, or never if not consuming.
+    """
+
+    def __init__(self, timestamps, consume=True):
+        self.timestamps = list(timestamps)
+        self.consume = consume
+
+    def next_timestamp(self):
+        return self.timestamps[0] if self.timestamps else None
+
+    def feed(self, timestamp):
+        if self.consume:
+            while self.timestamps and self.timestamps[0] <= timestamp:
+                self.timestamps.pop(0)
+
+
+class TestBacktestEventClock(unittest.TestCase):
+
+    def run_clock(self, clock, feeders, c, max_steps=1000):
+        steps = []
+
+        clock.init(feeders)
+
+        while c < clock.e + clock.ts and len(steps) < max_steps:
+            for feeder in feeders:
+                feeder.feed(c)
+
+            steps.append(c)
+            c = clock.next_step(c)
+
+        return steps
+
+    def test_skip_empty_timesteps(self):
+        clock = BacktestEventClock(0.0, 1000.0, 10.0)
+        feeders = [Feeder([0.0, 15.0, 500.0]), Feeder([42.0])]
+
+        # aligned on the timesteps, the data of a timestep being fed at its end
+        self.assertEqual(self.run_clock(clock, feeders, 0.0), [0.0, 20.0, 50.0, 500.0])
+
+    def test_feeder_never_consuming(self):
+        clock = BacktestEventClock(0.0, 100.0, 10.0)
+        feeders = [Feeder([5.0, 50.0], consume=False)]
+
+        # the clock moves forward by one timestep until the end
+        steps = self.run_clock(clock, feeders, 0.0)
+
+        self.assertEqual(steps, [i * 10.0 for i in range(0, 11)])
+
+    def test_feeder_consuming_later(self):
+        clock = BacktestEventClock(0.0, 1000.0, 10.0)
+        lazy = Feeder([5.0, 900.0], consume=False)
+        feeders = [lazy, Feeder([300.0])]
+
+        clock.init(feeders)
+
+        c = 0.0
+        for i in range(0, 5):
+            c = clock.next_step(c)
+
+        self.assertEqual(c, 50.0)
+
+        # once consumed the clock jumps again
+        lazy.consume = True
+        lazy.feed(c)
+
+        self.assertEqual(clock.next_step(c), 300.0)
+
+        feeders[1].feed(300.0)
+        self.assertEqual(clock.next_step(300.0), 900.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
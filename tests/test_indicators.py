@@ -0,0 +1,151 @@
+# @date 2019-03-26
+# @author Frederic SCHERMA
+# @license Copyright (c) 2019 Dream Overflow
+# Incremental compute mode of the indicators against the TA-Lib batch output, and the indicators utils.
+
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from talib import EMA as ta_EMA, SMA as ta_SMA, RSI as ta_RSI, ATR as ta_ATR, MACD as ta_MACD, \
+    BBANDS as ta_BBANDS, STOCHRSI as ta_STOCHRSI
+
+from strategy.indicator.indicator import Indicator
+from strategy.indicator.utils import MM_n
+from strategy.indicator.ema.ema import EMAIndicator
+from strategy.indicator.sma.sma import SMAIndicator
+from strategy.indicator.rsi.rsi import RSIIndicator
+from strategy.indicator.atr.atr import ATRIndicator
+from strategy.indicator.macd.macd import MACDIndicator
+from strategy.indicator.bollingerbands.bollingerbands import BollingerBandsIndicator
+from strategy.indicator.stochrsi.stochrsi import StochRSIIndicator
+
+
+class TestIncrementalIndicators(unittest.TestCase):
+    """
+    Each indicator in incremental mode is fed with a growing history, where the last sample is updated
+    a few times (STEP_UPDATE) before the next one follows (STEP_NEXT), with some gaps of timestamp (reseed).
+    After each compute its results must be the TA-Lib batch output over the same history.
+    """
+
+    TIMEFRAME = 60.0
+
+    INITIAL = 60      # size of the initial history
+    SAMPLES = 120     # number of the next samples
+    UPDATES = 3       # updates of a sample before the next one
+    GAPS = (40, 90)   # index of the next samples following a gap
+
+    def setUp(self):
+        self.rnd = np.random.RandomState(42)
+
+    def run_indicator(self, indicator, compute, batch):
+        """
+        @param compute Callable(indicator, timestamp, high, low, close) returning the results of the indicator.
+        @param batch Callable(high, low, close) returning the TA-Lib results for the same history.
+        """
+        indicator.incremental = True
+
+        n = self.INITIAL + self.SAMPLES
+        base = 100.0 + np.cumsum(self.rnd.normal(0.0, 1.0, n))
+
+        close = base[:self.INITIAL].copy()
+        high = close + 0.5
+        low = close - 0.5
+
+        timestamp = self.INITIAL * self.TIMEFRAME
+        steps = []
+
+        step = Indicator.step
+
+        def record_step(indicator, *args):
+            steps.append(step(indicator, *args))
+            return steps[-1]
+
+        for i in range(self.INITIAL, n):
+            timestamp += self.TIMEFRAME * (2 if i - self.INITIAL in self.GAPS else 1)
+
+            close = np.append(close, base[i])
+            high = np.append(high, base[i] + 0.5)
+            low = np.append(low, base[i] - 0.5)
+
+            for u in range(0, self.UPDATES):
+                if u > 0:
+                    # the last sample is updated
+                    close[-1] += self.rnd.normal(0.0, 0.5)
+                    high[-1] = max(high[-1], close[-1])
+                    low[-1] = min(low[-1], close[-1])
+
+                with mock.patch.object(Indicator, 'step', record_step):
+                    results = compute(indicator, timestamp, high, low, close)
+
+                expected = batch(high, low, close)
+
+                if not isinstance(results, tuple):
+                    results, expected = (results,), (expected,)
+
+                for result, value in zip(results, expected):
+                    self.assertEqual(len(result), len(close))
+                    np.testing.assert_allclose(result[-1], value[-1], rtol=1e-8, atol=1e-8)
+                    np.testing.assert_allclose(result[-self.UPDATES:], value[-self.UPDATES:], rtol=1e-8, atol=1e-8)
+
+        # a reseed at the first compute and after each gap only
+        self.assertEqual(steps.count(Indicator.STEP_RESEED), 1 + len(self.GAPS))
+        self.assertEqual(steps.count(Indicator.STEP_NEXT), self.SAMPLES - 1 - len(self.GAPS))
+        self.assertEqual(steps.count(Indicator.STEP_UPDATE), self.SAMPLES * (self.UPDATES - 1))
+
+    def test_ema(self):
+        self.run_indicator(EMAIndicator(self.TIMEFRAME, 9),
+            lambda i, t, h, l, c: i.compute(t, c),
+            lambda h, l, c: ta_EMA(c, 9))
+
+    def test_sma(self):
+        self.run_indicator(SMAIndicator(self.TIMEFRAME, 9),
+            lambda i, t, h, l, c: i.compute(t, c),
+            lambda h, l, c: ta_SMA(c, 9))
+
+    def test_rsi(self):
+        self.run_indicator(RSIIndicator(self.TIMEFRAME, 14),
+            lambda i, t, h, l, c: i.compute(t, c),
+            lambda h, l, c: ta_RSI(c, 14) * 0.01)
+
+    def test_atr(self):
+        self.run_indicator(ATRIndicator(self.TIMEFRAME, 14),
+            lambda i, t, h, l, c: i.compute(t, h, l, c),
+            lambda h, l, c: ta_ATR(h, l, c, timeperiod=14))
+
+    def test_macd(self):
+        self.run_indicator(MACDIndicator(self.TIMEFRAME, 12, 26, 9),
+            lambda i, t, h, l, c: i.compute(t, c),
+            lambda h, l, c: ta_MACD(c, fastperiod=12, slowperiod=26, signalperiod=9)[0])
+
+    def test_bollinger_bands(self):
+        self.run_indicator(BollingerBandsIndicator(self.TIMEFRAME, 20),
+            lambda i, t, h, l, c: i.compute(t, c),
+            lambda h, l, c: ta_BBANDS(c, timeperiod=20, nbdevup=2, nbdevdn=2, matype=0))
+
+    def test_stochrsi(self):
+        self.run_indicator(StochRSIIndicator(self.TIMEFRAME, 14, 9, 3),
+            lambda i, t, h, l, c: i.compute(t, c),
+            lambda h, l, c: ta_STOCHRSI(c, 14, 9, 3, 0))
+
+
+class TestIndicatorsUtils(unittest.TestCase):
+
+    def test_mm_n(self):
+        data = 100.0 + np.cumsum(np.random.RandomState(42).normal(0.0, 1.0, 50))
+
+        # the N first points are the average of the j+1 first samples
+        expected = np.array([np.average(data[max(0, j-8):j+1]) for j in range(0, len(data))])
+
+        np.testing.assert_allclose(MM_n(9, data), expected, rtol=1e-10)
+
+    def test_mm_n_short(self):
+        # less samples than the period
+        np.testing.assert_allclose(MM_n(5, [1.0, 2.0, 3.0]), [1.0, 1.5, 2.0])
+        np.testing.assert_allclose(MM_n(3, [1.0, 2.0, 3.0]), [1.0, 1.5, 2.0])
+        self.assertEqual(len(MM_n(5, [])), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,212 @@
+# @date 2019-03-02
+# @author Frederic SCHERMA
+# @license Copyright (c) 2019 Dream Overflow
+# Micro-benchmarks of some of the computation kernels.
+#
+# Usage : python -m tools.benchmark [indicators] [tick-archive]
+
+import sys
+import time
+
+import numpy as np
+
+
+def mm_n_loop(N, data):
+    """
+    Previous implementation of MM_n, kept as reference.
+    """
+    out = np.zeros(len(data))
+
+    for j in range(N):
+        out[j] = np.average(data[:j+1])
+    for (j,d) in enumerate(data[N-1:]):
+        out[j+N-1] = np.average(data[j:j+N])
+
+    return out
+
+
+def mmexp_n_loop(N, data, has_previous_val = False, previous_value = 0):
+    """
+    Previous implementation of MMexp_n, kept as reference.
+    """
+    An = 2.0 / (1.0 + N)
+    out = np.zeros(len(data))
+
+    if (has_previous_val):
+        out[0] = data[0]*An + (1-An)*previous_value
+        for (j,d) in enumerate(data[1:]):
+            out[j+1] = d*An + (1-An)*out[j]
+    else:
+        for j in range(N):
+            out[j] = np.average(data[:j+1])
+        for (j,d) in enumerate(data[N-1:]):
+            out[j+N-1] = d*An + (1-An)*out[j+N-2]
+
+    return out
+
+
+def rsi_hb_map(data):
+    """
+    Previous implementation of the gains and losses of RSI_n, kept as reference.
+    """
+    variations = np.diff(data)
+
+    h = np.array(list(map(lambda x: max(x,0.000000001), variations)))
+    b = np.array(list(map(lambda x: abs(min(x,-0.000000001)), variations)))
+
+    return h, b
+
+
+def rsi_hb(data):
+    variations = np.diff(data)
+
+    h = np.maximum(variations, 0.000000001)
+    b = np.abs(np.minimum(variations, -0.000000001))
+
+    return h, b
+
+
+def timeit(func, *args, repeat=5):
+    """
+    Best time of a function call in seconds, and its last result.
+    """
+    best = None
+    result = None
+
+    for i in range(repeat):
+        t = time.perf_counter()
+        result = func(*args)
+        t = time.perf_counter() - t
+
+        if best is None or t < best:
+            best = t
+
+    return best, result
+
+
+def max_diff(a, b):
+    if isinstance(a, tuple):
+        return max(max_diff(x, y) for x, y in zip(a, b))
+
+    return float(np.max(np.abs(a - b))) if len(a) else 0.0
+
+
+def bench_indicators(size=10000):
+    """
+    Compare the previous loop based and the vectorized indicators utils on a random walk serie.
+    """
+    from strategy.indicator.utils import MM_n, MMexp_n
+
+    data = 10000.0 + np.cumsum(np.random.normal(0.0, 10.0, size))
+
+    cases = (
+        ("MM_n(21)", mm_n_loop, MM_n, (21, data)),
+        ("MM_n(200)", mm_n_loop, MM_n, (200, data)),
+        ("MMexp_n(21)", mmexp_n_loop, MMexp_n, (21, data)),
+        ("MMexp_n(21, previous)", mmexp_n_loop, MMexp_n, (21, data, True, data[0])),
+        ("RSI h/b", rsi_hb_map, rsi_hb, (data,)),
+    )
+
+    print("%i points serie" % size)
+    print("%-24s %12s %12s %9s %12s" % ("kernel", "loop (ms)", "vector (ms)", "speedup", "max diff"))
+
+    for name, old, new, args in cases:
+        t_old, r_old = timeit(old, *args, repeat=3)
+        t_new, r_new = timeit(new, *args)
+
+        print("%-24s %12.3f %12.3f %8.1fx %12.3g" % (name, t_old*1000, t_new*1000, t_old / t_new, max_diff(r_old, r_new)))
+
+
+def random_ticks(size, start=1546300800.0):
+    """
+    Random walk of ticks (t, b, o, v) with ms timestamps, 2 decimals prices and 4 decimals volumes.
+    """
+    ticks = np.empty((size, 4))
+
+    ticks[:, 0] = start + np.cumsum(np.random.randint(1, 2000, size)) * 0.001
+    ticks[:, 1] = np.round(4000.0 + np.cumsum(np.random.normal(0.0, 0.5, size)), 2)
+    ticks[:, 2] = ticks[:, 1] + np.round(np.random.randint(1, 10, size) * 0.01, 2)
+    ticks[:, 3] = np.round(np.random.exponential(0.5, size), 4)
+
+    return ticks
+
+
+def bench_tick_archive(size=2000000):
+    """
+    Compare the size and the replay throughput of the binary tick file and of the compressed archive.
+    """
+    import os
+    import tempfile
+
+    from datetime import datetime, timedelta
+    from common.utils import UTC
+    from database.tickarchive import TickArchive
+    from database.tickstorage import TickStreamer
+
+    ticks = random_ticks(size)
+    month = datetime.utcfromtimestamp(ticks[0, 0])
+
+    with tempfile.TemporaryDirectory() as markets_path:
+        data_path = os.path.join(markets_path, 'bench', 'BENCH', 'T')
+        os.makedirs(data_path)
+
+        binary = os.path.join(data_path, "%04i%02iBENCH.dat" % (month.year, month.month))
+        archive = os.path.join(data_path, TickArchive.filename('BENCH', (month.year, month.month)))
+
+        ticks.astype('<f8').tofile(binary)
+
+        t_lzma, size_lzma = timeit(TickArchive.write, archive + '.lzma', ticks, TickArchive.DEFAULT_BLOCK_SIZE, TickArchive.CODEC_LZMA, repeat=1)
+        t_zlib, size_zlib = timeit(TickArchive.write, archive, ticks, repeat=1)
+
+        from_date = datetime.utcfromtimestamp(ticks[0, 0]).replace(tzinfo=UTC())
+        to_date = from_date + timedelta(days=31)
+
+        def replay():
+            streamer = TickStreamer(markets_path, 'bench', 'BENCH', from_date, to_date, use_mmap=True)
+            n = 0
+            timestamp = from_date.timestamp()
+
+            # per minute and read the prices, else a mapped file is never read
+            while not streamer.finished():
+                timestamp += 60.0
+                ticks = streamer.next_array(timestamp)
+
+                if len(ticks):
+                    n += len(ticks)
+                    ticks['b'].max()
+
+            return n
+
+        t_binary, n_binary = timeit(replay, repeat=3)
+
+        os.rename(binary, binary + '.bak')
+        t_archive, n_archive = timeit(replay, repeat=3)
+
+        check = TickArchive(archive)
+        check.open()
+        decoded = np.concatenate([check.read_block(i) for i in range(check.num_blocks)])
+        check.close()
+
+    print("%i ticks, encoding %.3fs zlib, %.3fs lzma" % (size, t_zlib, t_lzma))
+    print("%-16s %14s %8s %14s %14s" % ("format", "size (bytes)", "ratio", "replay (ms)", "ticks/s"))
+    print("%-16s %14i %7.1f%% %14.3f %14.0f" % ("binary", size * 32, 100.0, t_binary * 1000, n_binary / t_binary))
+    print("%-16s %14i %7.1f%% %14.3f %14.0f" % ("archive zlib", size_zlib, size_zlib * 100.0 / (size * 32), t_archive * 1000, n_archive / t_archive))
+    print("%-16s %14i %7.1f%%" % ("archive lzma", size_lzma, size_lzma * 100.0 / (size * 32)))
+    print("lossless %s, replayed %i/%i ticks" % (np.array_equal(decoded, ticks), n_archive, n_binary))
+
+
+BENCHMARKS = {
+    'indicators': bench_indicators,
+    'tick-archive': bench_tick_archive,
+}
+
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS.keys())
+
+    for name in names:
+        if name not in BENCHMARKS:
+            print("Unknown benchmark %s, available are : %s" % (name, ', '.join(BENCHMARKS.keys())))
+            sys.exit(-1)
+
+        BENCHMARKS[name]()
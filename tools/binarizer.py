@@ -4,15 +4,45 @@
 # Binarizer tools
 
 import sys
+import pathlib
 import logging
 import traceback
+import multiprocessing
 
-from common.utils import UTC, TIMEFRAME_FROM_STR_MAP
+from common.utils import UTC, TIMEFRAME_FROM_STR_MAP, matching_symbols_set
 
 from terminal.terminal import Terminal
 from database.database import Database
 
 
+def binarize_month(job):
+    """
+    Convert a month of a market, into a worker process.
+    @param job Tuple (markets_path, broker_id, market_id, from_date, to_date, month, compress)
+    @return A tuple (market_id, month, num ticks, text size, duration, archive size or None, error or None).
+    """
+    from database.tickstorage import TextToBinary
+    from database.tickarchive import BinaryToArchive
+
+    markets_path, broker_id, market_id, from_date, to_date, month, compress = job
+
+    try:
+        converter = TextToBinary(markets_path, broker_id, market_id, from_date, to_date)
+        month, num_ticks, size, duration = converter.convert_month(month)
+
+        archive_size = None
+
+        if compress:
+            month_date = from_date.replace(year=month[0], month=month[1], day=1)
+
+            for result in BinaryToArchive(markets_path, broker_id, market_id, month_date, month_date).process():
+                archive_size = result[3]
+
+        return market_id, month, num_ticks, size, duration, archive_size, None
+    except Exception as e:
+        return market_id, month, 0, 0, 0.0, None, repr(e)
+
+
 def do_binarizer(options, siis_logger):
     from database.tickstorage import TextToBinary
 
@@ -36,10 +66,49 @@ def do_binarizer(options, siis_logger):
         siis_logger.error("Invalid timeframe !")
         sys.exit(-1)
 
-    converter = TextToBinary(options['markets-path'], options['broker'], options['market'], options.get('from'), options.get('to'))
-    converter.process()
+    # markets list, with wildchars from the markets of the broker directory
+    broker_path = pathlib.Path(options['markets-path'], options['broker'])
+    available_markets = [path.name for path in broker_path.iterdir() if path.is_dir()] if broker_path.exists() else []
+
+    markets = sorted(matching_symbols_set(options['market'].split(','), available_markets))
+
+    # one job per month of each market
+    jobs = []
+
+    for market_id in markets:
+        converter = TextToBinary(options['markets-path'], options['broker'], market_id, options.get('from'), options.get('to'))
+
+        for month in converter.months():
+            jobs.append((options['markets-path'], options['broker'], market_id, options.get('from'), options.get('to'),
+                    month, options.get('compress', False)))
+
+    Terminal.inst().info("Binarize %i month(s) of %i market(s)..." % (len(jobs), len(markets)))
+    Terminal.inst().flush()
+
+    num_workers = min(options.get('process-pool-workers') or multiprocessing.cpu_count(), max(1, len(jobs)))
+    total_ticks = 0
+
+    if jobs:
+        context = multiprocessing.get_context('fork')
+
+        with context.Pool(num_workers) as pool:
+            for market_id, month, num_ticks, size, duration, archive_size, error in pool.imap_unordered(binarize_month, jobs):
+                if error:
+                    Terminal.inst().error("%s %04i-%02i failed : %s" % (market_id, month[0], month[1], error))
+                    continue
+
+                total_ticks += num_ticks
+
+                msg = "%s %04i-%02i %i ticks in %.3fs, %.0f ticks/s, %.1f MB/s" % (market_id, month[0], month[1], num_ticks,
+                        duration, num_ticks / duration if duration else 0, size / duration / (1024*1024) if duration else 0)
+
+                if archive_size is not None and num_ticks:
+                    msg += ", compressed %.1f%%" % (archive_size * 100.0 / (num_ticks * 32))
+
+                Terminal.inst().info(msg)
+                Terminal.inst().flush()
 
-    Terminal.inst().info("Binarization done!")
+    Terminal.inst().info("Binarization done, %i ticks!" % total_ticks)
     Terminal.inst().flush()
 
     Terminal.terminate()
@@ -12,6 +12,7 @@ from datetime import datetime
 from common.utils import UTC, TIMEFRAME_FROM_STR_MAP
 
 from watcher.service import WatcherService
+from watcher.fetchscheduler import FetchScheduler
 
 from terminal.terminal import Terminal
 from database.database import Database
@@ -66,20 +67,29 @@ def do_fetcher(options, siis_logger):
         siis_logger.info("Fetcher authentified to %s, trying to collect data..." % fetcher.name)
 
         markets = fetcher.matching_symbols_set(options['market'].split(','), fetcher.available_instruments())
+        valid_markets = []
+
+        for market_id in sorted(markets):
+            if not fetcher.has_instrument(market_id, options.get('spec')):
+                siis_logger.error("Market %s not found !" % (market_id,))
+            else:
+                valid_markets.append(market_id)
+
+        # concurrent fetches of the markets, resumed from their checkpoints
+        scheduler = FetchScheduler(fetcher, options['markets-path'], timeframe,
+                options.get('from'), options.get('to'), options.get('last'), options.get('spec'), cascaded)
 
         try:
-            for market_id in markets:
-                if not fetcher.has_instrument(market_id, options.get('spec')):
-                    siis_logger.error("Market %s not found !" % (market_id,))
-                else:
-                    fetcher.fetch_and_generate(market_id, timeframe,
-                        options.get('from'), options.get('to'), options.get('last'),
-                        options.get('spec'), cascaded)
-        except KeyboardInterrupt:
-            pass
+            scheduler.run(valid_markets)
         finally:
             fetcher.disconnect()
 
+        for market_id, result in scheduler.results.items():
+            if isinstance(result, str):
+                Terminal.inst().error("%s failed : %s" % (market_id, result))
+            else:
+                Terminal.inst().info("%s fetched in %.3fs" % (market_id, result))
+
     fetcher = None
 
     Terminal.inst().info("Flushing database...")
@@ -7,12 +7,18 @@ import sys
 import logging
 import traceback
 
+from datetime import datetime
+
 from common.utils import UTC, TIMEFRAME_FROM_STR_MAP
 
 from terminal.terminal import Terminal
 from database.database import Database
 
 
+def fmt_date(timestamp):
+    return datetime.fromtimestamp(timestamp, tz=UTC()).strftime('%Y-%m-%dT%H:%M:%S')
+
+
 def do_optimizer(options, siis_logger):
     Terminal.inst().info("Starting SIIS optimizer...")
     Terminal.inst().flush()
@@ -41,12 +47,71 @@ def do_optimizer(options, siis_logger):
 
     if timeframe == 0:
         # tick
-        pass
-        # @todo 
+        from database.optimizer import TickOptimizer
+
+        optimizer = TickOptimizer(options['markets-path'], broker_id, market_id, options.get('from'), options.get('to'))
+
+        for month, num_ticks, removed, rewritten, duration in optimizer.optimize():
+            if rewritten:
+                Terminal.inst().info("%04i-%02i %i ticks, sorted and %i duplicates removed in %.3fs" % (
+                    month[0], month[1], num_ticks, removed, duration))
+            else:
+                Terminal.inst().info("%04i-%02i %i ticks, already ordered (%.3fs)" % (month[0], month[1], num_ticks, duration))
+
+        # gap report
+        gaps = optimizer.detect_gaps(options.get('gap', TickOptimizer.DEFAULT_MIN_GAP))
+        closed = 0
+
+        for gap in gaps:
+            if gap[2] == TickOptimizer.GAP:
+                Terminal.inst().warning("Gap from %s to %s (%i seconds)" % (fmt_date(gap[0]), fmt_date(gap[1]), gap[1] - gap[0]))
+            else:
+                closed += 1
+
+        Terminal.inst().info("%i gap(s) and %i market closed period(s) (week-ends or daily sessions)" % (len(gaps) - closed, closed))
     else:
         # ohlc
-        pass
-        # @todo
+        from database.optimizer import OhlcOptimizer, TickOptimizer
+
+        optimizer = OhlcOptimizer(Database.inst(), broker_id, market_id, timeframe, options.get('from'), options.get('to'),
+                options['markets-path'])
+
+        gaps = optimizer.detect_gaps()
+        closed = len([gap for gap in gaps if gap[2] != TickOptimizer.GAP])
+
+        Terminal.inst().info("%i gap(s) and %i market closed period(s) (week-ends or daily sessions)" % (len(gaps) - closed, closed))
+
+        repaired, refetch = optimizer.optimize(gaps)
+
+        for first, last, count in repaired:
+            Terminal.inst().info("Rebuilt %i ohlc(s) from %s to %s from ticks" % (count, fmt_date(first), fmt_date(last)))
+
+        if refetch and options.get('refetch'):
+            from watcher.service import WatcherService
+
+            watcher_service = WatcherService(options)
+            fetcher = watcher_service.create_fetcher(broker_id)
+
+            try:
+                fetcher.connect()
+
+                if fetcher.connected and fetcher.has_instrument(market_id, options.get('spec')):
+                    for first, last in refetch:
+                        Terminal.inst().info("Fetching from %s to %s..." % (fmt_date(first), fmt_date(last)))
+
+                        fetcher.fetch_and_generate(market_id, timeframe,
+                                datetime.fromtimestamp(first, tz=UTC()), datetime.fromtimestamp(last, tz=UTC()), None,
+                                options.get('spec'), None)
+
+                    refetch = []
+            except Exception as e:
+                siis_logger.error(repr(e))
+            finally:
+                if fetcher.connected:
+                    fetcher.disconnect()
+
+        for first, last in refetch:
+            Terminal.inst().warning("No tick to rebuild from %s to %s, re-fetch it (--refetch)" % (fmt_date(first), fmt_date(last)))
 
     Terminal.inst().info("Flushing database...")
     Terminal.inst().flush() 
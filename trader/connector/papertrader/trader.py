@@ -20,6 +20,7 @@ from .account import PaperTraderAccount
 from trader.position import Position
 from trader.order import Order
 from trader.asset import Asset
+from instrument.orderbook import OrderBook
 from terminal.terminal import Terminal
 
 from config import config
@@ -559,7 +560,17 @@ class PaperTrader(Trader):
 
                 if order.order_type == Order.ORDER_MARKET:
                     # market
-                    # does not support the really offered qty, take all at current price in one shot
+                    # the quantity is taken from the levels of the order book if watched, else all at current price
+                    bids, asks = market.order_book
+
+                    if bids and asks:
+                        if order.direction == Position.LONG:
+                            open_exec_price = OrderBook.exec_price(asks, order.quantity)
+                            close_exec_price = OrderBook.exec_price(bids, order.quantity)
+                        else:
+                            open_exec_price = OrderBook.exec_price(bids, order.quantity)
+                            close_exec_price = OrderBook.exec_price(asks, order.quantity)
+
                     if market.trade == market.TRADE_BUY_SELL:
                         self.__exec_buysell_order(order, market, open_exec_price, close_exec_price)
                     elif market.trade == market.TRADE_MARGIN:
@@ -78,7 +78,8 @@ class Market(object):
     __slots__ = '_market_id', '_symbol', '_trade', '_orders', '_base', '_base_display', '_base_precision', '_quote', '_quote_display', '_quote_precision', \
                 '_expiry', '_is_open', '_contract_size', '_lot_size', '_base_exchange_rate', '_value_per_pip', '_one_pip_means', '_margin_factor', \
                 '_size_limits', '_price_limits', '_notional_limits', '_market_type', '_unit_type', '_contract_type', '_vol24h_base', '_vol24h_quote', \
-                '_hedging', '_fees', '_previous', '_leverages', '_last_update_time', '_bid', '_ofr'
+                '_hedging', '_fees', '_previous', '_leverages', '_last_update_time', '_bid', '_ofr', \
+                '_order_book'
 
     def __init__(self, market_id, symbol):
         self._market_id = market_id
@@ -116,6 +117,8 @@ class Market(object):
         self._vol24h_base = None
         self._vol24h_quote = None
 
+        self._order_book = ([], [])  # last depth (bids, asks) of (price, size), best first
+
         self._hedging = False
 
         self._fees = ([0.0, 0.0], [0.0, 0.0])  # maker 0, taker 1 => fee 0, commission 1
@@ -441,6 +444,17 @@ class Market(object):
     def vol24h_quote(self, vol):
         self._vol24h_quote = vol
 
+    def set_order_book(self, bids, asks):
+        self._order_book = (bids, asks)
+
+    @property
+    def order_book(self):
+        """
+        Last received depth of the order book, a tuple (bids, asks) of list of (price, size) best first,
+        empty if not watched.
+        """
+        return self._order_book
+
     #
     # helpers
     #
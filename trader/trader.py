@@ -249,6 +249,9 @@ class Trader(Runnable):
                 elif signal.signal_type == Signal.SIGNAL_MARKET_DATA:
                     # update instrument data during live mode
                     self.on_update_market(*signal.data)
+                elif signal.signal_type == Signal.SIGNAL_ORDER_BOOK:
+                    # update the depth of the market during live mode
+                    self.on_order_book(*signal.data)
                 elif signal.signal_type == Signal.SIGNAL_ACCOUNT_DATA:
                     self.on_account_updated(*signal.data)
 
@@ -682,7 +685,7 @@ class Trader(Runnable):
                 # only interested by the watcher of the same name
                 return
 
-            if signal.signal_type == Signal.SIGNAL_MARKET_DATA:
+            if signal.signal_type in (Signal.SIGNAL_MARKET_DATA, Signal.SIGNAL_ORDER_BOOK):
                 if not self.has_market(signal.data[0]):
                     # non interested by this instrument/symbol
                     return
@@ -998,6 +1001,15 @@ class Trader(Runnable):
         # push last price to keep a local cache of history
         market.push_price()
 
+    @Runnable.mutexed
+    def on_order_book(self, market_id, bids, asks):
+        """
+        Update the depth of the order book of a market.
+        """
+        market = self._markets.get(market_id)
+        if market is not None:
+            market.set_order_book(bids, asks)
+
     #
     # utils
     #
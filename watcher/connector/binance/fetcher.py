@@ -9,6 +9,8 @@ import traceback
 
 from watcher.fetcher import Fetcher
 
+from common.ratelimiter import TokenBucket
+
 from connector.binance.connector import Connector
 
 from config import config
@@ -41,11 +43,21 @@ class BinanceFetcher(Fetcher):
         2592000: '1M'
     }
 
+    # markets fetched concurrently, within the request weight limit
+    MAX_CONCURRENT_FETCH = 4
+
+    # request weight limit per minute of the API, and the share used by the fetcher (the rest for a watcher or trader)
+    WEIGHT_LIMIT = 1200
+    WEIGHT_SHARE = 0.8
+
     def __init__(self, service):
         super().__init__("binance.com", service)
 
         self._connector = None
 
+        weight = BinanceFetcher.WEIGHT_LIMIT * BinanceFetcher.WEIGHT_SHARE
+        self._rate_limiter = TokenBucket(weight / 60.0, weight)
+
     def connect(self):
         super().connect()
 
@@ -63,6 +75,9 @@ class BinanceFetcher(Fetcher):
                 if not self._connector.connected:
                     self._connector.connect(use_ws=False)
 
+                # shared by the concurrent fetches
+                self._connector.client.rate_limiter = self._rate_limiter
+
                 #
                 # instruments
                 #
@@ -124,20 +139,18 @@ class BinanceFetcher(Fetcher):
             logger.error("Fetcher %s does not support timeframe %s" % (self.name, timeframe))
             return
 
-        candles = []
-
         tf = self.TF_MAP[timeframe]
+        count = 0
 
         try:
-            candles = self._connector.client.get_historical_klines(market_id, tf, int(from_date.timestamp() * 1000), int(to_date.timestamp() * 1000))
+            # streamed per page in place of the whole history in memory
+            candles = self._connector.client.get_historical_klines_generator(market_id, tf, int(from_date.timestamp() * 1000), int(to_date.timestamp() * 1000))
+
+            for candle in candles:
+                count += 1
+                # (timestamp, open bid, high bid, low bid, close bid, open ofr, high ofr, low ofr, close ofr, volume)
+                yield((candle[0], candle[1], candle[2], candle[3], candle[4], candle[1], candle[2], candle[3], candle[4], candle[5]))
         except:
             logger.error("Fetcher %s cannot retrieve candles %s on market %s" % (self.name, tf, market_id))
 
-        count = 0
-        
-        for candle in candles:
-            count += 1
-            # (timestamp, open bid, high bid, low bid, close bid, open ofr, high ofr, low ofr, close ofr, volume)
-            yield((candle[0], candle[1], candle[2], candle[3], candle[4], candle[1], candle[2], candle[3], candle[4], candle[5]))
-
         logger.info("Fetcher %s has retrieved on market %s %s candles for timeframe %s" % (self.name, market_id, count, tf))
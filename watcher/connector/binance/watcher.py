@@ -21,6 +21,7 @@ from trader.order import Order
 from trader.market import Market
 
 from instrument.instrument import Instrument, Candle, Tick
+from instrument.orderbook import OrderBook
 
 from config import config
 
@@ -66,11 +67,12 @@ class BinanceWatcher(Watcher):
         '1M': 2592000
     }
 
+    ORDER_BOOK_LIMIT = 100  # levels of the REST snapshot, and kept per side
+
     def __init__(self, service):
         super().__init__("binance.com", service, Watcher.WATCHER_PRICE_AND_VOLUME)
 
         self._connector = None
-        self._depths = {}  # depth chart per symbol tuple (last_id, bids, ofrs)
 
         self._acount_data = {}
         self._symbols_data = {}
@@ -125,7 +127,8 @@ class BinanceWatcher(Watcher):
                             symbol = instrument['symbol'].lower()
 
                             # depth - order book
-                            # multiplex.append(symbol + '@depth')
+                            if self._order_book_depth:
+                                multiplex.append(symbol + '@depth')
 
                             # aggreged trade
                             multiplex.append(symbol + '@aggTrade')
@@ -409,54 +412,32 @@ class BinanceWatcher(Watcher):
                 self.service.notify(Signal.SIGNAL_MARKET_DATA, self.name, market_data)
 
     def __on_depth_data(self, data):
-        # @todo using binance.DepthCache
-        return
-
         if data['e'] == 'depthUpdate':
             symbol = data['s']
 
-            if symbol not in self._depths:
-                # initial snapshot of the order book from REST API
-                initial = self._connector.client.get_order_book(symbol=symbol, limit=100)
-
-                bids = {}
-                asks = {}
-
-                for bid in initial['bids']:
-                    bids[bid[0]] = bid[1]
+            order_book = self._order_books.get(symbol)
+            if order_book is None:
+                order_book = self._order_books[symbol] = OrderBook(symbol, BinanceWatcher.ORDER_BOOK_LIMIT)
 
-                for ask in initial['asks']:
-                    asks[ask[0]] = ask[1]
-
-                self._depths[symbol] = [initial.get('lastUpdateId', 0), bids, asks]
-
-            depth = self._depths[symbol]
-
-            # The first processed should have U <= lastUpdateId+1 AND u >= lastUpdateId+1
-            if data['u'] <= depth[0] or data['U'] >= depth[0]:
-                # drop event if older than the last snapshot
-                return
+            if not order_book.synced:
+                # initial snapshot of the order book from REST API
+                self.__snapshot_order_book(order_book)
 
-            if data['U'] != depth[0] + 1:
+            # the first processed should have U <= lastUpdateId+1 AND u >= lastUpdateId+1, and then U = previous u+1
+            if not order_book.update(data['b'], data['a'], data['U'], data['u']):
                 logger.warning("Watcher %s, there is a gap into depth data for symbol %s" % (self._name, symbol))
 
-            for bid in data['b']:
-                # if data['U'] <= depth[0]+1 and data['u'] >= depth[0]+1:
-                if bid[1] == 0:
-                    del depth[1][bid[0]]  # remove at price
-                else:
-                    depth[2][bid[0]] = bid[1]  # price : volume
+                # resnapshot, and apply if the event is contiguous with
+                self.__snapshot_order_book(order_book)
 
-            for ask in data['a']:
-                if ask[1] == 0:
-                    del depth[2][ask[0]]
-                else:
-                    depth[2][ask[0]] = ask[1]
+                if not order_book.update(data['b'], data['a'], data['U'], data['u']):
+                    return
 
-            # last processed id, next must be +1
-            depth[0] = data['u']
+            self.notify_order_book(symbol)
 
-            # self.service.notify(Signal.SIGNAL_ORDER_BOOK, self.name, (symbol, depth[1], depth[2]))
+    def __snapshot_order_book(self, order_book):
+        initial = self._connector.client.get_order_book(symbol=order_book.market_id, limit=BinanceWatcher.ORDER_BOOK_LIMIT)
+        order_book.snapshot(initial['bids'], initial['asks'], initial.get('lastUpdateId', 0))
 
     def __on_multiplex_data(self, data):
         """
@@ -493,24 +474,8 @@ class BinanceWatcher(Watcher):
 
             tick = (trade_time, bid, ofr, vol)
 
-            # store for generation of OHLCs
-            self.lock()
-            self._last_tick[symbol] = tick
-            self.unlock()
-
-            self.service.notify(Signal.SIGNAL_TICK_DATA, self.name, (symbol, tick))
-
-            if not self._read_only:
-                Database.inst().store_market_trade((self.name, symbol, int(data['T']), data['p'], data['p'], data['q']))
-
-            for tf in Watcher.STORED_TIMEFRAMES:
-                # generate candle per timeframe
-                self.lock()
-                candle = self.update_ohlc(symbol, tf, trade_time, bid, ofr, vol)
-                self.unlock()
-
-                if candle is not None:
-                    self.service.notify(Signal.SIGNAL_CANDLE_DATA, self.name, (symbol, candle))
+            # batched notify, storage and generation of OHLCs
+            self.push_tick(symbol, tick, (self.name, symbol, int(data['T']), data['p'], data['p'], data['q']))
 
     def __on_kline_data(self, data):
         event_type = data.get('e', '')
@@ -66,7 +66,8 @@ class BitMexWatcher(Watcher):
                         identity.get('api-secret'),
                         self.configured_symbols(),  # want WS subscribes to thats instruments or all if ['*']
                         identity.get('host'),
-                        (self, BitMexWatcher._ws_message))
+                        (self, BitMexWatcher._ws_message),
+                        bool(self._order_book_depth))
 
                 # get list of all availables instruments, and list of subscribed
                 self._available_instruments = set(self._connector.all_instruments)
@@ -498,37 +499,22 @@ class BitMexWatcher(Watcher):
                         # we have a tick when we have a volume in data content
                         tick = (update_time, bid, ofr, volume)
 
-                        self.lock()
-                        self._last_tick[market_id] = tick
-                        self.unlock()
-
-                        # and notify
-                        self.service.notify(Signal.SIGNAL_TICK_DATA, self.name, (market_id, tick))
-
-                        if not self._read_only:
-                            # store trade/tick
-                            Database.inst().store_market_trade((self.name, symbol, int(update_time*1000), bid, ofr, volume))
+                        # batched notify and store trade/tick, the OHLCs are updated from the last values
+                        self.push_tick(market_id, tick, (self.name, symbol, int(update_time*1000), bid, ofr, volume), False)
 
                     # @todo could check that, because might be done only when Tick
-                    for tf in Watcher.STORED_TIMEFRAMES:
-                        # generate candle per each timeframe
-                        self.lock()
-
-                        candle = self.update_ohlc(market_id, tf, update_time, last_bid, last_ofr, last_vol)
-                        if candle is not None:
-                            self.service.notify(Signal.SIGNAL_CANDLE_DATA, self.name, (market_id, candle))
-
-                        self.unlock()
+                    self.push_ohlc_update(market_id, update_time, last_bid, last_ofr, last_vol)
 
             #
             # order book L2 top 25
             #
             
             elif data[1] == 'orderBookL2_25' and data[2]:
-                pass
-                # for market_id in data[2]:
-                #   market_depth = self.connector.ws.market_depth(market_id)
-                #   self.service.notify(Signal.SIGNAL_ORDER_BOOK, self.name, (market_id, market_depth[0], market_depth[1]))
+                for market_id in data[2]:
+                    order_book = self.connector.ws.market_depth(market_id)
+                    if order_book is not None:
+                        self._order_books[market_id] = order_book
+                        self.notify_order_book(market_id)
 
     def fetch_market(self, market_id):
         """
@@ -443,23 +443,8 @@ class IGWatcher(Watcher):
 
                 tick = (float(utm) * 0.001, float(bid), float(ofr), float(ltv or "0"))
 
-                # keep last complete tick values for ohlc generation
-                self._last_tick[market_id] = tick
-
-                self.service.notify(Signal.SIGNAL_TICK_DATA, self.name, (market_id, tick))
-
-                for tf in Watcher.STORED_TIMEFRAMES:
-                    # generate candle per each tf
-                    self.lock()
-                    candle = self.update_ohlc(market_id, tf, tick[0], tick[1], tick[2], tick[3])
-                    self.unlock()
-
-                    if candle is not None:
-                        self.service.notify(Signal.SIGNAL_CANDLE_DATA, self.name, (market_id, candle))
-
-                # disabled for now
-                if not self._read_only:
-                    Database.inst().store_market_trade((self.name, market_id, int(utm), bid, ofr, ltv or 0))
+                # batched notify, storage and generation of OHLCs
+                self.push_tick(market_id, tick, (self.name, market_id, int(utm), bid, ofr, ltv or 0))
 
         except Exception as e:
             logger.debug(repr(e))
@@ -21,6 +21,7 @@ from trader.order import Order
 from trader.market import Market
 
 from instrument.instrument import Instrument, Candle, Tick
+from instrument.orderbook import OrderBook
 
 from config import config
 
@@ -40,11 +41,12 @@ class KrakenWatcher(Watcher):
     @todo complete
     """
 
+    BOOK_DEPTHS = (10, 25, 100, 500, 1000)
+
     def __init__(self, service):
         super().__init__("kraken.com", service, Watcher.WATCHER_PRICE_AND_VOLUME)
 
         self._connector = None
-        self._depths = {}  # depth chart per symbol tuple (last_id, bids, ofrs)
 
         self._acount_data = {}
         self._symbols_data = {}
@@ -130,15 +132,15 @@ class KrakenWatcher(Watcher):
                         callback=self.__on_trade_data
                     )
 
-                    # @todo see later
-                    # self._connector.ws.subscribe_public(
-                    #     subscription={
-                    #         'name': 'book'
-                    #     },
-                    #     pair=pairs,
-                    #     depth=10,  # 10 25 100 500 1000
-                    #     callback=self.__on_depth_data
-                    # )
+                    if self._order_book_depth:
+                        self._connector.ws.subscribe_public(
+                            subscription={
+                                'name': 'book',
+                                'depth': self.__book_depth()
+                            },
+                            pair=pairs,
+                            callback=self.__on_depth_data
+                        )
 
                 # and start ws manager
                 self._connector.ws.start()
@@ -364,9 +366,45 @@ class KrakenWatcher(Watcher):
         self._assets = self._connector.assets()
         self._instruments = self._connector.instruments()
 
+    def __book_depth(self):
+        """
+        Smallest subscribable book depth containing the configured order book depth.
+        """
+        for depth in KrakenWatcher.BOOK_DEPTHS:
+            if depth >= self._order_book_depth:
+                return depth
+
+        return KrakenWatcher.BOOK_DEPTHS[-1]
+
     def __on_depth_data(self, data):
         # @ref https://www.kraken.com/en-us/features/websocket-api#message-book
-        pass
+        if isinstance(data, list) and data[-2].startswith("book"):
+            market_id = self._wsname_lookup.get(data[-1])
+
+            if not market_id:
+                return
+
+            order_book = self._order_books.get(market_id)
+            if order_book is None:
+                # the levels out of the subscribed depth are not updated, so the book must be truncated at it
+                order_book = self._order_books[market_id] = OrderBook(market_id, self.__book_depth())
+
+            # a snapshot, or one or two (asks and bids) updates, levels are [price, volume, timestamp(, 'r')]
+            for book in data[1:-2]:
+                if 'as' in book or 'bs' in book:
+                    order_book.snapshot([level[:2] for level in book.get('bs', [])], [level[:2] for level in book.get('as', [])])
+                else:
+                    order_book.update([level[:2] for level in book.get('b', [])], [level[:2] for level in book.get('a', [])])
+
+            self.notify_order_book(market_id)
+
+        elif isinstance(data, dict):
+            if data['event'] == "subscriptionStatus" and data['channelName'].startswith("book"):
+                if data['status'] == "subscribed":
+                    # a new snapshot is going to be received
+                    market_id = self._wsname_lookup.get(data.get('pair'))
+                    if market_id in self._order_books:
+                        self._order_books[market_id].reset()
 
     def __on_ticker_data(self, data):
         if isinstance(data, list) and data[2] == "ticker":
@@ -419,24 +457,8 @@ class KrakenWatcher(Watcher):
 
                 tick = (trade_time, bid, ofr, vol)
 
-                # store for generation of OHLCs
-                self.lock()
-                self._last_tick[market_id] = tick
-                self.unlock()
-
-                self.service.notify(Signal.SIGNAL_TICK_DATA, self.name, (market_id, tick))
-
-                if not self._read_only:
-                    Database.inst().store_market_trade((self.name, market_id, int(trade_time*1000.0), trade[0], trade[0], trade[1]))
-
-                for tf in Watcher.STORED_TIMEFRAMES:
-                    # generate candle per timeframe
-                    self.lock()
-                    candle = self.update_ohlc(market_id, tf, trade_time, bid, ofr, vol)
-                    self.unlock()
-
-                    if candle is not None:
-                        self.service.notify(Signal.SIGNAL_CANDLE_DATA, self.name, (market_id, candle))
+                # batched notify, storage and generation of OHLCs
+                self.push_tick(market_id, tick, (self.name, market_id, int(trade_time*1000.0), trade[0], trade[0], trade[1]))
 
         elif isinstance(data, dict):
             if data['event'] == "subscriptionStatus" and data['channelName'] == "trade":
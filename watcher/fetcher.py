@@ -5,13 +5,15 @@
 
 import time
 
+import numpy as np
+
 from datetime import datetime, timedelta
 
 from common.utils import matching_symbols_set, UTC
 from terminal.terminal import Terminal
 
-from instrument.instrument import Tick, Candle
-from instrument.candlegenerator import CandleGenerator
+from instrument.instrument import Tick, TickBatch
+from instrument.candlegenerator import CandleGenerator, CascadedCandleGenerator
 
 from notifier.signal import Signal
 from config import config
@@ -31,8 +33,15 @@ class Fetcher(object):
     # candles from 1m to 1 week
     GENERATED_TF = [60, 60*5, 60*15, 60*60, 60*60*4, 60*60*24, 60*60*24*7]
 
-    TICK_STORAGE_DELAY = 0.05  # 50ms
-    MAX_PENDING_TICK = 10000
+    MAX_PENDING_TICK = 10000   # backpressure, max pending ticks into the database
+    MAX_PENDING_OHLC = 10000   # backpressure, max pending ohlcs into the database
+
+    GENERATE_CHUNK_SIZE = 1000  # number of fetched trades or candles per generation of higher candles
+
+    CHECKPOINT_DELAY = 60.0     # minimal delay in seconds between two checkpoints of a fetch
+    SYNC_TIMEOUT = 60.0         # max delay to wait for the database before a checkpoint
+
+    MAX_CONCURRENT_FETCH = 1    # markets fetched concurrently, more only if the connector is thread-safe and rate limited
 
     def __init__(self, name, service):
         super().__init__()
@@ -41,9 +50,7 @@ class Fetcher(object):
         self._service = service
 
         self._available_instruments = set()
-
-        self._last_ticks = []
-        self._last_ohlcs = {}
+        self._rate_limiter = None
 
     @property
     def service(self):
@@ -52,7 +59,14 @@ class Fetcher(object):
     @property
     def name(self):
         return self._name
-    
+
+    @property
+    def rate_limiter(self):
+        """
+        Optional TokenBucket shared by the concurrent fetches.
+        """
+        return self._rate_limiter
+
     def has_instrument(self, instrument, fetch_option=""):
         return instrument in self._available_instruments
 
@@ -79,16 +93,24 @@ class Fetcher(object):
     def connected(self):
         return False
 
-    def fetch_and_generate(self, market_id, timeframe, from_date=None, to_date=None, n_last=1000, fetch_option="", cascaded=None):
+    def fetch_and_generate(self, market_id, timeframe, from_date=None, to_date=None, n_last=1000, fetch_option="", cascaded=None,
+            checkpoint=None):
+        """
+        Fetch the trades or candles of a market and generate the cascaded candles.
+        Can be called concurrently for different markets (up to MAX_CONCURRENT_FETCH).
+
+        @param checkpoint Optional callable(timestamp in ms, done) called each CHECKPOINT_DELAY once the database
+            has written the data stored until this timestamp, and at the end of the fetch.
+        """
         if timeframe > 0 and timeframe not in self.GENERATED_TF:
             logger.error("Timeframe %i is not allowed !" % (timeframe,))
             return
 
-        generators = []
-        from_tf = timeframe
+        generator = None     # ticks to the first cascaded timeframe
+        cascaded_gen = None  # candles to any others cascaded timeframes
 
-        self._last_ticks = []
-        self._last_ohlcs = {}
+        last_ticks = []
+        last_ohlcs = []
 
         if not from_date and n_last:
             # compute a from date
@@ -101,69 +123,51 @@ class Fetcher(object):
 
         # cascaded generation of candles
         if cascaded:
-            for tf in Fetcher.GENERATED_TF:
-                if tf > timeframe:
-                    # from timeframe greater than initial
-                    if tf <= cascaded:
-                        # until max cascaded timeframe
-                        generators.append(CandleGenerator(from_tf, tf))
-                        from_tf = tf
-
-                        # store for generation
-                        self._last_ohlcs[tf] = []
-                else:
-                    from_tf = tf
+            to_tfs = [tf for tf in Fetcher.GENERATED_TF if timeframe < tf <= cascaded]
 
-        if timeframe > 0:
-            self._last_ohlcs[timeframe] = []
+            if to_tfs:
+                if timeframe == 0:
+                    # first level from ticks, next levels from its candles
+                    generator = CandleGenerator(0, to_tfs[0])
+
+                    if len(to_tfs) > 1:
+                        cascaded_gen = CascadedCandleGenerator(to_tfs[0], to_tfs[1:])
+                else:
+                    cascaded_gen = CascadedCandleGenerator(timeframe, to_tfs)
 
         n = 0
         t = 0
+        last_ts = 0
+        last_checkpoint = time.time()
 
         if timeframe == 0:
             for data in self.fetch_trades(market_id, from_date, to_date, None):
                 # store (int timestamp in ms, str bid, str ofr, str volume)
                 Database.inst().store_market_trade((self.name, market_id, data[0], data[1], data[2], data[3]))
 
-                if generators:
-                    self._last_ticks.append((float(data[0]) * 0.001, float(data[1]), float(data[2]), float(data[3])))
-
-                # generate higher candles
-                for generator in generators:
-                    if generator.from_tf == 0:
-                        candles = generator.generate_from_ticks(self._last_ticks)
-
-                        if candles:
-                            for c in candles:
-                                self.store_candle(market_id, generator.to_tf, c)
-
-                            self._last_ohlcs[generator.to_tf] += candles
-
-                        # remove consumed ticks
-                        self._last_ticks = []
-                    else:
-                        candles = generator.generate_from_candles(self._last_ohlcs[generator.from_tf])
-
-                        if candles:
-                            for c in candles:
-                                self.store_candle(market_id, generator.to_tf, c)
-
-                            self._last_ohlcs[generator.to_tf] += candles
-
-                        # remove consumed candles
-                        self._last_ohlcs[generator.from_tf] = []
+                if generator:
+                    last_ticks.append((float(data[0]) * 0.001, float(data[1]), float(data[2]), float(data[3])))
 
                 n += 1
                 t += 1
+                last_ts = data[0]
 
-                if n == 1000:
+                if n == Fetcher.GENERATE_CHUNK_SIZE:
                     n = 0
-                    Terminal.inst().info("%i..." % t)
+                    Terminal.inst().info("%s %i..." % (market_id, t))
                     Terminal.inst().flush()
 
+                    # generate higher candles for the chunk
+                    self.generate_from_ticks(market_id, generator, cascaded_gen, last_ticks)
+                    last_ticks = []
+
                     # calm down the storage of tick, if parsing is faster
-                    while Database.inst().num_pending_ticks_storage() > Fetcher.TICK_STORAGE_DELAY:
-                        time.sleep(Fetcher.TICK_STORAGE_DELAY)  # wait a little before continue
+                    Database.inst().wait_pending(Fetcher.MAX_PENDING_TICK, Fetcher.MAX_PENDING_OHLC)
+
+                    last_checkpoint = self.checkpoint(checkpoint, last_ts, last_checkpoint)
+
+            # remaining chunk
+            self.generate_from_ticks(market_id, generator, cascaded_gen, last_ticks)
 
             logger.info("Fetched %i trades" % t)
 
@@ -176,37 +180,79 @@ class Fetcher(object):
                     data[5], data[6], data[7], data[8],
                     data[9]))
 
-                if generators:
-                    candle = Candle(float(data[0]) * 0.001, timeframe)
+                if cascaded_gen:
+                    last_ohlcs.append(data)
 
-                    candle.set_bid_ohlc(float(data[1]), float(data[2]), float(data[3]), float(data[4]))
-                    candle.set_ofr_ohlc(float(data[5]), float(data[6]), float(data[7]), float(data[8]))
+                n += 1
+                t += 1
+                last_ts = data[0]
 
-                    candle.set_volume(float(data[9]))
-                    candle.set_consolidated(True)
+                if n == Fetcher.GENERATE_CHUNK_SIZE:
+                    n = 0
+                    Terminal.inst().info("%s %i..." % (market_id, t))
 
-                    self._last_ohlcs[timeframe].append(candle)
+                    # generate higher candles for the chunk
+                    self.generate_from_ohlcs(market_id, timeframe, cascaded_gen, last_ohlcs)
+                    last_ohlcs = []
 
-                # generate higher candles
-                for generator in generators:
-                    candles = generator.generate_from_candles(self._last_ohlcs[generator.from_tf])
-                    if candles:
-                        for c in candles:
-                            self.store_candle(market_id, generator.to_tf, c)
+                    Database.inst().wait_pending(Fetcher.MAX_PENDING_TICK, Fetcher.MAX_PENDING_OHLC)
 
-                        self._last_ohlcs[generator.to_tf].extend(candles)
+                    last_checkpoint = self.checkpoint(checkpoint, last_ts, last_checkpoint)
 
-                    # remove consumed candles
-                    self._last_ohlcs[generator.from_tf] = []
+            # remaining chunk
+            self.generate_from_ohlcs(market_id, timeframe, cascaded_gen, last_ohlcs)
 
-                n += 1
-                t += 1
+        logger.info("Fetched %i candles" % t)
 
-                if n == 1000:
-                    n = 0
-                    Terminal.inst().info("%i..." % t)
+        if checkpoint and Database.inst().sync(Fetcher.SYNC_TIMEOUT):
+            checkpoint(int(to_date.timestamp() * 1000), True)
 
-        logger.info("Fetched %i candles" % t)
+    def checkpoint(self, checkpoint, timestamp, last_checkpoint):
+        """
+        Call the checkpoint with the timestamp once the database has written the data, if the last one is older
+        than CHECKPOINT_DELAY.
+        @return Time of the last checkpoint.
+        """
+        now = time.time()
+
+        if not checkpoint or now - last_checkpoint < Fetcher.CHECKPOINT_DELAY:
+            return last_checkpoint
+
+        if Database.inst().sync(Fetcher.SYNC_TIMEOUT):
+            checkpoint(int(timestamp), False)
+            return now
+
+        return last_checkpoint
+
+    def generate_from_ticks(self, market_id, generator, cascaded_gen, ticks):
+        """
+        Generate and store the higher candles from the pending fetched ticks.
+        """
+        if not generator or not ticks:
+            return
+
+        candles = generator.generate_from_ticks(TickBatch.from_ticks(ticks))
+
+        if candles:
+            self.store_candles(market_id, generator.to_tf, candles)
+
+            if cascaded_gen:
+                for tf, generated in cascaded_gen.generate_from_candles(candles).items():
+                    self.store_candles(market_id, tf, generated)
+
+    def generate_from_ohlcs(self, market_id, timeframe, cascaded_gen, rows):
+        """
+        Generate and store the higher candles from the pending fetched candles rows.
+        """
+        if not cascaded_gen or not rows:
+            return
+
+        # timestamp in second and prices as float
+        ohlc = np.array(rows, dtype=np.float64)
+        ohlc[:, 0] *= 0.001
+
+        for tf, generated in cascaded_gen.generate_from_ohlc(ohlc).items():
+            self.store_candles(market_id, tf, generated)
 
     def fetch_trades(self, market_id, from_date=None, to_date=None, n_last=None):
         """
@@ -228,6 +274,10 @@ class Fetcher(object):
         """
         pass
 
+    def store_candles(self, market_id, timeframe, candles):
+        for candle in candles:
+            self.store_candle(market_id, timeframe, candle)
+
     def store_candle(self, market_id, timeframe, candle):
         Database.inst().store_market_ohlc((
             self.name, market_id, int(candle.timestamp*1000.0), int(timeframe),
@@ -0,0 +1,204 @@
+# @date 2019-03-23
+# @author Frederic SCHERMA
+# @license Copyright (c) 2019 Dream Overflow
+# Multi-market fetch scheduler with checkpoints
+
+import os
+import json
+import time
+import queue
+import pathlib
+import threading
+import traceback
+
+from datetime import datetime
+
+from common.utils import UTC
+from instrument.instrument import Instrument
+
+import logging
+logger = logging.getLogger('siis.fetcher.scheduler')
+error_logger = logging.getLogger('siis.error.fetcher.scheduler')
+
+
+class FetchScheduler(object):
+    """
+    Fetch a list of markets with concurrent worker threads (up to the MAX_CONCURRENT_FETCH of the fetcher), the
+    requests being paced by the rate limiter of the fetcher, and the storage by the backpressure of the database.
+
+    The progress of each market is checkpointed into <markets-path>/<broker-id>/<market-id>/fetch.json, per
+    timeframe : the beginning of the fetched range, the last timestamp written into the database, and if the
+    fetch is complete. An interrupted fetch of the same range then resumes from its last checkpoint (aligned
+    to the largest cascaded timeframe, in way to regenerate complete candles), and a complete one is skipped.
+
+    @note Resumed ticks can duplicate the ticks of the last checkpointed ms, they are removed by the tick optimizer.
+    """
+
+    CHECKPOINT_FILE = "fetch.json"
+
+    def __init__(self, fetcher, markets_path, timeframe, from_date=None, to_date=None, n_last=None, fetch_option=None,
+            cascaded=None, num_workers=None):
+        self._fetcher = fetcher
+        self._markets_path = markets_path
+
+        self._timeframe = timeframe
+        self._from_date = from_date
+        self._to_date = to_date
+        self._n_last = n_last
+        self._fetch_option = fetch_option
+        self._cascaded = cascaded
+
+        self._num_workers = num_workers or fetcher.MAX_CONCURRENT_FETCH
+
+        self._queue = queue.Queue()
+        self._workers = []
+        self._running = False
+
+        self._mutex = threading.Lock()
+        self._results = {}  # per market, fetch duration or error
+
+    @property
+    def results(self):
+        return self._results
+
+    #
+    # checkpoints
+    #
+
+    def checkpoint_pathname(self, market_id):
+        return pathlib.Path(self._markets_path, self._fetcher.name, market_id, FetchScheduler.CHECKPOINT_FILE)
+
+    def load_checkpoints(self, market_id):
+        pathname = self.checkpoint_pathname(market_id)
+
+        if not pathname.is_file():
+            return {}
+
+        try:
+            with open(str(pathname), 'rt') as f:
+                return json.load(f)
+        except Exception as e:
+            logger.warning("Ignore invalid fetch checkpoint %s : %s" % (pathname, repr(e)))
+            return {}
+
+    def save_checkpoint(self, market_id, from_ts, last_ts, done):
+        """
+        @param from_ts Timestamp in ms of the beginning of the fetched range.
+        @param last_ts Timestamp in ms until the data are written.
+        """
+        pathname = self.checkpoint_pathname(market_id)
+
+        try:
+            if not pathname.parent.exists():
+                pathname.parent.mkdir(parents=True)
+
+            checkpoints = self.load_checkpoints(market_id)
+            checkpoints[str(int(self._timeframe))] = {'from': int(from_ts), 'last': int(last_ts), 'done': done}
+
+            tmpname = str(pathname) + '.tmp'
+            with open(tmpname, 'wt') as f:
+                json.dump(checkpoints, f)
+
+            os.replace(tmpname, str(pathname))
+        except Exception as e:
+            logger.error("Unable to save the fetch checkpoint of %s : %s" % (market_id, repr(e)))
+
+    def resume(self, market_id):
+        """
+        @return A tuple (from timestamp in ms of the covered range, date to fetch from), the date is None if the
+            range is already fetched.
+        """
+        if not self._from_date:
+            return None, self._from_date
+
+        from_ts = int(self._from_date.timestamp() * 1000)
+        to_ts = int((self._to_date.timestamp() if self._to_date else time.time()) * 1000)
+
+        checkpoint = self.load_checkpoints(market_id).get(str(int(self._timeframe)))
+
+        if not checkpoint or not (checkpoint['from'] <= from_ts <= checkpoint['last']):
+            # not contiguous to the checkpointed range
+            return from_ts, self._from_date
+
+        if checkpoint['done'] and checkpoint['last'] >= to_ts:
+            return checkpoint['from'], None
+
+        resume_ts = checkpoint['last'] * 0.001
+
+        if self._cascaded:
+            # from the beginning of the last candle of the largest generated timeframe
+            to_tfs = [tf for tf in self._fetcher.GENERATED_TF if self._timeframe < tf <= self._cascaded]
+            if to_tfs:
+                resume_ts = Instrument.basetime(to_tfs[-1], resume_ts)
+
+        return checkpoint['from'], datetime.fromtimestamp(max(from_ts * 0.001, resume_ts), tz=UTC())
+
+    #
+    # processing
+    #
+
+    def run(self, markets):
+        """
+        Fetch the markets and return once done, or on a keyboard interrupt (the current fetches are then abandoned
+        and will be resumed from their last checkpoint).
+        """
+        for market_id in markets:
+            self._queue.put(market_id)
+
+        self._running = True
+
+        for i in range(0, min(self._num_workers, len(markets))):
+            worker = threading.Thread(name="fetch-%i" % i, target=self.__work, daemon=True)
+            worker.start()
+
+            self._workers.append(worker)
+
+        try:
+            for worker in self._workers:
+                while worker.is_alive():
+                    worker.join(0.5)
+        except KeyboardInterrupt:
+            self._running = False
+
+        self._workers = []
+
+    def __work(self):
+        while self._running:
+            try:
+                market_id = self._queue.get_nowait()
+            except queue.Empty:
+                return
+
+            try:
+                self.fetch(market_id)
+            except Exception as e:
+                logger.error("Fetch of %s failed : %s" % (market_id, repr(e)))
+                error_logger.error(traceback.format_exc())
+
+                with self._mutex:
+                    self._results[market_id] = repr(e)
+
+    def fetch(self, market_id):
+        start = time.time()
+        covered_ts, from_date = self.resume(market_id)
+
+        if self._from_date and from_date is None:
+            logger.info("Fetch of %s already done" % market_id)
+
+            with self._mutex:
+                self._results[market_id] = 0.0
+
+            return
+
+        if from_date != self._from_date:
+            logger.info("Resume fetch of %s from %s" % (market_id, from_date.strftime('%Y-%m-%dT%H:%M:%S')))
+
+        def checkpoint(timestamp, done):
+            if covered_ts is not None:
+                self.save_checkpoint(market_id, covered_ts, timestamp, done)
+
+        self._fetcher.fetch_and_generate(market_id, self._timeframe, from_date, self._to_date, self._n_last,
+                self._fetch_option, self._cascaded, checkpoint)
+
+        with self._mutex:
+            self._results[market_id] = time.time() - start
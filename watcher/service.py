@@ -110,9 +110,8 @@ class WatcherService(Service):
 
         signal = Signal(Signal.SOURCE_WATCHER, source_name, signal_type, signal_data)
 
-        self._mutex.acquire()
+        # lock-free, the listeners of the notifier are copy-on-write
         self._notifier.notify(signal)
-        self._mutex.release()
 
     def find_author(self, watcher_name, author_id):
         watcher = self._watchers.get(watcher_name)
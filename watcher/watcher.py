@@ -4,6 +4,8 @@
 # watcher interface
 
 import time
+import heapq
+import threading
 import collections
 
 from datetime import datetime, timedelta
@@ -18,6 +20,7 @@ from database.database import Database
 
 from instrument.instrument import Instrument, Candle
 from instrument.candlegenerator import CandleGenerator
+from instrument.candleaggregator import CandleAggregator
 
 
 class Watcher(Runnable):
@@ -47,6 +50,8 @@ class Watcher(Runnable):
     # candles from 1m to 1 week
     GENERATED_TF = [60, 60*5, 60*15, 60*60, 60*60*4, 60*60*24, 60*60*24*7]
 
+    TICK_BATCH_DELAY = 0.010  # default max delay in second of accumulation of the incoming ticks, 0 to disable
+
     def __init__(self, name, service, watcher_type):
         super().__init__("wt-%s" % (name,))
 
@@ -66,10 +71,26 @@ class Watcher(Runnable):
         self._read_only = service.read_only  # no db storage in read-only mode
 
         self._last_tick = {}  # last tick per market id
-        self._last_ohlc = {}  # last ohlc per market id and then per timeframe
+        self._candle_aggregators = {}  # current ohlcs per market id, @see CandleAggregator
+
+        # timer wheel of the ohlcs to close, set of market id per next close timestamp
+        self._ohlc_timers = {}
+        self._ohlc_timers_heap = []
 
         self._last_market_update = time.time()
 
+        # per market id incoming ticks, trades to store and ohlc updates, accumulated before processing
+        self._tick_batches = {}
+        self._tick_batch_time = None  # timestamp of the oldest pending tick
+        self._tick_batch_mutex = threading.Lock()
+        self._tick_flush_mutex = threading.Lock()  # batches of a market are processed in order
+
+        self._tick_batch_delay = service.watcher_config(name).get('tick-batch-delay', Watcher.TICK_BATCH_DELAY)
+
+        # order book per market id, maintained and notified only if a depth is configured
+        self._order_books = {}
+        self._order_book_depth = service.watcher_config(name).get('order-book-depth', 0)
+
         # listen to its service
         self.service.add_listener(self)
 
@@ -126,14 +147,11 @@ class Watcher(Runnable):
         ltimeframes = set.union(set(Watcher.STORED_TIMEFRAMES), set(timeframes))
 
         for timeframe in ltimeframes:
-            if timeframe == Instrument.TF_TICK and market_id not in self._last_tick:
-                self._last_tick[market_id] = None
+            if timeframe == Instrument.TF_TICK:
+                if market_id not in self._last_tick:
+                    self._last_tick[market_id] = None
             else:
-                if market_id not in self._last_ohlc:
-                    self._last_ohlc[market_id] = {}
-
-                if timeframe not in self._last_ohlc[market_id]:
-                    self._last_ohlc[market_id][timeframe] = None
+                self.candle_aggregator(market_id).add_timeframe(timeframe)
 
     def configured_symbols(self):
         """
@@ -194,13 +212,27 @@ class Watcher(Runnable):
         """
         return False
 
+    def order_book(self, market_id):
+        """
+        Return the OrderBook of a market or None.
+        """
+        return self._order_books.get(market_id)
+
+    def notify_order_book(self, market_id):
+        """
+        Notify the configured depth of the order book of a market, if synced.
+        """
+        order_book = self.order_book(market_id)
+        if order_book is not None and order_book.synced:
+            self.service.notify(Signal.SIGNAL_ORDER_BOOK, self.name, order_book.top(self._order_book_depth))
+
     def current_ohlc(self, market_id, timeframe):
         """
         Return current OHLC for a specific market-id and timeframe or None.
         """
-        if market_id in self._last_ohlc:
-            if timeframe in self._last_ohlc[market_id]:
-                return self._last_ohlc[market_id][timeframe]
+        aggregator = self._candle_aggregators.get(market_id)
+        if aggregator:
+            return aggregator.candle(timeframe)
 
         return None
 
@@ -230,6 +262,7 @@ class Watcher(Runnable):
 
     def post_run(self):
         Terminal.inst().info("Joining watcher %s..." % self._name)
+        self.flush_ticks(True)
         self.disconnect()
 
     def post_update(self):
@@ -237,8 +270,9 @@ class Watcher(Runnable):
 
     def update(self):
         """
-        Nothing by default by you must call at least update_from_tick.
+        Process the expired batch of ticks, and by default nothing more but you must call at least update_from_tick.
         """
+        self.flush_ticks()
         return True
 
     @property
@@ -307,104 +341,183 @@ class Watcher(Runnable):
     # utils
     #
 
-    def update_ohlc(self, market_id, tf, ts, bid, ofr, volume):
+    def candle_aggregator(self, market_id):
+        """
+        Aggregator of the current ohlcs of a market, created for the stored timeframes if necessary.
+        """
+        aggregator = self._candle_aggregators.get(market_id)
+        if aggregator is None:
+            aggregator = self._candle_aggregators[market_id] = CandleAggregator(Watcher.STORED_TIMEFRAMES)
+
+        return aggregator
+
+    def schedule_ohlc_close(self, market_id, timestamp):
+        """
+        Add the market to the timer wheel, to close its ohlcs at timestamp if no update does it before.
+        """
+        if not (0 < timestamp < float('inf')):
+            return
+
+        markets = self._ohlc_timers.get(timestamp)
+        if markets is None:
+            markets = self._ohlc_timers[timestamp] = set()
+            heapq.heappush(self._ohlc_timers_heap, timestamp)
+
+        markets.add(market_id)
+
+    def update_ohlc(self, market_id, updates):
         """
-        Update the current OHLC or create a new one, and save them.
+        Update the current OHLCs of any timeframes of a market, and save the closed ones.
         @param market_id str Unique market identifier
-        @param tf float Timeframe (normalized timeframe at second)
-        @param ts float Timestamp of the update or of the tick/trade
-        @param bid float Bid price.
-        @param ofr float Offer/ask price.
-        @param volume float Volume transacted or 0 if unspecified.
-        """
-        ended_ohlc = None
-        ohlc = None
-
-        # last ohlc per market id
-        last_ohlc_by_timeframe = self._last_ohlc.get(market_id)
-        if last_ohlc_by_timeframe is None:
-            # not found for this market insert it
-            self._last_ohlc[market_id] = {tf: None}
-            last_ohlc_by_timeframe = self._last_ohlc[market_id]
-
-        if tf not in last_ohlc_by_timeframe:
-            last_ohlc_by_timeframe[tf] = None
-        else:
-            ohlc = last_ohlc_by_timeframe[tf]
+        @param updates List of tuples (timestamp, bid, ofr, volume) of the tick/trade or update, the bid, ofr and
+            volume can be None if unspecified.
+        @return A tuple (list of closed OHLCs, list of current OHLCs).
+        """
+        aggregator = self.candle_aggregator(market_id)
+        next_close = aggregator.next_close
 
-        if ohlc and ts >= ohlc.timestamp + tf:
-            # need to close the current ohlc
-            ohlc.set_consolidated(True)
-            ended_ohlc = ohlc
+        closed = aggregator.update(updates)
 
-            last_ohlc_by_timeframe[tf] = None
-            ohlc = None
+        if aggregator.next_close != next_close:
+            self.schedule_ohlc_close(market_id, aggregator.next_close)
 
-        if ohlc is None:
-            # open a new one if necessary
-            base_time = Instrument.basetime(tf, ts)
-            ohlc = Candle(base_time, tf)
+        self.store_closed_ohlcs(market_id, closed)
 
-            ohlc.set_consolidated(False)
+        return closed, aggregator.candles()
 
-            if bid:
-                ohlc.set_bid(bid)
-            if ofr:
-                ohlc.set_ofr(ofr)
+    def store_closed_ohlcs(self, market_id, ohlcs):
+        # stored timeframes only
+        if self._read_only:
+            return
 
-            last_ohlc_by_timeframe[tf] = ohlc
+        for ohlc in ohlcs:
+            if ohlc.timeframe in self.STORED_TIMEFRAMES:
+                Database.inst().store_market_ohlc((
+                    self.name, market_id, int(ohlc.timestamp*1000), ohlc.timeframe,
+                    ohlc.bid_open, ohlc.bid_high, ohlc.bid_low, ohlc.bid_close,
+                    ohlc.ofr_open, ohlc.ofr_high, ohlc.ofr_low, ohlc.ofr_close,
+                    ohlc.volume))
 
-        if ts >= ohlc.timestamp:
-            # update the current OHLC
-            if volume:
-                ohlc._volume += volume
+    #
+    # batch of ticks
+    #
 
-            if bid:
-                if not ohlc._bid_open:
-                    ohlc.set_bid(bid)
+    def push_tick(self, market_id, tick, trade=None, ohlc=True):
+        """
+        Add an incoming tick to the batch of its market.
+        @param tick Tuple (timestamp, bid, ofr, volume) notified in a SIGNAL_TICK_DATA_BULK.
+        @param trade Tuple to store, @see Database.store_market_trade, ignored in read-only mode.
+        @param ohlc If True the tick also updates the OHLCs of the stored timeframes.
+        """
+        self._tick_batch_mutex.acquire()
 
-                # update bid prices
-                ohlc._bid_high = max(ohlc._bid_high, bid)
-                ohlc._bid_low = min(ohlc._bid_low, bid)
+        batch = self._tick_batches.get(market_id)
+        if batch is None:
+            batch = self._tick_batches[market_id] = ([], [], [])
 
-                # potential close
-                ohlc._bid_close = bid
+        batch[0].append(tick)
 
-            if ofr:
-                if not ohlc.ofr_open:
-                    ohlc.set_ofr(ofr)
+        if trade is not None and not self._read_only:
+            batch[1].append(trade)
 
-                # update ofr prices
-                ohlc._ofr_high = max(ohlc._ofr_high, ofr)
-                ohlc._ofr_low = min(ohlc._ofr_low, ofr)
+        if ohlc:
+            batch[2].append(tick)
 
-                # potential close
-                ohlc._ofr_close = ofr
+        if self._tick_batch_time is None:
+            self._tick_batch_time = time.time()
 
-        # stored timeframes only
-        if ended_ohlc and (tf in self.STORED_TIMEFRAMES):
-            Database.inst().store_market_ohlc((
-                self.name, market_id, int(ended_ohlc.timestamp*1000), tf,
-                ended_ohlc.bid_open, ended_ohlc.bid_high, ended_ohlc.bid_low, ended_ohlc.bid_close,
-                ended_ohlc.ofr_open, ended_ohlc.ofr_high, ended_ohlc.ofr_low, ended_ohlc.ofr_close,
-                ended_ohlc.volume))
+        self._tick_batch_mutex.release()
+
+        self.flush_ticks()
+
+    def push_ohlc_update(self, market_id, timestamp, bid, ofr, volume):
+        """
+        Add to the batch of a market an update of its OHLCs without tick (as a quote update).
+        """
+        self._tick_batch_mutex.acquire()
+
+        batch = self._tick_batches.get(market_id)
+        if batch is None:
+            batch = self._tick_batches[market_id] = ([], [], [])
+
+        batch[2].append((timestamp, bid, ofr, volume))
+
+        if self._tick_batch_time is None:
+            self._tick_batch_time = time.time()
+
+        self._tick_batch_mutex.release()
+
+        self.flush_ticks()
+
+    def flush_ticks(self, force=False):
+        """
+        Once the batch delay is expired (or if force), process the batches of ticks : one signal of bulk ticks,
+        one storage of trades, and then the update of the OHLCs of each stored timeframe, per market.
+        """
+        if self._tick_batch_time is None or (not force and time.time() - self._tick_batch_time < self._tick_batch_delay):
+            # nothing to process yet
+            return
+
+        self._tick_flush_mutex.acquire()
+        self._tick_batch_mutex.acquire()
 
-        return ohlc
+        batches, self._tick_batches = self._tick_batches, {}
+        self._tick_batch_time = None
+
+        self._tick_batch_mutex.release()
+
+        try:
+            self.__process_tick_batches(batches)
+        finally:
+            self._tick_flush_mutex.release()
+
+    def __process_tick_batches(self, batches):
+        for market_id, (ticks, trades, updates) in batches.items():
+            if ticks:
+                # store for generation of OHLCs
+                self.lock()
+                self._last_tick[market_id] = ticks[-1]
+                self.unlock()
+
+                self.service.notify(Signal.SIGNAL_TICK_DATA_BULK, self.name, (market_id, Instrument.TF_TICK, ticks))
+
+            if trades:
+                Database.inst().store_market_trade(trades)
+
+            if updates:
+                # generate candles of any timeframes
+                self.lock()
+                closed, current = self.update_ohlc(market_id, updates)
+                self.unlock()
+
+                for candle in closed:
+                    self.service.notify(Signal.SIGNAL_CANDLE_DATA, self.name, (market_id, candle))
+
+                for candle in current:
+                    self.service.notify(Signal.SIGNAL_CANDLE_DATA, self.name, (market_id, candle))
 
     def update_from_tick(self):
         """
-        During update processing, update currently opened candles.
-        Then notify a signal if a ohlc is generated (and closed).
+        During update processing, close the ended OHLCs of the markets without recent update.
+        Then notify a signal per closed OHLC.
         """
-        for market_id in self._watched_instruments:
-            last_ohlc_by_timeframe = self._last_ohlc.get(market_id)
-            if not last_ohlc_by_timeframe:
-                continue
+        now = time.time()
+
+        while self._ohlc_timers_heap and self._ohlc_timers_heap[0] <= now:
+            timestamp = heapq.heappop(self._ohlc_timers_heap)
+
+            for market_id in self._ohlc_timers.pop(timestamp, ()):
+                aggregator = self._candle_aggregators.get(market_id)
+                if aggregator is None or aggregator.next_close > now:
+                    # already closed by an update, and rescheduled
+                    continue
+
+                closed = aggregator.roll(now)
+                self.schedule_ohlc_close(market_id, aggregator.next_close)
 
-            for tf, _ohlc in last_ohlc_by_timeframe.items():
-                # for closing candles, generate them
-                ohlc = self.update_ohlc(market_id, tf, time.time(), None, None, None)
-                if ohlc:
+                self.store_closed_ohlcs(market_id, closed)
+
+                for ohlc in closed:
                     self.service.notify(Signal.SIGNAL_CANDLE_DATA, self.name, (market_id, ohlc))
 
     def fetch_and_generate(self, market_id, timeframe, n_last=1, cascaded=None):
@@ -418,8 +531,7 @@ class Watcher(Runnable):
         generators = []
         from_tf = timeframe
 
-        if not market_id in self._last_ohlc:
-            self._last_ohlc[market_id] = {}
+        last_ohlc = {}  # last ohlc per timeframe
 
         # compute a from date
         today = datetime.now().astimezone(UTC())
@@ -466,7 +578,7 @@ class Watcher(Runnable):
             last_ohlcs[timeframe].append(candle)
 
             # only the last
-            self._last_ohlc[market_id][timeframe] = candle
+            last_ohlc[timeframe] = candle
 
             # generate higher candles
             for generator in generators:
@@ -479,19 +591,24 @@ class Watcher(Runnable):
                     last_ohlcs[generator.to_tf].extend(candles)
 
                     # only the last as current
-                    self._last_ohlc[market_id][generator.to_tf] = candles[-1]
+                    last_ohlc[generator.to_tf] = candles[-1]
 
                 elif generator.current:
-                    self._last_ohlc[market_id][generator.to_tf] = generator.current
+                    last_ohlc[generator.to_tf] = generator.current
 
                 # remove consumed candles
                 last_ohlcs[generator.from_tf] = []
 
             n += 1
 
-        for k, ohlc in self._last_ohlc[market_id].items():
+        aggregator = self.candle_aggregator(market_id)
+
+        for tf, ohlc in last_ohlc.items():
             if ohlc:
                 ohlc.set_consolidated(False)
+                aggregator.set_candle(ohlc)
+
+        self.schedule_ohlc_close(market_id, aggregator.next_close)
 
     def fetch_candles(self, market_id, timeframe, from_date=None, to_date=None, n_last=None):
         """